@@ -0,0 +1,166 @@
+""" Benchmark cases. Every case takes a size parameter and returns the optimum it found,
+    so a comparison catches encodings which got faster by getting wrong """
+import os
+import re
+import subprocess
+import sys
+import typing as T
+
+import numpy as np
+
+from cognition.entity_parsing import entity_block
+from cognition.resource_analysis import patches
+from factory_theory.factory import Factory
+from factory_theory.primitives import SOL, IntVal, Belt, no_intersections, SegmentedBelt, non_intersecting_seg_belts
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Case:
+    def __init__(self, name: str, run: T.Callable[[int, int], T.Any], sizes: T.List[int], quick: T.List[int],
+                 doc: str = ''):
+        """ run(size, seed) returns the optimum, sizes - all sizes the case makes sense for,
+            quick - ones for the default run and the stored baseline """
+        self.name = name
+        self.run = run
+        self.sizes = sizes
+        self.quick = quick
+        self.doc = doc or (run.__doc__ or '').strip()
+
+
+def _shrink(sz: IntVal, init: T.Optional[int] = None) -> int:
+    sizes = list(SOL.shrinker_loop(sz, init=init, restore=False))
+    return sizes[-1] if sizes else None
+
+
+def three_belts(size: int, seed: int):
+    """ TestDemoTasks.test_three_belts: three point belts crossing if drawn straight, ends at size apart """
+    SOL.fresh_solver()
+    belts = [Belt() for _ in range(3)]
+    for k, b1 in enumerate(belts):
+        for b2 in belts[k + 1:]:
+            SOL.add(no_intersections(b1, b2))
+    belts[0].fix_ends((0, 0), (size, size))
+    belts[1].fix_ends((0, size // 2), (size, size // 2))
+    belts[2].fix_ends((0, size), (size, 0))
+    sz = IntVal()
+    SOL.add(sz.v == sum(b.belt_len for b in belts))
+    return _shrink(sz, init=38 * size // 4)  # the test starts from 38 at size 4
+
+
+def three_seg_belts(size: int, seed: int, max_segs=None, bounded=False):
+    """ TestDemoTasks.test_three_seg_belts: segmented belts crossing if drawn straight, number of segments minimized """
+    SOL.fresh_solver()
+    belts = [SegmentedBelt(max_segs=max_segs, bounded=bounded) for _ in range(3)]
+    for k, b1 in enumerate(belts):
+        for b2 in belts[k + 1:]:
+            SOL.add(non_intersecting_seg_belts(b1, b2))
+    belts[0].fix_ends((0, 0), (size, size))
+    belts[1].fix_ends((0, size // 2), (size, size // 2))
+    belts[2].fix_ends((0, size), (size, 0))
+    sz = IntVal()
+    SOL.add(sz.v == sum(b.num_segs for b in belts))
+    return _shrink(sz, init=38)
+
+
+def three_bounded_seg_belts(size: int, seed: int):
+    """ TestDemoTasks.test_three_bounded_seg_belts: quantifier free encoding with up to 5 segments per belt """
+    return three_seg_belts(size, seed, max_segs=5, bounded=True)
+
+
+def _minimize(f: Factory, metric):
+    f.sol.on_probe = lambda probe: None
+    res = f.finalize_and_model(minimize_metric=metric)
+    return None if res is None else res[1]
+
+
+def production_line(size: int, seed: int):
+    """ Single ProductionLine of size machines with one input, area minimized """
+    f = Factory()
+    f.new_production_line(num_machines=size, machine_size=3, num_inputs=1, color='g')
+    return _minimize(f, f.area.size.x + f.area.size.y)
+
+
+def production_lines(size: int, seed: int):
+    """ TestDemoTasks.test_production_line_stacking scaled: size lines of 4 machines chained output to input """
+    f = Factory()
+    lines = [f.new_production_line(num_machines=4, machine_size=3, num_inputs=1 if k else 0, auto_output=not k)
+             for k in range(size)]
+    for pl1, pl2 in zip(lines, lines[1:]):
+        f.connect_with_inserter(pl1.output(), pl2.input(0))
+    return _minimize(f, f.area.size.x + f.area.size.y)
+
+
+def machines_on_belt(size: int, seed: int):
+    """ TestDemoTasks.test_factory_minification scaled: three stages of size machines linked by two belts """
+    f = Factory()
+    stages = [[f.new_machine(c) for _ in range(size)] for c in 'bgr']
+    belts = [f.new_segmented_belt() for _ in range(2)]
+    for b in belts:
+        f.add(b.num_segs <= 1)
+    for m in stages[0]:
+        f.connect_with_inserter(m, belts[0])
+    for m in stages[1]:
+        f.connect_with_inserter(belts[0], m)
+        f.connect_with_inserter(m, belts[1])
+    for m in stages[2]:
+        f.connect_with_inserter(belts[1], m)
+    return _minimize(f, f.area.size.x + f.area.size.y)
+
+
+def ore_patch(size: int, seed: int) -> np.ndarray:
+    """ Round patch of radius size with ragged border and 2% holes in its outer half, as find_entities_columns
+        returns it """
+    rnd = np.random.default_rng(seed)
+    xs, ys = np.mgrid[-size:size + 1, -size:size + 1].reshape(2, -1)
+    d = (xs ** 2 + ys ** 2) / size ** 2
+    keep = (d <= 1 - 0.3 * rnd.random(len(xs))) & ((d < 0.25) | (rnd.random(len(xs)) >= 0.02))
+    ents = np.empty(keep.sum(), dtype=[('x', float), ('y', float), ('amount', int), ('name', 'U16')])
+    ents['x'], ents['y'] = xs[keep] + 0.5, ys[keep] + 0.5
+    ents['amount'] = rnd.integers(100, 1000, len(ents))
+    ents['name'] = 'iron-ore'
+    return ents
+
+
+def ore_block(size: int, seed: int):
+    """ cognition.entity_block on a patch of radius size (over 100k tiles from 200 on), area of the block """
+    b = entity_block(ore_patch(size, seed), 'iron-ore')
+    return (b.p2.x - b.p1.x + 1) * (b.p2.y - b.p1.y + 1)
+
+
+def resource_patches(size: int, seed: int):
+    """ cognition.resource_analysis.patches on a patch of radius size and four of radius size // 3 around it,
+        number of patches of at least 10 tiles """
+    parts = [ore_patch(size, seed)]
+    for k, (dx, dy) in enumerate([(3, 0), (-3, 0), (0, 3), (0, -3)]):
+        p = ore_patch(size // 3, seed + k + 1)
+        p['x'] += dx * size
+        p['y'] += dy * size
+        p['name'] = 'coal' if k % 2 else 'copper-ore'
+        parts.append(p)
+    return len(patches(np.concatenate(parts), min_tiles=10))
+
+
+def logistics(script: str) -> T.Callable[[int, int], T.Any]:
+    def run(size: int, seed: int):
+        """ Standalone experiments/{script}.py on a SZ x SZ grid, number of belts minimized """
+        code = (f'import runpy, z3; z3.set_param("smt.random_seed", {seed}); z3.set_param("sat.random_seed", {seed}); '
+                f'runpy.run_path({script + ".py"!r}, run_name="__main__")')
+        out = subprocess.run([sys.executable, '-c', code], cwd=os.path.join(ROOT, 'experiments'),
+                             env=dict(os.environ, SZ=str(size)), capture_output=True, text=True, check=True).stdout
+        belts = re.findall(r'^belts: (\d+)', out, re.M)
+        return int(belts[-1]) if belts else None
+    run.__doc__ = run.__doc__.format(script=script)
+    return run
+
+
+CASES = {c.name: c for c in [
+    Case('three_belts', three_belts, sizes=[4, 6], quick=[]),  # minutes already at size 4
+    Case('three_seg_belts', three_seg_belts, sizes=[10, 20, 40], quick=[20]),  # size 10 is the slow one, 2 minutes
+    Case('three_bounded_seg_belts', three_bounded_seg_belts, sizes=[10, 20, 40], quick=[10, 20]),
+    Case('production_line', production_line, sizes=[2, 4, 6, 8, 10], quick=[2, 4, 6]),
+    Case('production_lines', production_lines, sizes=[2, 3, 4], quick=[2]),
+    Case('machines_on_belt', machines_on_belt, sizes=[1, 2, 3], quick=[1]),  # size 2 takes over a minute
+    Case('ore_block', ore_block, sizes=[50, 200, 400], quick=[200]),
+    Case('resource_patches', resource_patches, sizes=[50, 200, 400], quick=[200]),
+] + [Case(name, logistics(name), sizes=[4, 5, 6, 7], quick=[4, 5]) for name in ('logistics4', 'logistics4_2', 'logistics5')]}
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+""" Benchmark suite runner. Every measurement runs in a fresh interpreter with fixed z3 seeds,
+    generated variable names (and so z3 search) don't depend on what ran before.
+
+    python -m benchmarks.run                          quick sizes of all cases, compared to the stored baseline
+    python -m benchmarks.run production_line --sizes 2 4 8 10 --repeats 5
+    python -m benchmarks.run --all-sizes -o results.json
+    python -m benchmarks.run --save-baseline          re-record benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import typing as T
+from time import time
+
+import z3
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def measure(case: str, size: int, seed: int, timeout: float) -> dict:
+    """ Single run in a subprocess, {'value', 'elapsed'} or {'error'} """
+    cmd = [sys.executable, '-m', 'benchmarks.run', '--single', case, str(size), str(seed)]
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    except subprocess.TimeoutExpired:
+        return {'error': 'timeout'}
+    if out.returncode != 0:
+        return {'error': out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f'exit {out.returncode}'}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _single(case: str, size: int, seed: int):
+    """ Runs in the measuring subprocess, prints result as the last line """
+    from benchmarks.cases import CASES
+    z3.set_param('smt.random_seed', seed)
+    z3.set_param('sat.random_seed', seed)
+    devnull = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, devnull  # binary_shrinking and friends print progress
+    try:
+        t0 = time()
+        value = CASES[case].run(size, seed)
+        elapsed = time() - t0
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    print(json.dumps({'value': value, 'elapsed': elapsed}))
+
+
+def run_suite(cases: T.List[str], sizes: T.Optional[T.List[int]], all_sizes: bool, repeats: int, seed: int,
+              timeout: float, log=print) -> dict:
+    from benchmarks.cases import CASES
+    results = {}
+    for name in cases:
+        case = CASES[name]
+        for size in sizes or (case.sizes if all_sizes else case.quick):
+            runs = [measure(name, size, seed, timeout) for _ in range(repeats)]
+            errors = [r['error'] for r in runs if 'error' in r]
+            times = [r['elapsed'] for r in runs if 'error' not in r]
+            entry = {'times': times, 'value': next((r['value'] for r in runs if 'error' not in r), None)}
+            if times:
+                entry.update(median=statistics.median(times), min=min(times))
+            if errors:
+                entry['errors'] = errors
+            results.setdefault(name, {})[str(size)] = entry
+            log(f'{name:<26}{size:>6}{entry["value"] if entry["value"] is not None else "-":>8}'
+                f'{entry.get("median", float("nan")):>10.2f}{entry.get("min", float("nan")):>10.2f}'
+                + (f'  {", ".join(sorted(set(errors)))}' if errors else ''))
+    return {'meta': {'python': platform.python_version(), 'z3': z3.get_version_string(), 'seed': seed,
+                     'repeats': repeats, 'machine': platform.machine()},
+            'results': results}
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 1.5, min_delta: float = 0.2) -> T.List[str]:
+    """ Regressions of current results against baseline: optimum changed, new errors,
+        or median time over tolerance times the baseline (differences under min_delta seconds are noise) """
+    problems = []
+    for name, sizes in current['results'].items():
+        for size, cur in sizes.items():
+            base = baseline['results'].get(name, {}).get(size)
+            if base is None:
+                continue
+            label = f'{name}[{size}]'
+            if cur.get('errors') and not base.get('errors'):
+                problems.append(f'{label}: {", ".join(sorted(set(cur["errors"])))}')
+            if cur['value'] is not None and base['value'] is not None and cur['value'] != base['value']:
+                problems.append(f'{label}: optimum {cur["value"]}, baseline {base["value"]}')
+            if 'median' in cur and 'median' in base and \
+                    cur['median'] > tolerance * base['median'] and cur['median'] - base['median'] > min_delta:
+                problems.append(f'{label}: {cur["median"]:.2f}s, baseline {base["median"]:.2f}s '
+                                f'({cur["median"] / base["median"]:.1f}x)')
+    return problems
+
+
+def main():
+    from benchmarks.cases import CASES
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cases', nargs='*', help=f'some of {", ".join(CASES)}, all by default')
+    parser.add_argument('--sizes', type=int, nargs='+', help='sizes instead of the quick ones of each case')
+    parser.add_argument('--all-sizes', action='store_true', help='every size a case defines')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0, help='z3 random seed')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds per run')
+    parser.add_argument('-o', '--output', help='write results as json')
+    parser.add_argument('--baseline', default=BASELINE, help='results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='write results to --baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed slowdown factor of median time')
+    parser.add_argument('--single', nargs=3, metavar=('CASE', 'SIZE', 'SEED'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        case, size, seed = args.single
+        return _single(case, int(size), int(seed))
+
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f'unknown cases {", ".join(sorted(unknown))}')
+
+    print(f'{"case":<26}{"size":>6}{"optimum":>8}{"median,s":>10}{"min,s":>10}')
+    results = run_suite(args.cases or list(CASES), args.sizes, args.all_sizes, args.repeats, args.seed, args.timeout)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+        return
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), tolerance=args.tolerance)
+        for p in problems:
+            print('REGRESSION', p)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
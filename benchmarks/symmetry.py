@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+""" Solving time with and without symmetry breaking (SubFactory.break_symmetries).
+    Run from the repository root: python -m benchmarks.symmetry [--repeats N] [case ...] """
+import argparse
+import statistics
+from time import time
+
+from factory_theory.factory import Factory
+from factory_theory.primitives import IntVal
+
+
+def minification(f: Factory):
+    """ Same task as TestDemoTasks.test_factory_minification: three stages of two machines linked by belts """
+    n = 2
+    stages = [[f.new_machine(c) for _ in range(n)] for c in 'bgr']
+    belts = [f.new_segmented_belt() for _ in range(2)]
+    metric = IntVal()
+    f.add(metric.v == f.area.size.x + f.area.size.y)
+
+    areas = [f.new_area(None, None, color=c, opacity=0.2) for c in ('blue', 'green', 'red')]
+    for a1, a2 in f._forall_commutative_pairs(areas):
+        f.add(a1.non_intersecting(a2))
+    for b in belts:
+        f.add(b.num_segs <= 1)
+
+    for stage, area in zip(stages, areas):
+        for m in stage:
+            f.add(m.inside(area))
+    for m in stages[0]:
+        f.connect_with_inserter(m, belts[0])
+    for m in stages[1]:
+        f.connect_with_inserter(belts[0], m)
+        f.connect_with_inserter(m, belts[1])
+    for m in stages[2]:
+        f.connect_with_inserter(belts[1], m)
+    return metric
+
+
+def fan_in(f: Factory, n=6):
+    """ n identical machines feeding a single straight belt with fixed ends """
+    b = f.new_segmented_belt(max_segs=1, bounded=True)
+    b.fix_ends((0, 0), (4 * n, 0))
+    for _ in range(n):
+        f.connect_with_inserter(f.new_machine('g'), b)
+    return f.area.size.x + f.area.size.y
+
+
+def star(f: Factory, n=6):
+    """ n identical machines around a hub machine, each connected to the hub by an inserter """
+    hub = f.new_machine('r')
+    for _ in range(n):
+        f.connect_with_inserter(f.new_machine('g'), hub)
+    return f.area.size.x + f.area.size.y
+
+
+CASES = {'minification': minification, 'fan_in': fan_in, 'star': star}
+
+
+def run(case: str, symmetries: bool):
+    f = Factory()
+    f.break_symmetries = symmetries
+    metric = CASES[case](f)
+    f.sol.on_probe = lambda probe: None
+    t0 = time()
+    _, value = f.finalize_and_model(metric)
+    return value, time() - t0, len(f.sol.probes), [len(c) for c in f.symmetry_classes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('cases', nargs='*', help=f'some of {", ".join(CASES)}, all by default')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f'unknown cases {", ".join(sorted(unknown))}')
+
+    print(f'{"case":<14}{"symmetries":<12}{"metric":>8}{"probes":>8}{"median, s":>12}{"min, s":>10}  classes')
+    for case in args.cases or list(CASES):
+        for symmetries in (False, True):
+            runs = [run(case, symmetries) for _ in range(args.repeats)]
+            times = [t for _, t, _, _ in runs]
+            value, _, probes, classes = runs[0]
+            print(f'{case:<14}{str(symmetries):<12}{value:>8}{probes:>8}'
+                  f'{statistics.median(times):>12.2f}{min(times):>10.2f}  {classes}')
+
+
+if __name__ == '__main__':
+    main()
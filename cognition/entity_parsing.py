@@ -1,56 +1,74 @@
+import typing as T
+
 import numpy as np
 
 from factory_theory.primitives import Point2D, Segment
 
 
+def _tiles(entities, name):
+    """ Integer positions and amounts of entities with name """
+    if isinstance(entities, np.ndarray):
+        sel = entities[entities['name'] == name]
+        return np.stack([sel['x'], sel['y']], axis=1).astype(int), sel['amount']
+    sel = [e for e in entities if e['name'] == name]
+    coords = np.array([(int(e['position']['x']), int(e['position']['y'])) for e in sel], dtype=int).reshape(-1, 2)
+    return coords, np.array([e['amount'] for e in sel])
+
+
 def entity_block(entities, name):
-    enmap = {}
-    coords = []
-    amounts = []
+    """ Rectangle fully covered by entities with name grown from their amount weighted center:
+        every round each side in turn (left, right, top, bottom) moves out by one if the tiles next to it are covered.
+        entities - dicts from SmartCommunicator.find_entities or structured array from find_entities_columns """
+    coords, amounts = _tiles(entities, name)
 
-    for e in entities:
-        if e['name'] == name:
-            pos = int(e['position']['x']), int(e['position']['y'])
-            coords.append(pos)
-            amounts.append(e['amount'])
+    center = np.sum(coords * amounts.reshape(-1, 1), axis=0) / np.sum(amounts)
+    cx, cy = int(center[0]), int(center[1])
 
-            enmap[pos] = e['amount']
+    # occupancy raster with empty margin of one tile, so the block never grows past it
+    ox, oy = coords.min(axis=0) - 1
+    w, h = coords.max(axis=0) - (ox, oy) + 2
+    grid = np.zeros((h, w), dtype=np.int32)
+    grid[coords[:, 1] - oy, coords[:, 0] - ox] = 1
 
-    coords = np.array(coords)
-    amounts = np.array(amounts)
+    x1, y1, x2, y2 = grow_rectangle(summed_area(grid), cx - ox, cy - oy)
+    return Segment(Point2D(int(x1 + ox), int(y1 + oy)), Point2D(int(x2 + ox), int(y2 + oy)))
 
-    center = np.sum(coords * amounts.reshape(-1, 1), axis=0) / np.sum(amounts)
-    pc = Point2D(int(center[0]), int(center[1]))
-    block = Segment(pc, pc)
 
-    def fully_occupied(s: Segment):
-        for p in s.enumerate_points():
-            if (p.x, p.y) not in enmap:
-                return False
-        return True
+def summed_area(grid: np.ndarray) -> np.ndarray:
+    """ sat[y, x] - sum of grid above and left of (x, y), one row and column longer than grid """
+    sat = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.int64)
+    sat[1:, 1:] = grid.cumsum(0).cumsum(1)
+    return sat
 
+
+def grow_rectangle(sat: np.ndarray, x: int, y: int) -> T.Tuple[int, int, int, int]:
+    """ Greedy growth of entity_block on 0/1 grid given by its summed area table, starting from cell (x, y).
+        Grid must have an empty border. Returns x1, y1, x2, y2 including ends """
+    def fully_occupied(x1, y1, x2, y2):
+        x2, y2 = x2 + 1, y2 + 1
+        return sat[y2, x2] - sat[y1, x2] - sat[y2, x1] + sat[y1, x1] == (x2 - x1) * (y2 - y1)
+
+    x1, y1, x2, y2 = x, y, x, y
     while True:
         enlarged = False
 
-        if fully_occupied(block.left_neigh()):
-            block.p1 = block.p1.left()
+        if fully_occupied(x1 - 1, y1, x1 - 1, y2):
+            x1 -= 1
             enlarged = True
 
-        if fully_occupied(block.right_neigh()):
-            block.p2 = block.p2.right()
+        if fully_occupied(x2 + 1, y1, x2 + 1, y2):
+            x2 += 1
             enlarged = True
 
-        if fully_occupied(block.top_neigh()):
-            block.p1 = block.p1.top()
+        if fully_occupied(x1, y1 - 1, x2, y1 - 1):
+            y1 -= 1
             enlarged = True
 
-        if fully_occupied(block.bottom_neigh()):
-            block.p2 = block.p2.bottom()
+        if fully_occupied(x1, y2 + 1, x2, y2 + 1):
+            y2 += 1
             enlarged = True
 
         if not enlarged:
             break
 
-    return block
-
-
+    return x1, y1, x2, y2
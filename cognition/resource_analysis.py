@@ -0,0 +1,150 @@
+""" Resource patches of a scanned map: connected components of tiles of every resource, labelled with vectorized
+    union-find, and their statistics as a structured array, one record per patch """
+import typing as T
+
+import numpy as np
+
+from cognition.entity_parsing import grow_rectangle, summed_area
+
+PATCH_DTYPE = np.dtype([
+    ('name', 'U64'),
+    ('tiles', np.int64), ('amount', np.int64),
+    ('x_min', np.int64), ('y_min', np.int64), ('x_max', np.int64), ('y_max', np.int64),  # bounding box, ends included
+    ('cx', np.float64), ('cy', np.float64),  # amount weighted center
+    # fully covered rectangle grown by entity_block rules from the patch tile nearest to the center
+    ('rect_x1', np.int64), ('rect_y1', np.int64), ('rect_x2', np.int64), ('rect_y2', np.int64),
+    ('rect_tiles', np.int64), ('rect_amount', np.int64),
+])
+
+
+class Tiles(T.NamedTuple):
+    """ Resource tiles as columns, one row per tile """
+    x: np.ndarray
+    y: np.ndarray
+    amount: np.ndarray
+    name: np.ndarray  # index into names
+    names: np.ndarray
+
+
+def tiles(entities, type: T.Optional[str] = None) -> Tiles:
+    """ Integer tiles of entities (dicts of SmartCommunicator.find_entities or structured array of
+        find_entities_columns), positions floored as map_scanner.chunk_of does. Entities on the same tile are merged.
+        type filters dicts, structured arrays carry no type (filter them in find_entities_columns) """
+    if isinstance(entities, np.ndarray):
+        x, y = np.floor(entities['x']).astype(np.int64), np.floor(entities['y']).astype(np.int64)
+        amount, name = entities['amount'].astype(np.int64), entities['name']
+    else:
+        entities = [e for e in entities if type is None or e.get('type') == type]
+        x = np.floor([e['position']['x'] for e in entities]).astype(np.int64).reshape(-1)
+        y = np.floor([e['position']['y'] for e in entities]).astype(np.int64).reshape(-1)
+        amount = np.array([e.get('amount', 0) for e in entities], dtype=np.int64)
+        name = np.array([e['name'] for e in entities], dtype='U64')
+    names, name = np.unique(name, return_inverse=True)
+    key = _key(x, y, name)
+    key, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    amount = np.bincount(inverse.ravel(), weights=amount, minlength=len(key)).astype(np.int64)
+    return Tiles(x[first], y[first], amount, name[first], names)
+
+
+_SHIFT = 2 ** 21  # coordinates within +-2^20 of the origin, far beyond any explored map
+
+
+def _key(x, y, name):
+    return (name.astype(np.int64) * _SHIFT + (y + _SHIFT // 2)) * _SHIFT + (x + _SHIFT // 2)
+
+
+def label(t: Tiles, connectivity: int = 4) -> np.ndarray:
+    """ Patch index of every tile, tiles of one resource touching by sides (connectivity=4) or also
+        by corners (8) share a patch. Patches are numbered in order of their first tile """
+    assert connectivity in (4, 8)
+    n = len(t.x)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    key = _key(t.x, t.y, t.name)
+    if np.all(key[1:] > key[:-1]):  # as tiles returns them
+        order, sorted_keys = np.arange(n), key
+    else:
+        order = np.argsort(key)
+        sorted_keys = key[order]
+    offsets = [(1, 0), (0, 1)] + ([(1, 1), (1, -1)] if connectivity == 8 else [])
+    edges_i, edges_j = [], []
+    for dx, dy in offsets:
+        nk = _key(t.x + dx, t.y + dy, t.name)
+        pos = np.minimum(np.searchsorted(sorted_keys, nk), n - 1)
+        found = sorted_keys[pos] == nk
+        edges_i.append(np.nonzero(found)[0])
+        edges_j.append(order[pos[found]])
+    i, j = np.concatenate(edges_i), np.concatenate(edges_j)
+
+    # hook roots to the smallest neighbouring root, then compress paths fully, until edges are inside components.
+    # Every round at least halves the number of components which can still merge
+    parent = np.arange(n)
+    while True:
+        pi, pj = parent[i], parent[j]
+        differ = pi != pj
+        if not differ.any():
+            break
+        lo, hi = np.minimum(pi[differ], pj[differ]), np.maximum(pi[differ], pj[differ])
+        np.minimum.at(parent, hi, lo)
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    # roots are the smallest tiles of their components
+    roots = parent == np.arange(n)
+    return (np.cumsum(roots) - 1)[parent]
+
+
+def patches(entities, connectivity: int = 4, min_tiles: int = 1, type: T.Optional[str] = None) -> np.ndarray:
+    """ Records with PATCH_DTYPE of all resource patches, biggest amount first """
+    t = entities if isinstance(entities, Tiles) else tiles(entities, type)
+    if len(t.x) == 0:
+        return np.empty(0, dtype=PATCH_DTYPE)
+    labels = label(t, connectivity)
+    num = labels.max() + 1
+
+    res = np.zeros(num, dtype=PATCH_DTYPE)
+    res['tiles'] = np.bincount(labels, minlength=num)
+    res['amount'] = np.bincount(labels, weights=t.amount, minlength=num)
+    first = np.full(num, len(labels))
+    np.minimum.at(first, labels, np.arange(len(labels)))
+    res['name'] = t.names[t.name[first]]
+    for f, v, op in (('x_min', t.x, np.minimum), ('y_min', t.y, np.minimum),
+                     ('x_max', t.x, np.maximum), ('y_max', t.y, np.maximum)):
+        res[f] = v[first]
+        op.at(res[f], labels, v)
+    w = np.where(res['amount'][labels] > 0, t.amount, 1).astype(np.float64)  # plain mean without amounts
+    w_sum = np.bincount(labels, weights=w, minlength=num)
+    res['cx'] = np.bincount(labels, weights=t.x * w, minlength=num) / w_sum
+    res['cy'] = np.bincount(labels, weights=t.y * w, minlength=num) / w_sum
+
+    # single tiles are their own rectangles, bigger patches are rastered in their bounding boxes,
+    # tiles of a patch are contiguous after sorting by label
+    single = res['tiles'] == 1
+    res['rect_x1'] = res['rect_x2'] = np.where(single, res['x_min'], 0)
+    res['rect_y1'] = res['rect_y2'] = np.where(single, res['y_min'], 0)
+    res['rect_tiles'] = single
+    res['rect_amount'] = np.where(single, res['amount'], 0)
+    order = np.argsort(labels, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(res['tiles'])])
+    for p in np.nonzero(~single & (res['tiles'] >= min_tiles))[0]:
+        idx = order[bounds[p]:bounds[p + 1]]
+        _mining_rect(res[p:p + 1], t.x[idx], t.y[idx], t.amount[idx])
+
+    res = res[res['tiles'] >= min_tiles]
+    return res[np.argsort(-res['amount'], kind='stable')]
+
+
+def _mining_rect(rec: np.ndarray, x: np.ndarray, y: np.ndarray, amount: np.ndarray):
+    ox, oy = rec['x_min'][0] - 1, rec['y_min'][0] - 1  # empty margin of one tile
+    grid = np.zeros((rec['y_max'][0] - oy + 2, rec['x_max'][0] - ox + 2), dtype=np.int64)
+    grid[y - oy, x - ox] = 1
+    sat = summed_area(grid)
+    k = np.argmin((x - rec['cx'][0]) ** 2 + (y - rec['cy'][0]) ** 2)
+    x1, y1, x2, y2 = grow_rectangle(sat, x[k] - ox, y[k] - oy)
+    grid[y - oy, x - ox] = amount
+    amounts = summed_area(grid)
+    rec['rect_x1'], rec['rect_y1'], rec['rect_x2'], rec['rect_y2'] = x1 + ox, y1 + oy, x2 + ox, y2 + oy
+    rec['rect_tiles'] = (x2 - x1 + 1) * (y2 - y1 + 1)
+    rec['rect_amount'] = amounts[y2 + 1, x2 + 1] - amounts[y1, x2 + 1] - amounts[y2 + 1, x1] + amounts[y1, x1]
@@ -24,25 +24,29 @@ class BasePoint2D:
 
         return resx and resy
 
+    def derived(self, x, y):
+        """ Point of the same kind at other coordinates """
+        return self.__class__(x, y)
+
     def __add__(self, disp: tuple):
         assert isinstance(disp, tuple)
-        return self.__class__(self.x + disp[0], self.y + disp[1])
+        return self.derived(self.x + disp[0], self.y + disp[1])
 
     def __sub__(self, disp: tuple):
         assert isinstance(disp, tuple)
-        return self.__class__(self.x - disp[0], self.y - disp[1])
+        return self.derived(self.x - disp[0], self.y - disp[1])
 
     def right(self):
-        return self.__class__(self.x + 1, self.y)
+        return self.derived(self.x + 1, self.y)
 
     def left(self):
-        return self.__class__(self.x - 1, self.y)
+        return self.derived(self.x - 1, self.y)
 
     def top(self):
-        return self.__class__(self.x, self.y - 1)
+        return self.derived(self.x, self.y - 1)
 
     def bottom(self):
-        return self.__class__(self.x, self.y + 1)
+        return self.derived(self.x, self.y + 1)
 
     def as_tuple(self):
         return self.x, self.y
@@ -85,17 +89,17 @@ class BaseSegment:
 
     def left_neigh(self):
         p = self.p1.left()
-        return self.__class__(p, p.__class__(p.x, self.p2.y))
+        return self.__class__(p, p.derived(p.x, self.p2.y))
 
     def right_neigh(self):
         p = self.p2.right()
-        return self.__class__(p.__class__(p.x, self.p1.y), p)
+        return self.__class__(p.derived(p.x, self.p1.y), p)
 
     def top_neigh(self):
         p = self.p1.top()
-        return self.__class__(p, p.__class__(self.p2.x, p.y))
+        return self.__class__(p, p.derived(self.p2.x, p.y))
 
     def bottom_neigh(self):
         p = self.p2.bottom()
-        return self.__class__(p.__class__(self.p1.x, p.y), p)
+        return self.__class__(p.derived(self.p1.x, p.y), p)
 
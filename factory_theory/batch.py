@@ -0,0 +1,187 @@
+""" Batch solving of many factory layouts in a process pool with a persistent result store.
+
+    A spec is a json friendly dict:
+        {'name': 'optional label', 'builder': 'module:function', 'params': {...}}
+    builder(f: Factory, **params) populates a fresh Factory and returns metric to minimize (or None).
+    Specs are identified by a hash of builder and params, already stored ones are skipped on rerun.
+
+    Usage: python -m factory_theory.batch specs.json layouts.db [--workers N] [--timeout S] [--memory MB]
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import multiprocessing as mp
+import os
+import queue
+import sqlite3
+import typing as T
+import zlib
+from time import time, sleep
+
+# Results which are not going to change on rerun
+FINAL_STATUSES = ('solved', 'unsat')
+
+
+def spec_key(spec: dict) -> str:
+    canonical = json.dumps({'builder': spec['builder'], 'params': spec.get('params', {})}, sort_keys=True)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+class LayoutStore:
+    """ sqlite backed storage of solved layouts, layouts are kept as zlib compressed json """
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS layouts ('
+                        'key TEXT PRIMARY KEY, name TEXT, status TEXT, metric TEXT, solve_time REAL, layout BLOB)')
+        self.db.commit()
+
+    def put(self, key: str, name: str, status: str, metric=None, solve_time: float = None, layout: dict = None):
+        blob = zlib.compress(json.dumps(layout, separators=(',', ':')).encode()) if layout is not None else None
+        self.db.execute('INSERT OR REPLACE INTO layouts VALUES (?, ?, ?, ?, ?, ?)',
+                        (key, name, status, json.dumps(metric), solve_time, blob))
+        self.db.commit()
+
+    def get(self, key: str) -> T.Optional[dict]:
+        row = self.db.execute('SELECT name, status, metric, solve_time, layout FROM layouts WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        name, status, metric, solve_time, blob = row
+        return {'name': name, 'status': status, 'metric': json.loads(metric), 'solve_time': solve_time,
+                'layout': json.loads(zlib.decompress(blob)) if blob is not None else None}
+
+    def is_final(self, key: str) -> bool:
+        row = self.db.execute('SELECT status FROM layouts WHERE key = ?', (key,)).fetchone()
+        return row is not None and row[0] in FINAL_STATUSES
+
+    def keys(self) -> T.List[str]:
+        return [r[0] for r in self.db.execute('SELECT key FROM layouts')]
+
+    def close(self):
+        self.db.close()
+
+
+def _load_builder(path: str) -> T.Callable:
+    module, func = path.split(':')
+    return getattr(importlib.import_module(module), func)
+
+
+def _limit_memory(memory_limit_mb: T.Optional[int]):
+    if memory_limit_mb is None:
+        return
+    import resource
+    import z3
+    limit = memory_limit_mb * 2 ** 20
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    z3.set_param('memory_max_size', memory_limit_mb)
+
+
+def _solve_job(key: str, spec: dict, memory_limit_mb: T.Optional[int], results):
+    try:
+        _limit_memory(memory_limit_mb)
+        from factory_theory.factory import Factory
+        from factory_theory.layout import extract_layout
+
+        t0 = time()
+        f = Factory()
+        metric = _load_builder(spec['builder'])(f, **spec.get('params', {}))
+        res = f.finalize_and_model(minimize_metric=metric)
+        dt = time() - t0
+        if res is None:
+            results.put((key, 'unsat', None, dt, None))
+        else:
+            results.put((key, 'solved', res[1], dt, extract_layout(f)))
+    except MemoryError:
+        results.put((key, 'memory', None, None, None))
+    except Exception as e:
+        results.put((key, f'error: {e!r}', None, None, None))
+
+
+def run_batch(specs: T.List[dict], store: LayoutStore, workers: T.Optional[int] = None,
+              timeout: T.Optional[float] = None, memory_limit_mb: T.Optional[int] = None,
+              start_method: str = 'spawn') -> T.Dict[str, str]:
+    """ Solves specs not yet in the store, each in its own process, at most `workers` at once.
+        Jobs exceeding timeout (seconds) are killed. Returns {spec key: status}, 'cached' for skipped ones """
+    workers = workers or os.cpu_count()
+    mpc = mp.get_context(start_method)
+    results = mpc.Queue()
+
+    statuses = {}
+    todo = []
+    for spec in specs:
+        key = spec_key(spec)
+        if key in statuses:
+            continue
+        if store.is_final(key):
+            statuses[key] = 'cached'
+        else:
+            statuses[key] = None
+            todo.append((key, spec))
+    names = {key: spec.get('name', spec['builder']) for key, spec in todo}
+
+    running = {}  # key -> (process, start time)
+
+    def collect(block: float):
+        """ Stores all queued results, waiting up to block seconds for the first one.
+            Results of jobs which are no longer running (timed out meanwhile) are dropped """
+        while True:
+            try:
+                key, status, metric, dt, layout = results.get(timeout=block) if block else results.get_nowait()
+            except queue.Empty:
+                return
+            block = 0
+            job = running.pop(key, None)
+            if job is None:
+                continue
+            store.put(key, names[key], status, metric, dt, layout)
+            statuses[key] = status
+            job[0].join()
+
+    while todo or running:
+        while todo and len(running) < workers:
+            key, spec = todo.pop(0)
+            proc = mpc.Process(target=_solve_job, args=(key, spec, memory_limit_mb, results), daemon=True)
+            proc.start()
+            running[key] = (proc, time())
+
+        collect(0.05)
+
+        for key, (proc, t0) in list(running.items()):
+            if not proc.is_alive():
+                if proc.exitcode != 0:
+                    sleep(0.05)  # give a chance to result sent right before exit
+                    collect(0)
+                    if key in running:
+                        running.pop(key)
+                        statuses[key] = f'crashed: exit code {proc.exitcode}'
+                        store.put(key, names[key], statuses[key])
+            elif timeout is not None and time() - t0 > timeout:
+                proc.terminate()
+                proc.join()
+                running.pop(key)
+                statuses[key] = 'timeout'
+                store.put(key, names[key], 'timeout', solve_time=time() - t0)
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Solve a batch of factory layout specs')
+    parser.add_argument('specs', help='json file with list of specs')
+    parser.add_argument('store', help='sqlite file for solved layouts')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--timeout', type=float, default=None, help='per job, seconds')
+    parser.add_argument('--memory', type=int, default=None, help='per job, megabytes')
+    args = parser.parse_args()
+
+    with open(args.specs) as f:
+        specs = json.load(f)
+    store = LayoutStore(args.store)
+    statuses = run_batch(specs, store, workers=args.workers, timeout=args.timeout, memory_limit_mb=args.memory)
+    for key, status in statuses.items():
+        print(key[:12], status)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+""" Interval bounds of integer terms derived from asserted linear atoms, and bounding boxes of entities built on them.
+    Used to skip non-intersection constraints between entities which can never meet """
+import math
+import typing as T
+
+import z3
+
+from factory_theory import primitives as P
+
+Interval = T.Tuple[float, float]  # ints or +-inf
+Box = T.Tuple[float, float, float, float]  # x_lo, x_hi, y_lo, y_hi
+
+UNBOUNDED: Interval = (-math.inf, math.inf)
+UNBOUNDED_BOX: Box = UNBOUNDED + UNBOUNDED
+
+_CMP = {z3.Z3_OP_LE, z3.Z3_OP_LT, z3.Z3_OP_GE, z3.Z3_OP_GT, z3.Z3_OP_EQ}
+
+
+def _linear(e: z3.ArithRef) -> T.Optional[T.Tuple[T.Dict[int, T.Tuple[int, z3.ExprRef]], int]]:
+    """ Decomposes e into ({term id: (coefficient, term)}, constant).
+        Terms are uninterpreted constants and applications or opaque non linear subterms """
+    if z3.is_int_value(e):
+        return {}, e.as_long()
+    if not z3.is_arith(e) or not e.is_int():
+        return None
+    k = e.decl().kind() if z3.is_app(e) else None
+    if k in (z3.Z3_OP_ADD, z3.Z3_OP_SUB, z3.Z3_OP_UMINUS):
+        terms, const = {}, 0
+        for pos, arg in enumerate(e.children()):
+            sign = -1 if k == z3.Z3_OP_UMINUS or k == z3.Z3_OP_SUB and pos > 0 else 1
+            sub = _linear(arg)
+            if sub is None:
+                return None
+            for tid, (c, t) in sub[0].items():
+                c0 = terms.get(tid, (0, t))[0]
+                terms[tid] = (c0 + sign * c, t)
+            const += sign * sub[1]
+        return {tid: ct for tid, ct in terms.items() if ct[0] != 0}, const
+    if k == z3.Z3_OP_MUL and e.num_args() == 2:
+        a, b = e.children()
+        if z3.is_int_value(b):
+            a, b = b, a
+        if z3.is_int_value(a):
+            sub = _linear(b)
+            if sub is None:
+                return None
+            c = a.as_long()
+            return {tid: (c * c1, t) for tid, (c1, t) in sub[0].items()}, c * sub[1]
+    return {e.get_id(): (1, e)}, 0
+
+
+def _scale(c: int, i: Interval) -> Interval:
+    lo, hi = c * i[0], c * i[1]
+    return (lo, hi) if c > 0 else (hi, lo)
+
+
+def _add(i1: Interval, i2: Interval) -> Interval:
+    return i1[0] + i2[0], i1[1] + i2[1]
+
+
+def _meet(i1: Interval, i2: Interval) -> Interval:
+    return max(i1[0], i2[0]), min(i1[1], i2[1])
+
+
+class Bounds:
+    """ Interval bounds of terms propagated from top level linear atoms of given assertions """
+    def __init__(self, assertions: T.Iterable[z3.BoolRef], max_rounds: int = 20):
+        self.bounds: T.Dict[int, Interval] = {}
+        self._terms: T.Dict[int, z3.ExprRef] = {}
+        self.max_rounds = max_rounds
+
+        atoms = []
+        todo = list(assertions)
+        while todo:
+            a = todo.pop()
+            if z3.is_and(a):
+                todo.extend(a.children())
+            elif z3.is_app(a) and a.decl().kind() in _CMP and z3.is_arith(a.arg(0)):
+                atoms.append(a)
+        self._propagate(atoms)
+
+    def _constraints(self, atoms) -> T.List[T.Tuple[T.Dict[int, T.Tuple[int, z3.ExprRef]], int]]:
+        """ Atoms as linear forms `sum(c * t) + const <= 0` """
+        res = []
+        for a in atoms:
+            lhs, rhs = _linear(a.arg(0)), _linear(a.arg(1))
+            if lhs is None or rhs is None:
+                continue
+            terms = dict(lhs[0])
+            for tid, (c, t) in rhs[0].items():
+                terms[tid] = (terms.get(tid, (0, t))[0] - c, t)
+            terms = {tid: ct for tid, ct in terms.items() if ct[0] != 0}
+            const = lhs[1] - rhs[1]
+            neg = ({tid: (-c, t) for tid, (c, t) in terms.items()}, -const)
+            k = a.decl().kind()
+            if k == z3.Z3_OP_LE:
+                res.append((terms, const))
+            elif k == z3.Z3_OP_LT:
+                res.append((terms, const + 1))
+            elif k == z3.Z3_OP_GE:
+                res.append(neg)
+            elif k == z3.Z3_OP_GT:
+                res.append((neg[0], neg[1] + 1))
+            else:
+                res.extend([(terms, const), neg])
+        return res
+
+    def _propagate(self, atoms):
+        substituted = set()
+        for _ in range(self.max_rounds):
+            constraints = self._constraints(atoms)
+            for _ in range(self.max_rounds):
+                if not any([self._tighten(terms, const) for terms, const in constraints]):
+                    break
+
+            # terms like belt_x(num_segs) become plain once the index is known, so fixed constants are substituted
+            fixed = [(t, z3.IntVal(int(lo), ctx=t.ctx)) for t, (lo, hi) in self._fixed_consts() if t.get_id() not in substituted]
+            if not fixed:
+                break
+            substituted.update(t.get_id() for t, _ in fixed)
+            atoms = [z3.simplify(z3.substitute(a, *fixed)) for a in atoms]
+            atoms = [a for a in atoms if z3.is_app(a) and a.decl().kind() in _CMP]
+
+    def _fixed_consts(self):
+        for tid, (lo, hi) in list(self.bounds.items()):
+            t = self._terms[tid]
+            if lo == hi and z3.is_const(t):
+                yield t, (lo, hi)
+
+    def _tighten(self, terms, const) -> bool:
+        """ One propagation step over `sum(c * t) + const <= 0`, returns whether any bound changed """
+        parts = {tid: _scale(c, self.term(t)) for tid, (c, t) in terms.items()}
+        changed = False
+        for tid, (c, t) in terms.items():
+            self._terms[tid] = t
+            others_lo = const + sum(p[0] for oid, p in parts.items() if oid != tid)
+            if others_lo == math.inf or others_lo == -math.inf:
+                continue
+            # c * t <= -others_lo
+            limit = -others_lo
+            old = self.term(t)
+            new = (old[0], math.floor(limit / c)) if c > 0 else (math.ceil(limit / c), old[1])
+            new = _meet(old, new)
+            if new != old:
+                self.bounds[tid] = new
+                changed = True
+        return changed
+
+    def term(self, t: z3.ExprRef) -> Interval:
+        """ Bounds of a single term, opaque ite terms are bounded by their branches """
+        res = self.bounds.get(t.get_id(), UNBOUNDED)
+        if z3.is_app_of(t, z3.Z3_OP_ITE):
+            a, b = self.expr(t.arg(1)), self.expr(t.arg(2))
+            res = _meet(res, (min(a[0], b[0]), max(a[1], b[1])))
+        return res
+
+    def expr(self, e: T.Union[int, z3.ArithRef]) -> Interval:
+        """ Bounds of a linear expression """
+        if isinstance(e, int):
+            return e, e
+        lin = _linear(z3.simplify(e))
+        if lin is None:
+            return UNBOUNDED
+        res = (lin[1], lin[1])
+        for c, t in lin[0].values():
+            res = _add(res, _scale(c, self.term(t)))
+        return res
+
+    # Entities
+    def point_box(self, p: P.Point2D) -> Box:
+        return self.expr(p.x) + self.expr(p.y)
+
+    def rect_box(self, r: P.Rectangle) -> Box:
+        ds = r.to_diag_seg()
+        return self.expr(ds.p1.x)[0], self.expr(ds.p2.x)[1], self.expr(ds.p1.y)[0], self.expr(ds.p2.y)[1]
+
+    def belt_box(self, b: P.SegmentedBelt) -> Box:
+        """ Hull of the corners which may be in use """
+        max_segs = self.expr(b.num_segs)[1]
+        if b.max_segs is not None:
+            max_segs = min(max_segs, b.max_segs)
+        if max_segs == math.inf:
+            return UNBOUNDED_BOX
+        boxes = [self.point_box(b.corner(k)) for k in range(int(max_segs) + 1)]
+        return (min(bx[0] for bx in boxes), max(bx[1] for bx in boxes),
+                min(bx[2] for bx in boxes), max(bx[3] for bx in boxes))
+
+    def belt_len_lower(self, b: P.SegmentedBelt) -> float:
+        """ Lower bound of b.len(), a belt takes at least Manhattan distance between its ends plus one cells """
+        s, t = self.point_box(b.source()), self.point_box(b.sink())
+        dx = max(0, s[0] - t[1], t[0] - s[1])
+        dy = max(0, s[2] - t[3], t[2] - s[3])
+        return dx + dy + 1
+
+
+def min_perimeter(cx: float, cy: float, w_lo: int, h_lo: int, area: int) -> float:
+    """ Minimum of cx * w + cy * h (cx, cy > 0) over integer sides w >= w_lo, h >= h_lo holding at least area cells """
+    w_lo, h_lo = max(1, w_lo), max(1, h_lo)
+    w_hi = max(w_lo, -(-area // h_lo))  # wider rectangles only grow the sum
+    return min(cx * w + cy * max(h_lo, -(-area // w)) for w in range(w_lo, w_hi + 1))
+
+
+def boxes_overlap(b1: Box, b2: Box) -> bool:
+    return b1[0] <= b2[1] and b2[0] <= b1[1] and b1[2] <= b2[3] and b2[2] <= b1[3]
+
+
+def overlapping_pairs(boxes1: T.List[Box], boxes2: T.Optional[T.List[Box]] = None) -> T.List[T.Tuple[int, int]]:
+    """ Index pairs (i, j) of boxes which may overlap, found by a sweep along x.
+        Without boxes2 pairs within boxes1 with i < j are returned """
+    same = boxes2 is None
+    if same:
+        boxes2 = boxes1
+    events = sorted([(b[0], 0, i) for i, b in enumerate(boxes1)] + [(b[0], 1, j) for j, b in enumerate(boxes2)])
+    active: T.List[T.List[int]] = [[], []]
+    res = set()
+    for x, side, idx in events:
+        if same and side == 1:
+            continue
+        box = (boxes1 if side == 0 else boxes2)[idx]
+        other_side = 0 if same else 1 - side
+        others = boxes1 if other_side == 0 else boxes2
+        still = []
+        for o in active[other_side]:
+            if others[o][1] < x:
+                continue  # ended before the sweep line
+            still.append(o)
+            if boxes_overlap(box, others[o]):
+                pair = (idx, o) if side == 0 else (o, idx)
+                res.add(tuple(sorted(pair)) if same else pair)
+        active[other_side] = still
+        active[side].append(idx)
+    return sorted(res)
@@ -1,45 +1,161 @@
+import collections
+import math
 from time import time
 import typing as T
 
+from factory_theory import placement as PL
+from factory_theory import portfolio as PF
 from factory_theory import primitives as P
-from factory_theory.subfactory import SubFactory
-from factory_theory.production_line import ProductionLine
+from factory_theory import solution_cache as SC
+from factory_theory.solver_wrapper import _objective
+from factory_theory.subfactory import SubFactory, WarmStartError
+from factory_theory.production_line import ProductionLine, ProductionLineTemplate, TemplatedProductionLine
 
 
 class Factory(SubFactory):
     """ Factory object for creating and managing all stuff on the map """
-    def __init__(self):
-        super().__init__()
+    def __init__(self, sol: T.Optional[P.SolverWrapper] = None, hierarchical=False, workers: T.Optional[int] = None):
+        """ sol - solver to build the factory in, by default the global one (P.SOL) is reset and used.
+            Factories with distinct solvers (see SolverWrapper.isolated) can be built and solved concurrently.
+            hierarchical - production lines are solved independently (in parallel, by up to `workers` threads)
+            into fixed footprints, the factory itself only places footprints and routes between them """
+        if sol is None:
+            P.SOL.fresh_solver()
+        super().__init__(sol=sol)
         self.production_lines = []
+        self.hierarchical = hierarchical
+        self.workers = workers
 
         self.elapsed_time: T.Optional[float] = None
-        P.SOL.fresh_solver()
+        self.metric_bounds: T.Tuple[int, T.Optional[int]] = (0, None)
 
     def new_production_line(self, num_machines: int, machine_size: int,
-                            num_inputs: int, auto_output=False, color='gray'):
-        pl = ProductionLine(num_machines=num_machines, machine_size=machine_size,
-                            num_inputs=num_inputs, auto_output=auto_output, color=color)
+                            num_inputs: int, auto_output=False, color='gray', templated=False):
+        """ templated - place a precomputed layout as a rigid block instead of solving the line's internals here """
+        if templated or self.hierarchical:
+            pl = TemplatedProductionLine(num_machines=num_machines, machine_size=machine_size,
+                                         num_inputs=num_inputs, auto_output=auto_output, color=color,
+                                         lazy=self.hierarchical, sol=self.sol)
+        else:
+            pl = ProductionLine(num_machines=num_machines, machine_size=machine_size,
+                                num_inputs=num_inputs, auto_output=auto_output, color=color, sol=self.sol)
 
         self.production_lines.append(pl)
         self.buildings.append(pl.area)
 
         return pl
 
+    def _prior_entities(self, layout: dict) -> T.List[tuple]:
+        res = super()._prior_entities(layout)
+        for pl, sub in zip(self.production_lines, layout.get('production_lines', [])):
+            if not isinstance(pl, TemplatedProductionLine):  # templated lines are placed by their area only
+                res += pl._prior_entities(sub)
+        return res
+
     def finalize(self):
+        lazy = [pl for pl in self.production_lines if isinstance(pl, TemplatedProductionLine) and pl.template is None]
+        if lazy:
+            templates = ProductionLineTemplate.solve_all([pl.key for pl in lazy], workers=self.workers)
+            for pl in lazy:
+                pl.bind(templates[pl.key])
+
         for pl in self.production_lines:
             pl.finalize()
 
         super().finalize()
 
-    def finalize_and_model(self, minimize_metric=None):
-        """ Adds final constraints and solves for model """
-        self.finalize()
+    def placement_bound(self, metric, placement: T.Optional[PL.Placement] = None) -> T.Optional[int]:
+        """ Value of metric attainable with buildings at positions of a heuristic placement
+            (greedy_placement by default) and the area shrunk around them. Checked by the solver,
+            None if the placement can't be completed (e.g. belts don't fit) """
+        assert self.finalized
+        if placement is None:
+            placement = self.greedy_placement()
+            if placement is None:
+                return None
+        x, y, w, h = placement.bbox()
+        self.sol.push()
+        try:
+            for b, pos in zip(self.buildings, placement.positions):
+                self.add(b.pos == pos)
+            self.add(self.area.pos == (x, y))
+            self.add(self.area.size == (w, h))
+            direction, expr = _objective(metric)
+            if direction != 'min' or self.sol.model() is None:
+                return None
+            return self.sol.eval(expr)
+        finally:
+            self.sol.pop()
 
-        t0 = time()
-        metric = None
+    def derive_bounds(self, metric, lower: T.Union[None, int, str] = 'auto',
+                      upper: T.Union[None, int, str] = 'auto') -> T.Tuple[int, T.Optional[int]]:
+        """ Bounds for minimization of metric, 'auto' derives them:
+            lower by metric_lower_bound (never below 0, where the search starts by default),
+            upper by placement_bound ('placement' for this one only), falling back to metric_upper_bound """
+        if _objective(metric)[0] != 'min':
+            return lower if isinstance(lower, int) else 0, upper if isinstance(upper, int) else None
+
+        if lower is None:
+            lower = 0
+        elif lower == 'auto':
+            lb = self.metric_lower_bound(metric)
+            lower = max(0, math.ceil(lb)) if lb != -math.inf else 0
+
+        if upper in ('auto', 'placement'):
+            ub = self.placement_bound(metric)
+            if ub is None and upper == 'auto':
+                ub = self.metric_upper_bound(metric)
+                ub = None if ub == math.inf else int(ub)
+            upper = ub
+        return lower, upper
+
+    def search_report(self) -> str:
+        """ Bounds the last minimization started from and probes it took """
+        lower, upper = self.metric_bounds
+        results = collections.Counter(p.result for p in self.sol.probes)
+        details = ', '.join(f'{n} {r}' for r, n in sorted(results.items()))
+        return f'metric bounds [{lower}, {upper}], {len(self.sol.probes)} probes' + (f' ({details})' if details else '')
+
+    def finalize_and_model(self, minimize_metric=None, priority='lex', cache: T.Optional[SC.SolutionCache] = None,
+                           lower: T.Union[None, int, str] = None, upper: T.Union[None, int, str] = None):
+        """ Adds final constraints and solves for model.
+            minimize_metric may be a single metric or list of objectives, see SolverWrapper.minimize.
+            With cache, a problem solved before (up to generated names) is restored without solving.
+            lower, upper - bounds of the (first) metric to start the search from, lower must hold
+            and upper be attainable, 'auto' derives them (see derive_bounds) """
+        with self.sol.span('finalize'):
+            self.finalize()
+
+        self.metric_bounds = (0, None)  # nothing to bound without a metric
         if minimize_metric is not None:
-            metric = P.SOL.binary_shrinking(minimize_metric, 0, None)
-        m = P.SOL.model()
+            metric = minimize_metric[0] if isinstance(minimize_metric, list) else minimize_metric
+            with self.sol.span('bounds'):
+                self.metric_bounds = self.derive_bounds(metric, lower, upper)
+        lower, upper = self.metric_bounds
+
+        # after bounds: heuristic placement ignores the ordering, the optimum is kept anyway
+        objectives = [] if minimize_metric is None else \
+            [_objective(m)[1] for m in (minimize_metric if isinstance(minimize_metric, list) else [minimize_metric])]
+        for sub in [self] + self.production_lines:
+            if sub.break_symmetries:
+                with self.sol.span('symmetries'):
+                    sub.add_symmetry_breaking(objectives)
+
+        t0 = time()
+        if cache is None:
+            m, metric = self._solve(minimize_metric, priority, lower, upper)
+        else:
+            assertions = list(self.sol.assertions())
+            key, names = SC.problem_key(assertions, minimize_metric, priority)
+            hit = cache.get(key)
+            if hit is None:
+                m, metric = self._solve(minimize_metric, priority, lower, upper)
+                if self.sol.proven:  # results cut by a timeout may differ on the next run
+                    cache.put(key, metric, SC.dump_model(m, names) if m else None)
+            else:
+                metric, text = hit
+                m = SC.load_model(text, names, PF.collect_decls(assertions), self.sol.ctx) if text else None
+                self.sol.use_model(m)
         self.elapsed_time = time() - t0
 
         if m:
@@ -47,4 +163,20 @@ class Factory(SubFactory):
             for pl in self.production_lines:
                 pl.postprocess()
             return m, metric
+        if self.warm_pinned and self.sol.proven:
+            raise WarmStartError(f'no layout with {self.warm_pinned} entities pinned by warm_start, '
+                                 'try a larger radius')
+
+    def _solve(self, minimize_metric, priority, lower=0, upper=None):
+        with self.sol.span('solve'):
+            self.sol.proven = True
+            if minimize_metric is None:
+                return self.sol.model(), None
+            metric = self.sol.minimize(minimize_metric, priority=priority, lower=lower, upper=upper)
+            found = self.sol.last_model()
+            m = self.sol.model()
+            if m is None and metric is not None:  # check timed out, the model minimize() found still holds
+                m = found
+                self.sol.use_model(m)
+            return m, metric
 
@@ -0,0 +1,145 @@
+""" Where solving time goes: constraints by origin, per check timing with z3 statistics, probes of minimization
+    and named spans (finalize, solve, ...). Enabled per solver with SolverWrapper.instrument(),
+    exported as JSON or as Chrome trace (chrome://tracing, Perfetto) """
+import contextlib
+import json
+import sys
+import typing as T
+from time import perf_counter
+
+import z3
+
+_FORWARDERS = {'SolverWrapper.add', 'SubFactory.add'}
+
+
+def origin() -> str:
+    """ Qualified name of the function which added a constraint, skipping plain forwarders like SubFactory.add """
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        name = getattr(code, 'co_qualname', code.co_name).split('.<locals>')[0]
+        if name == '<module>':
+            return frame.f_globals.get('__name__', name)
+        if code.co_filename != __file__ and name not in _FORWARDERS and not name.startswith('<'):
+            return name
+        frame = frame.f_back
+    return '<unknown>'
+
+
+def expr_size(e: z3.ExprRef) -> T.Tuple[int, int]:
+    """ Number of distinct nodes and quantifiers of expression """
+    seen, todo = set(), [e]
+    quantifiers = 0
+    while todo:
+        e = todo.pop()
+        if e.get_id() in seen:
+            continue
+        seen.add(e.get_id())
+        if z3.is_quantifier(e):
+            quantifiers += 1
+            todo.append(e.body())
+        elif z3.is_app(e):
+            todo.extend(e.children())
+    return len(seen), quantifiers
+
+
+def statistics(sol) -> T.Dict[str, T.Union[int, float]]:
+    """ z3 statistics of the last check as a dict (conflicts, decisions, memory, ...) """
+    try:
+        st = sol.statistics()
+    except z3.Z3Exception:
+        return {}
+    return {k: st.get_key_value(k) for k in st.keys()}
+
+
+class Instrumentation:
+    def __init__(self):
+        self.t0 = perf_counter()
+        # origin -> {'constraints', 'nodes', 'quantifiers'}
+        self.origins: T.Dict[str, T.Dict[str, int]] = {}
+        self.checks: T.List[dict] = []  # {'start', 'elapsed', 'result', 'assumptions', 'statistics'}
+        self.spans: T.List[dict] = []  # {'name', 'start', 'elapsed'}
+        self.probes: T.List[dict] = []
+
+    def now(self) -> float:
+        return perf_counter() - self.t0
+
+    def constraints(self, exprs: T.Iterable):
+        """ Counts constraints under the name of the function adding them """
+        stats = self.origins.setdefault(origin(), {'constraints': 0, 'nodes': 0, 'quantifiers': 0})
+        todo = list(exprs)
+        while todo:
+            e = todo.pop()
+            if isinstance(e, (list, tuple)):
+                todo.extend(e)
+                continue
+            stats['constraints'] += 1
+            if isinstance(e, z3.ExprRef):
+                nodes, quantifiers = expr_size(e)
+                stats['nodes'] += nodes
+                stats['quantifiers'] += quantifiers
+
+    def check(self, start: float, result, assumptions: int, sol):
+        self.checks.append({'start': start, 'elapsed': self.now() - start, 'result': str(result),
+                            'assumptions': assumptions, 'statistics': statistics(sol)})
+
+    def probe(self, probe):
+        self.probes.append(dict(probe._asdict(), time=self.now()))
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.spans.append({'name': name, 'start': start, 'elapsed': self.now() - start})
+
+    # Export
+    def summary(self) -> dict:
+        return {'constraints': sum(o['constraints'] for o in self.origins.values()),
+                'quantifiers': sum(o['quantifiers'] for o in self.origins.values()),
+                'checks': len(self.checks),
+                'check_time': sum(c['elapsed'] for c in self.checks),
+                'probes': len(self.probes)}
+
+    def to_json(self) -> dict:
+        return {'summary': self.summary(), 'origins': self.origins, 'checks': self.checks,
+                'spans': self.spans, 'probes': self.probes}
+
+    def chrome_trace(self) -> dict:
+        """ Trace Event Format: spans and checks as complete events, probes as instants,
+            constraint origins go to metadata """
+        def us(t):
+            return round(t * 1e6)
+
+        events = []
+        for s in self.spans:
+            events.append({'name': s['name'], 'cat': 'span', 'ph': 'X', 'ts': us(s['start']), 'dur': us(s['elapsed']),
+                           'pid': 0, 'tid': 0})
+        for k, c in enumerate(self.checks):
+            events.append({'name': f'check {c["result"]}', 'cat': 'check', 'ph': 'X', 'ts': us(c['start']),
+                           'dur': us(c['elapsed']), 'pid': 0, 'tid': 1,
+                           'args': dict(c['statistics'], index=k, assumptions=c['assumptions'])})
+        for p in self.probes:
+            events.append({'name': f'probe {p["result"]}', 'cat': 'probe', 'ph': 'i', 's': 't', 'ts': us(p['time']),
+                           'pid': 0, 'tid': 1, 'args': {k: v for k, v in p.items() if k != 'time'}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'metadata': {'summary': self.summary(), 'origins': self.origins}}
+
+    def save_json(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=1)
+
+    def save_chrome_trace(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def report(self, top: int = 10) -> str:
+        """ Human readable summary, origins sorted by number of nodes they contributed """
+        s = self.summary()
+        lines = [f'{s["constraints"]} constraints ({s["quantifiers"]} quantifiers), '
+                 f'{s["checks"]} checks in {s["check_time"]:.3f}s, {s["probes"]} probes']
+        by_nodes = sorted(self.origins.items(), key=lambda kv: -kv[1]['nodes'])
+        for name, o in by_nodes[:top]:
+            lines.append(f'  {name}: {o["constraints"]} constraints, {o["nodes"]} nodes, {o["quantifiers"]} quantifiers')
+        return '\n'.join(lines)
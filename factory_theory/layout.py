@@ -0,0 +1,49 @@
+""" Plain (json friendly) representation of a solved factory layout """
+import typing as T
+
+from factory_theory import primitives as P
+from factory_theory.subfactory import SubFactory
+
+
+def _rect(r: P.Rectangle) -> T.List[int]:
+    x, y = r.pos.eval_as_tuple()
+    w, h = r.size.eval_as_tuple()
+    return [x, y, w, h]
+
+
+def _inserter(ins: P.Inserter) -> T.List:
+    x, y = ins.pos.eval_as_tuple()
+    return [x, y, str(ins.dir.eval()), ins.arm_len.eval()]
+
+
+def extract_subfactory(f: SubFactory) -> dict:
+    """ Positions of all entities of a solved subfactory.
+        Rectangles are [x, y, w, h], inserters [x, y, dir, arm_len], belts lists of corners """
+    assert f.finalized
+    return {'area': _rect(f.area),
+            'buildings': [_rect(b) for b in f.buildings],
+            'inserters': [_inserter(ins) for ins in f.inserters],
+            'belts': [[list(c) for c in sb.eval_corners()] for sb in f.segmented_belts],
+            'areas': [_rect(a) for a in f.areas]}
+
+
+def extract_layout(f) -> dict:
+    """ Layout of a solved Factory including its production lines """
+    layout = extract_subfactory(f)
+    layout['production_lines'] = [extract_subfactory(pl) for pl in getattr(f, 'production_lines', [])]
+    return layout
+
+
+def occupied_cells(layout: dict) -> T.Set[T.Tuple[int, int]]:
+    """ Cells taken by buildings, inserters and belts of a layout and its production lines """
+    cells = set()
+    for sub in [layout] + layout.get('production_lines', []):
+        for x, y, w, h in sub['buildings']:
+            cells.update((x + i, y + j) for i in range(w) for j in range(h))
+        for x, y, *_ in sub['inserters']:
+            cells.add((x, y))
+        for corners in sub['belts']:
+            for (x1, y1), (x2, y2) in zip(corners, corners[1:]):
+                cells.update((x, y) for x in range(min(x1, x2), max(x1, x2) + 1)
+                             for y in range(min(y1, y2), max(y1, y2) + 1))
+    return cells
@@ -0,0 +1,147 @@
+""" Constructive placement of rectangles on an occupancy bitmap: greedy bottom-left fill whose order
+    is improved by simulated annealing. Takes milliseconds where SMT search takes minutes, the result
+    is a layout on its own or a feasible bound for the minimization (see Factory.placement_bound) """
+import math
+import random
+import typing as T
+
+import numpy as np
+
+Size = T.Tuple[int, int]
+Pos = T.Tuple[int, int]
+Net = T.Tuple[int, int]  # indices of rectangles to be kept close, e.g. connected by inserters
+
+
+class Placement(T.NamedTuple):
+    positions: T.List[Pos]
+    width: int  # of bounding box of placed rectangles
+    height: int
+    wire: float  # sum of Manhattan distances between centers of connected rectangles
+    cost: float  # width + height + wire_weight * wire
+
+    def bbox(self) -> T.Tuple[int, int, int, int]:
+        """ x, y, width, height """
+        return min(x for x, _ in self.positions), min(y for _, y in self.positions), self.width, self.height
+
+
+def _window_sums(grid: np.ndarray, w: int, h: int) -> np.ndarray:
+    """ Sums of grid over all w x h windows via summed area table, indexed [y, x] of window corner """
+    sat = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.int32)
+    sat[1:, 1:] = grid.cumsum(0).cumsum(1)
+    return sat[h:, w:] - sat[:-h, w:] - sat[h:, :-w] + sat[:-h, :-w]
+
+
+def _wire(positions: T.List[Pos], sizes: T.List[Size], nets: T.List[Net]) -> float:
+    total = 0.
+    for i, j in nets:
+        (x1, y1), (w1, h1) = positions[i], sizes[i]
+        (x2, y2), (w2, h2) = positions[j], sizes[j]
+        total += abs(x1 + w1 / 2 - x2 - w2 / 2) + abs(y1 + h1 / 2 - y2 - h2 / 2)
+    return total
+
+
+def place(sizes: T.List[Size], nets: T.Iterable[Net] = (), fixed: T.Optional[T.Dict[int, Pos]] = None,
+          order: T.Optional[T.List[int]] = None, gap: int = 1, wire_weight: float = 0.5) -> Placement:
+    """ Places rectangles of sizes one by one in order (by default biggest first), fixed ones go to their positions.
+        Every rectangle takes the free position minimizing growth of the bounding box plus wire_weight times
+        distance to already placed neighbours, ties go to the bottom-left. At least gap cells separate rectangles """
+    nets = list(nets)
+    fixed = fixed or {}
+    if order is None:
+        order = sorted(range(len(sizes)), key=lambda i: -sizes[i][0] * sizes[i][1])
+    order = [i for i in order if i not in fixed]
+    neighbours = [[] for _ in sizes]
+    for i, j in nets:
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+
+    span = 2 * math.ceil(math.sqrt(sum((w + gap) * (h + gap) for w, h in sizes))) + max(max(s) for s in sizes)
+    while True:
+        positions = _place(sizes, neighbours, fixed, order, gap, wire_weight, span)
+        if positions is not None:
+            break
+        span *= 2  # grid too small for an unlucky order
+
+    x0 = min(x for x, _ in positions)
+    y0 = min(y for _, y in positions)
+    width = max(x + w for (x, _), (w, _) in zip(positions, sizes)) - x0
+    height = max(y + h for (_, y), (_, h) in zip(positions, sizes)) - y0
+    wire = _wire(positions, sizes, nets)
+    return Placement(positions, width, height, wire, width + height + wire_weight * wire)
+
+
+def _place(sizes, neighbours, fixed, order, gap, wire_weight, span) -> T.Optional[T.List[Pos]]:
+    # grid covers fixed rectangles and span cells around them
+    if fixed:
+        ox = min(x for x, _ in fixed.values()) - span
+        oy = min(y for _, y in fixed.values()) - span
+        ex = max(x + sizes[i][0] for i, (x, _) in fixed.items()) + span
+        ey = max(y + sizes[i][1] for i, (_, y) in fixed.items()) + span
+    else:
+        ox, oy, ex, ey = 0, 0, span, span
+    keepout = np.zeros((ey - oy, ex - ox), dtype=np.int32)
+    positions: T.List[T.Optional[Pos]] = [None] * len(sizes)
+    bbox = None  # x_lo, y_lo, x_hi, y_hi in grid coordinates, exclusive upper ends
+
+    def occupy(i, x, y):
+        nonlocal bbox
+        w, h = sizes[i]
+        positions[i] = (x + ox, y + oy)
+        keepout[max(0, y - gap):y + h + gap, max(0, x - gap):x + w + gap] = 1
+        box = (x, y, x + w, y + h)
+        bbox = box if bbox is None else (min(bbox[0], box[0]), min(bbox[1], box[1]),
+                                         max(bbox[2], box[2]), max(bbox[3], box[3]))
+
+    for i, (x, y) in fixed.items():
+        occupy(i, x - ox, y - oy)
+
+    for i in order:
+        w, h = sizes[i]
+        if w > keepout.shape[1] or h > keepout.shape[0]:
+            return None
+        free = _window_sums(keepout, w, h) == 0
+        if not free.any():
+            return None
+        ys, xs = np.mgrid[0:free.shape[0], 0:free.shape[1]]
+        if bbox is None:
+            cost = (xs + ys).astype(float)
+        else:
+            cost = ((np.maximum(bbox[2], xs + w) - np.minimum(bbox[0], xs)) +
+                    (np.maximum(bbox[3], ys + h) - np.minimum(bbox[1], ys))).astype(float)
+        for j in neighbours[i]:
+            if positions[j] is not None:
+                (xj, yj), (wj, hj) = positions[j], sizes[j]
+                cost += wire_weight * (np.abs(xs + ox + w / 2 - xj - wj / 2) + np.abs(ys + oy + h / 2 - yj - hj / 2))
+        cost[~free] = np.inf
+        y, x = np.unravel_index(np.argmin(cost), cost.shape)  # first minimum in row major order is bottom-left
+        occupy(i, int(x), int(y))
+    return positions
+
+
+def anneal(sizes: T.List[Size], nets: T.Iterable[Net] = (), fixed: T.Optional[T.Dict[int, Pos]] = None,
+           gap: int = 1, wire_weight: float = 0.5, iters: int = 200, seed: int = 0,
+           temperature: T.Optional[float] = None) -> Placement:
+    """ Simulated annealing over placement order, neighbouring orders differ by a swap of two rectangles.
+        Deterministic for a given seed, returns the best placement seen """
+    nets = list(nets)
+    fixed = fixed or {}
+    rnd = random.Random(seed)
+    order = [i for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][0] * sizes[i][1]) if i not in fixed]
+
+    cur = best = place(sizes, nets, fixed, order, gap, wire_weight)
+    if len(order) < 2:
+        return best
+    t = temperature if temperature is not None else 0.05 * cur.cost
+    cooling = 0.01 ** (1 / iters)  # temperature drops 100 times over the run
+    for _ in range(iters):
+        i, j = rnd.sample(range(len(order)), 2)
+        cand_order = list(order)
+        cand_order[i], cand_order[j] = cand_order[j], cand_order[i]
+        cand = place(sizes, nets, fixed, cand_order, gap, wire_weight)
+        delta = cand.cost - cur.cost
+        if delta <= 0 or t > 0 and rnd.random() < math.exp(-delta / t):
+            cur, order = cand, cand_order
+            if cur.cost < best.cost:
+                best = cur
+        t *= cooling
+    return best
@@ -0,0 +1,159 @@
+""" Portfolio solving: the same assertion set is checked by several differently configured solvers
+    running in separate processes, the first definite answer wins and the rest are cancelled """
+import multiprocessing as mp
+import queue
+import typing as T
+from time import time
+
+import z3
+
+
+class Strategy:
+    """ Single portfolio entry, either a tactic or a logic plus a random seed """
+    def __init__(self, tactic: T.Optional[str] = None, logic: T.Optional[str] = None, seed: int = 0):
+        assert tactic is None or logic is None, 'specify either tactic or logic'
+        self.tactic = 'default' if tactic is None and logic is None else tactic
+        self.logic = logic
+        self.seed = seed
+
+    def __repr__(self):
+        kind = f'logic={self.logic}' if self.logic else f'tactic={self.tactic}'
+        return f'Strategy({kind}, seed={self.seed})'
+
+    def solver(self, ctx=None) -> z3.Solver:
+        if self.logic:
+            sol = z3.SolverFor(self.logic, ctx=ctx)
+        else:
+            sol = z3.Tactic(self.tactic, ctx=ctx).solver()
+        sol.set('random_seed', self.seed)
+        sol.set('smt.random_seed', self.seed)
+        return sol
+
+
+DEFAULT_PORTFOLIO = [Strategy('default', seed=0),
+                     Strategy('smt', seed=1),
+                     Strategy('smt', seed=2),
+                     Strategy('qflia', seed=0)]
+
+
+def _dump_value(v):
+    """ Converts model value to plain python so it can be sent between processes """
+    if z3.is_int_value(v):
+        return v.as_long()
+    if z3.is_true(v):
+        return True
+    if z3.is_false(v):
+        return False
+    if z3.is_app(v) and v.num_args() == 0 and z3.is_app_of(v, z3.Z3_OP_DT_CONSTRUCTOR):
+        return v.decl().name()
+    raise ValueError('unsupported model value', v)
+
+
+def dump_model(m: z3.ModelRef) -> T.Dict[str, tuple]:
+    """ Model as {name: ('const', value) or ('func', [(args, value)])}, values are plain python """
+    res = {}
+    for d in m.decls():
+        try:
+            if d.arity() == 0:
+                res[d.name()] = ('const', _dump_value(m[d]))
+            else:
+                fi = m[d]
+                entries = [([_dump_value(fi.entry(k).arg_value(a)) for a in range(fi.entry(k).num_args())],
+                            _dump_value(fi.entry(k).value()))
+                           for k in range(fi.num_entries())]
+                res[d.name()] = ('func', entries)
+        except ValueError:
+            pass  # values we can't transfer are left for the local solver to fill in
+    return res
+
+
+def _load_value(sort: z3.SortRef, v):
+    if isinstance(v, bool):
+        return z3.BoolVal(v, ctx=sort.ctx)
+    if isinstance(v, int):
+        return z3.IntVal(v, ctx=sort.ctx)
+    assert isinstance(sort, z3.DatatypeSortRef)
+    for k in range(sort.num_constructors()):
+        if sort.constructor(k).name() == v:
+            return sort.constructor(k)()
+    raise ValueError('unknown constructor', sort, v)
+
+
+def collect_decls(exprs: T.Iterable[z3.ExprRef]) -> T.Dict[str, z3.FuncDeclRef]:
+    """ All uninterpreted constants and functions occurring in given expressions """
+    decls = {}
+    visited = set()
+    todo = list(exprs)
+    while todo:
+        e = todo.pop()
+        if e.get_id() in visited:
+            continue
+        visited.add(e.get_id())
+        if z3.is_quantifier(e):
+            todo.append(e.body())
+        elif z3.is_app(e):
+            if e.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                decls[e.decl().name()] = e.decl()
+            todo.extend(e.children())
+    return decls
+
+
+def model_pins(decls: T.Dict[str, z3.FuncDeclRef], dump: T.Dict[str, tuple]) -> T.List[z3.BoolRef]:
+    """ Equalities fixing given declarations to values from a dumped model """
+    pins = []
+    for name, (kind, val) in dump.items():
+        d = decls.get(name)
+        if d is None:
+            continue
+        if kind == 'const':
+            pins.append(d() == _load_value(d.range(), val))
+        else:
+            for args, res in val:
+                args = [_load_value(d.domain(a), arg) for a, arg in enumerate(args)]
+                pins.append(d(*args) == _load_value(d.range(), res))
+    return pins
+
+
+def _worker(idx: int, strategy: Strategy, smt2: str, results):
+    try:
+        sol = strategy.solver()
+        sol.from_string(smt2)
+        r = sol.check()
+        dump = dump_model(sol.model()) if r == z3.sat else None
+        results.put((idx, str(r), dump))
+    except z3.Z3Exception:
+        results.put((idx, 'unknown', None))
+
+
+def solve_portfolio(smt2: str, strategies: T.List[Strategy], timeout: T.Optional[float] = None,
+                    start_method: str = 'spawn') -> T.Tuple[str, T.Optional[Strategy], T.Optional[dict]]:
+    """ Checks SMT-LIB benchmark with all strategies in parallel.
+        Returns (result, winning strategy, dumped model), result is one of 'sat', 'unsat', 'unknown' """
+    mpc = mp.get_context(start_method)
+    results = mpc.Queue()
+    procs = [mpc.Process(target=_worker, args=(k, st, smt2, results), daemon=True) for k, st in enumerate(strategies)]
+    for p in procs:
+        p.start()
+
+    t0 = time()
+    answer = ('unknown', None, None)
+    pending = len(procs)
+    try:
+        while pending and (timeout is None or time() - t0 < timeout):
+            try:
+                idx, r, dump = results.get(timeout=0.05)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs) and results.empty():
+                    break  # all workers are gone without an answer
+                continue
+            pending -= 1
+            if r in ('sat', 'unsat'):
+                answer = (r, strategies[idx], dump)
+                break
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for p in procs:
+            p.join()
+    return answer
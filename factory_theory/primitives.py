@@ -1,4 +1,6 @@
 import typing as T
+import weakref
+
 import z3
 from z3 import Const, IntSort, And, Or, Function, Consts, ForAll, Implies, Not
 
@@ -7,31 +9,41 @@ from .solver_wrapper import SolverWrapper
 from utils import tail
 
 
+# Default solver used by all primitives unless another SolverWrapper is passed explicitly
 SOL: SolverWrapper = SolverWrapper()
 
 
+def resolve_solver(sol: T.Optional[SolverWrapper]) -> SolverWrapper:
+    return SOL if sol is None else sol
+
+
 class IntVal:
     _IDX = 0
-    def __init__(self, label='', value=None):
+    def __init__(self, label='', value=None, sol: T.Optional[SolverWrapper] = None):
+        self.sol = resolve_solver(sol)
         if value is None:
-            self.v = z3.Const(f'intval_{label}{self._IDX}', z3.IntSort())
+            self.v = z3.Const(f'intval_{label}{self._IDX}', z3.IntSort(self.sol.ctx))
             self.__class__._IDX += 1
         else:
             self.v = value
 
     def eval(self):
-        return SOL.eval(self.v)
+        return self.sol.eval(self.v)
 
 
 class Point2D(BasePoint2D):
     _IDX = 0
 
-    def __init__(self, x=None, y=None):
-        x = Const(f"p{self._IDX}_x", IntSort()) if x is None else x
-        y = Const(f"p{self._IDX}_y", IntSort()) if y is None else y
+    def __init__(self, x=None, y=None, sol: T.Optional[SolverWrapper] = None):
+        self.sol = resolve_solver(sol)
+        x = Const(f"p{self._IDX}_x", IntSort(self.sol.ctx)) if x is None else x
+        y = Const(f"p{self._IDX}_y", IntSort(self.sol.ctx)) if y is None else y
         self.__class__._IDX += 1
         super().__init__(x, y)
 
+    def derived(self, x, y):
+        return Point2D(x, y, sol=self.sol)
+
     def __repr__(self):
         return f'Point2D({self.x},{self.y})'
 
@@ -59,15 +71,15 @@ class Point2D(BasePoint2D):
             return And(resx, resy)
 
     def eval(self):
-        x = SOL.eval(self.x)
-        y = SOL.eval(self.y)
+        x = self.sol.eval(self.x)
+        y = self.sol.eval(self.y)
         assert isinstance(x, int)
         assert isinstance(y, int)
-        return Point2D(x,y)
+        return Point2D(x, y, sol=self.sol)
 
     def eval_as_tuple(self):
-        x = SOL.eval(self.x)
-        y = SOL.eval(self.y)
+        x = self.sol.eval(self.x)
+        y = self.sol.eval(self.y)
         return x,y
 
 
@@ -123,27 +135,68 @@ def Min(x, y):
     return z3.If(x < y, x, y)
 
 
+def _select(values: list, idx):
+    """ Picks values[idx] for a possibly symbolic index, building an ite chain over the finite candidates """
+    if isinstance(idx, int):
+        return values[idx]
+    idx = z3.simplify(idx)
+    if z3.is_int_value(idx):
+        return values[idx.as_long()]
+    res = values[-1]
+    for k in reversed(range(len(values) - 1)):
+        res = z3.If(idx == k, values[k], res)
+    return res
+
+
 # Belts
 class Belt:
+    """ Belt as a chain of neighbouring cells.
+
+        By default points are modelled by uninterpreted functions constrained by quantifiers.
+        If max_len is given belt is bounded, points become plain integer variables and all constraints are quantifier free.
+    """
     _IDX = 0
-    def __init__(self):
-        self.belt_x = Function(f'belt{self._IDX}_x', IntSort(), IntSort())
-        self.belt_y = Function(f'belt{self._IDX}_y', IntSort(), IntSort())
-        self.belt_len = Const(f'belt{self._IDX}_len', IntSort())
-        SOL.add(self.belt_len > 0)
-
-        i,j = Consts("i j", IntSort())
-        # neighbor condition
-        SOL.add(ForAll([i], Implies(And(i < self.belt_len - 1, i >= 0),
-                                    neighs(self[i], self[i+1]))))
-
-        # no intersections
-        SOL.add(ForAll([i, j], Implies(And(i >= 0, i < j, j < self.belt_len),
-                                       Not(self[i] == self[j]))))
+    def __init__(self, max_len: T.Optional[int] = None, sol: T.Optional[SolverWrapper] = None):
+        self.sol = resolve_solver(sol)
+        self.max_len = max_len
+        Int = IntSort(self.sol.ctx)
+        self.belt_len = Const(f'belt{self._IDX}_len', Int)
+        self.sol.add(self.belt_len > 0)
+
+        if max_len is None:
+            self.belt_x = Function(f'belt{self._IDX}_x', Int, Int)
+            self.belt_y = Function(f'belt{self._IDX}_y', Int, Int)
+
+            i,j = Consts("i j", Int)
+            # neighbor condition
+            self.sol.add(ForAll([i], Implies(And(i < self.belt_len - 1, i >= 0),
+                                             neighs(self[i], self[i+1]))))
+
+            # no intersections
+            self.sol.add(ForAll([i, j], Implies(And(i >= 0, i < j, j < self.belt_len),
+                                                Not(self[i] == self[j]))))
+        else:
+            assert max_len > 0
+            self.points_x = [Const(f'belt{self._IDX}_x_{k}', Int) for k in range(max_len)]
+            self.points_y = [Const(f'belt{self._IDX}_y_{k}', Int) for k in range(max_len)]
+            self.sol.add(self.belt_len <= max_len)
+
+            for k in range(max_len - 1):
+                self.sol.add(Implies(k + 1 < self.belt_len, neighs(self[k], self[k+1])))
+
+            for k in range(max_len):
+                for l in range(k + 1, max_len):
+                    self.sol.add(Implies(l < self.belt_len, Not(self[k] == self[l])))
         self.__class__._IDX += 1
 
+    @property
+    def bounded(self) -> bool:
+        return self.max_len is not None
+
     def __getitem__(self, i):
-        return Point2D(self.belt_x(i), self.belt_y(i))
+        if self.bounded:
+            return Point2D(_select(self.points_x, i), _select(self.points_y, i), sol=self.sol)
+        return Point2D(self.belt_x(i), self.belt_y(i), sol=self.sol)
 
     def source(self):
         return self[0]
@@ -152,7 +205,7 @@ class Belt:
         return self[self.belt_len-1]
 
     def lazy_points(self)->T.List[Point2D]:
-        m = SOL.model()
+        m = self.sol.model()
         blen = m.eval(self.belt_len)
         points = []
         for k in range(0, blen):
@@ -160,79 +213,130 @@ class Belt:
         return points
 
     def eval_points(self)->T.List[T.Tuple[int,int]]:
-        m = SOL.model()
+        m = self.sol.model()
         assert(m)
-        blen = SOL.eval(self.belt_len)
+        blen = self.sol.eval(self.belt_len)
         points = []
         for k in range(0, blen):
             points.append(self[k].eval_as_tuple())
         return points
 
+    def forall_points(self, pred: T.Callable[[Point2D], z3.BoolRef], var_name='i') -> z3.BoolRef:
+        """ Constraint stating pred holds for every point of the belt """
+        if self.bounded:
+            return And([Implies(k < self.belt_len, pred(self[k])) for k in range(self.max_len)])
+        i = Const(var_name, IntSort(self.sol.ctx))
+        return ForAll([i], Implies(And(0 <= i, i < self.belt_len), pred(self[i])))
+
     # convenience
     def fix_ends(self, source, sink):
-        SOL.add(self.source() == source)
-        SOL.add(self.sink() == sink)
+        self.sol.add(self.source() == source)
+        self.sol.add(self.sink() == sink)
 
 
 def no_intersections(belt1: Belt, belt2: Belt):
     assert isinstance(belt1, Belt)
     assert isinstance(belt2, Belt)
 
-    i,j = Consts("i j", IntSort())
+    # quantifier free if both belts are bounded, with one bounded belt a single quantifier over the other one
+    if belt1.bounded and not belt2.bounded:
+        return belt2.forall_points(lambda p2: belt1.forall_points(lambda p1: Not(p1 == p2), var_name='i'), var_name='j')
+    if belt1.bounded or belt2.bounded:
+        return belt1.forall_points(lambda p1: belt2.forall_points(lambda p2: Not(p1 == p2), var_name='j'), var_name='i')
+
+    i,j = Consts("i j", IntSort(belt1.sol.ctx))
     return ForAll([i,j], Implies(And(0 <= i, i < belt1.belt_len, 0 <=j, j < belt2.belt_len),
                                  Not(belt1[i] == belt2[j])))
 
 
 class SegmentedBelt:
+    """ Belt described by a chain of axis aligned segments.
+
+        By default corners are uninterpreted functions constrained by quantifiers.
+        With bounded=True (requires max_segs) corners are expanded into plain integer variables,
+        so the belt stays quantifier free, as do its non-intersection constraints with other bounded belts.
+    """
     _IDX = 0
 
-    def __init__(self, max_segs=None):
-        self.corners_x = Function(f'seg_belt{self._IDX}_x', IntSort(), IntSort())
-        self.corners_y = Function(f'seg_belt{self._IDX}_y', IntSort(), IntSort())
-        self.num_segs = Const(f'seg_belt{self._IDX}_num_segs', IntSort())
-        SOL.add(self.num_segs > 0)
+    def __init__(self, max_segs=None, bounded=False, sol: T.Optional[SolverWrapper] = None):
+        self.sol = resolve_solver(sol)
+        self.max_segs = max_segs
+        self.bounded = bounded
+        Int = IntSort(self.sol.ctx)
+        self.num_segs = Const(f'seg_belt{self._IDX}_num_segs', Int)
+        self.sol.add(self.num_segs > 0)
         if max_segs:
-            SOL.add(self.num_segs <= max_segs)
+            self.sol.add(self.num_segs <= max_segs)
+
+        if bounded:
+            assert max_segs, 'bounded belt requires max_segs'
+            self.corners_x = [Const(f'seg_belt{self._IDX}_x_{k}', Int) for k in range(max_segs + 1)]
+            self.corners_y = [Const(f'seg_belt{self._IDX}_y_{k}', Int) for k in range(max_segs + 1)]
+        else:
+            self.corners_x = Function(f'seg_belt{self._IDX}_x', Int, Int)
+            self.corners_y = Function(f'seg_belt{self._IDX}_y', Int, Int)
 
-        i,j = Consts("i j", IntSort())
-        SOL.add(ForAll([i], Implies(And(0 <= i, i < self.num_segs),
-                                    Or(self.segment(i).horizontal(), self.segment(i).vertical()))))
+        self.sol.add(self.forall_segments(lambda s: Or(s.horizontal(), s.vertical())))
 
         self.__class__._IDX += 1
 
+    @classmethod
+    def fixed(cls, corners: T.List[T.Tuple[int, int]], sol: T.Optional[SolverWrapper] = None) -> 'SegmentedBelt':
+        """ Belt with known corners, introduces no variables """
+        b = cls.__new__(cls)
+        b.sol = resolve_solver(sol)
+        b.max_segs = len(corners) - 1
+        b.bounded = True
+        b.num_segs = b.max_segs
+        b.corners_x = [x for x, _ in corners]
+        b.corners_y = [y for _, y in corners]
+        return b
+
     def corner(self, i) -> Point2D:
-        return Point2D(self.corners_x(i), self.corners_y(i))
+        if self.bounded:
+            return Point2D(_select(self.corners_x, i), _select(self.corners_y, i), sol=self.sol)
+        return Point2D(self.corners_x(i), self.corners_y(i), sol=self.sol)
 
     def segment(self, i) -> Segment:
         return Segment(self.corner(i) , self.corner(i+1))
 
     def source(self):
-        return Point2D(self.corners_x(0), self.corners_y(0))
+        return self.corner(0)
 
     def sink(self):
-        return Point2D(self.corners_x(self.num_segs), self.corners_y(self.num_segs))
+        return self.corner(self.num_segs)
+
+    def forall_segments(self, pred: T.Callable[[Segment], z3.BoolRef], var_name='i') -> z3.BoolRef:
+        """ Constraint stating pred holds for every segment of the belt """
+        if self.bounded:
+            return And([Implies(k < self.num_segs, pred(self.segment(k))) for k in range(self.max_segs)])
+        i = Const(var_name, IntSort(self.sol.ctx))
+        return ForAll([i], Implies(And(0 <= i, i < self.num_segs), pred(self.segment(i))))
 
     def not_contains(self, p: Point2D):
-        i = Const("i", IntSort())
-        return (ForAll([i], Implies(And(0 <= i, i < self.num_segs), Not(self.segment(i).contains(p)))))
+        return self.forall_segments(lambda s: Not(s.contains(p)))
 
     def contains(self, p: Point2D):
         return Not(self.not_contains(p))
 
     def fix_ends(self, source, sink):
-        SOL.add(self.source() == source)
-        SOL.add(self.sink() == sink)
-
-    def len(self, max_segs):
+        self.sol.add(self.source() == source)
+        self.sol.add(self.sink() == sink)
+
+    def len(self, max_segs=None):
+        """ Number of belt cells, summed over the first max_segs segments (belt's own max_segs by default) """
+        if max_segs is None:
+            max_segs = self.max_segs
+        if max_segs is None:
+            raise ValueError('length of a belt without max_segs needs max_segs argument')
         seg_lens = [ z3.If(k < self.num_segs, self.segment(k).len(), 0) for k in range(max_segs)]
         return sum(seg_lens) - self.num_segs + 1
 
     def eval_corners(self)->T.List[T.Tuple[int, int]]:
         points = []
-        nc = SOL.eval(self.num_segs) + 1
+        nc = self.sol.eval(self.num_segs) + 1
         for i in range(nc):
-            p = Point2D(self.corners_x(i), self.corners_y(i))
-            t = p.eval_as_tuple()
+            t = self.corner(i).eval_as_tuple()
             points.append(t)
         return points
 
@@ -247,7 +351,7 @@ class SegmentedBelt:
 
     def enumerate_points(self) -> T.Iterator[Point2D]:
         """ Iterates points from source to sink one after another """
-        ns = SOL.eval(self.num_segs)
+        ns = self.sol.eval(self.num_segs)
 
         first = True
         for si in range(ns):
@@ -272,7 +376,15 @@ def non_intersecting_seg_belts(belt1: SegmentedBelt , belt2: SegmentedBelt):
     assert isinstance(belt1, SegmentedBelt)
     assert isinstance(belt2, SegmentedBelt)
 
-    i,j = Consts("i j", IntSort())
+    # quantifier free if both belts are bounded, with one bounded belt a single quantifier over the other one
+    if belt1.bounded and not belt2.bounded:
+        return belt2.forall_segments(lambda s2: belt1.forall_segments(lambda s1: non_intersecting_segs(s1, s2),
+                                                                      var_name='i'), var_name='j')
+    if belt1.bounded or belt2.bounded:
+        return belt1.forall_segments(lambda s1: belt2.forall_segments(lambda s2: non_intersecting_segs(s1, s2),
+                                                                      var_name='j'), var_name='i')
+
+    i,j = Consts("i j", IntSort(belt1.sol.ctx))
     return ForAll([i,j], Implies(And(0 <= i, i < belt1.num_segs, 0 <=j, j < belt2.num_segs),
                                  non_intersecting_segs(belt1.segment(i), belt2.segment(j))))
 
@@ -283,24 +395,23 @@ def non_intersecting_seg_belt_diag_seg(belt: SegmentedBelt, dseg: Segment):
     assert isinstance(dseg, Segment)
     assert dseg.is_diag
 
-    i = Const("i", IntSort())
-    return ForAll([i], Implies(And(0 <= i, i < belt.num_segs),
-                                   Or(Max(belt.segment(i).p1.x, belt.segment(i).p2.x) < dseg.p1.x,
-                                      Min(belt.segment(i).p1.x, belt.segment(i).p2.x) > dseg.p2.x,
-                                      Max(belt.segment(i).p1.y, belt.segment(i).p2.y) < dseg.p1.y,
-                                      Min(belt.segment(i).p1.y, belt.segment(i).p2.y) > dseg.p2.y)))
+    return belt.forall_segments(lambda s: Or(Max(s.p1.x, s.p2.x) < dseg.p1.x,
+                                             Min(s.p1.x, s.p2.x) > dseg.p2.x,
+                                             Max(s.p1.y, s.p2.y) < dseg.p1.y,
+                                             Min(s.p1.y, s.p2.y) > dseg.p2.y))
 
 
 # Buildings
 class Rectangle:
     """ Generic class for all rectangular things, supports both floating and fixed locations """
-    def __init__(self, size, x=None, y=None):
-        self.pos = Point2D(x,y)
+    def __init__(self, size, x=None, y=None, sol: T.Optional[SolverWrapper] = None):
+        self.sol = resolve_solver(sol)
+        self.pos = Point2D(x, y, sol=self.sol)
 
         if isinstance(size, Point2D):
             self.size = size
         elif isinstance(size, int) or size is None:
-            self.size = Point2D(size, size)
+            self.size = Point2D(size, size, sol=self.sol)
         else:
             raise ValueError('Strange size', size, type(size))
 
@@ -342,30 +453,47 @@ def non_intersecting_rectangles(*rects: T.List[Rectangle]):
         assert isinstance(rects[i], Rectangle)
         for j in range(i+1, len(rects)):
             cases.append(rects[i].non_intersecting(rects[j]))
-    return And(cases)
+    return And(cases) if cases else True
 
 
 class AssemblyMachine(Rectangle):
-    def __init__(self, size=3, x=None, y=None):
-        super().__init__(x=x, y=y, size=size)
+    def __init__(self, size=3, x=None, y=None, sol: T.Optional[SolverWrapper] = None):
+        super().__init__(x=x, y=y, size=size, sol=sol)
+
+
+_DIR_SORTS = weakref.WeakKeyDictionary()
 
 
-Dir = z3.Datatype('Dir')
-Dir.declare('u')
-Dir.declare('d')
-Dir.declare('l')
-Dir.declare('r')
-Dir = Dir.create()
+def dir_sort(ctx: T.Optional[z3.Context] = None) -> z3.DatatypeSortRef:
+    """ Direction datatype, z3 sorts are bound to a context so there is one per context """
+    ctx = z3.main_ctx() if ctx is None else ctx
+    if ctx not in _DIR_SORTS:
+        dt = z3.Datatype('Dir', ctx=ctx)
+        dt.declare('u')
+        dt.declare('d')
+        dt.declare('l')
+        dt.declare('r')
+        _DIR_SORTS[ctx] = dt.create()
+    return _DIR_SORTS[ctx]
+
+
+Dir = dir_sort()
 
 
 class DirVal:
     _IDX = 0
-    def __init__(self, label=''):
-        self.v = Const(f'dirval_{label}{self._IDX}', Dir)
-        self.__class__._IDX += 1
+    def __init__(self, label='', value: T.Optional[str] = None, sol: T.Optional[SolverWrapper] = None):
+        """ value - constructor name ('u', 'd', 'l', 'r') for a known direction """
+        self.sol = resolve_solver(sol)
+        dt = dir_sort(self.sol.ctx)
+        if value is None:
+            self.v = Const(f'dirval_{label}{self._IDX}', dt)
+            self.__class__._IDX += 1
+        else:
+            self.v = getattr(dt, value)
 
     def eval(self):
-        return SOL.eval(self.v)
+        return self.sol.eval(self.v)
 
 
 def dir_to_disp(x: T.Union[DirVal, z3.DatatypeRef], length:T.Union[int, z3.Int] = 1) -> tuple:
@@ -373,6 +501,7 @@ def dir_to_disp(x: T.Union[DirVal, z3.DatatypeRef], length:T.Union[int, z3.Int]
         x = x.v
 
     assert isinstance(x, z3.DatatypeRef)
+    Dir = dir_sort(x.ctx)
     if x.eq(Dir.u):
         res = (0,length)
     elif x.eq(Dir.d):
@@ -390,12 +519,23 @@ def dir_to_disp(x: T.Union[DirVal, z3.DatatypeRef], length:T.Union[int, z3.Int]
 
 
 class Inserter:
-    def __init__(self, unit_len_only=True):
-        self.pos = Point2D()
-        self.dir = DirVal()
-        self.arm_len = IntVal(value=1 if unit_len_only else None)
+    def __init__(self, unit_len_only=True, sol: T.Optional[SolverWrapper] = None):
+        self.sol = resolve_solver(sol)
+        self.pos = Point2D(sol=self.sol)
+        self.dir = DirVal(sol=self.sol)
+        self.arm_len = IntVal(value=1 if unit_len_only else None, sol=self.sol)
         if not unit_len_only:
-            SOL.add(And(1 <= self.arm_len.v, self.arm_len.v <= 2))
+            self.sol.add(And(1 <= self.arm_len.v, self.arm_len.v <= 2))
+
+    @classmethod
+    def fixed(cls, x: int, y: int, dir: str, arm_len: int, sol: T.Optional[SolverWrapper] = None) -> 'Inserter':
+        """ Inserter with known position and direction, introduces no variables """
+        ins = cls.__new__(cls)
+        ins.sol = resolve_solver(sol)
+        ins.pos = Point2D(x, y, sol=ins.sol)
+        ins.dir = DirVal(value=dir, sol=ins.sol)
+        ins.arm_len = IntVal(value=arm_len, sol=ins.sol)
+        return ins
 
     def source(self) -> Point2D:
         disp = dir_to_disp(self.dir, length=self.arm_len.v)
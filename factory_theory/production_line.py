@@ -1,13 +1,20 @@
+import threading
+import typing as T
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import z3
 
 from factory_theory import primitives as P
+from factory_theory.layout import extract_subfactory
+from factory_theory.solution_cache import canonical_model
 from factory_theory.subfactory import SubFactory
 
 
 class ProductionLine(SubFactory):
     """ AssemblyMachines or Drills built along straight line together with belts and inserters """
     
-    def __init__(self, num_machines: int, machine_size: int, num_inputs: int, auto_output=False, short_inserters=False, color='gray'):
+    def __init__(self, num_machines: int, machine_size: int, num_inputs: int, auto_output=False, short_inserters=False, color='gray',
+                 sol: T.Optional[P.SolverWrapper] = None):
         """ num_machines - number of machines in a row 
             machine_size - size of a single machine(in cells)
             num_inputs - number of input lines (common for all machines as they presumably share a single program)
@@ -20,10 +27,12 @@ class ProductionLine(SubFactory):
         self.num_inputs = num_inputs
 
         # conservative estimations (2 for inserters)
-        area = P.Rectangle(size=P.Point2D(x=num_machines * machine_size, y=machine_size + num_inputs + 1 + (2 if num_inputs > 0 else 0)))
+        sol = P.resolve_solver(sol)
+        area = P.Rectangle(size=P.Point2D(x=num_machines * machine_size, y=machine_size + num_inputs + 1 + (2 if num_inputs > 0 else 0), sol=sol),
+                           sol=sol)
         area.color = color
         area.opacity = 0.2
-        super().__init__(area=area)
+        super().__init__(area=area, sol=sol)
 
         self.model_machine = self.new_machine(size=machine_size, color='gray')
         self.machine_area = self.new_area(self.model_machine.pos.as_tuple(),
@@ -38,11 +47,11 @@ class ProductionLine(SubFactory):
         # constraining  belts positions
         area_ds = self.area.to_diag_seg()
         for b in self.input_belts + [self.output_belt]:
-            P.SOL.add(b.num_segs == 1)
-            P.SOL.add(b.segment(0).horizontal())
-            P.SOL.add(z3.Or(z3.And(b.source().x == area_ds.p1.x, b.sink().x == area_ds.p2.x),
+            self.add(b.num_segs == 1)
+            self.add(b.segment(0).horizontal())
+            self.add(z3.Or(z3.And(b.source().x == area_ds.p1.x, b.sink().x == area_ds.p2.x),
                             z3.And(b.source().x == area_ds.p2.x, b.sink().x == area_ds.p1.x)))
-            P.SOL.add(z3.And(area_ds.p1.y <= b.segment(0).p1.y, b.segment(0).p1.y <= area_ds.p2.y))
+            self.add(z3.And(area_ds.p1.y <= b.segment(0).p1.y, b.segment(0).p1.y <= area_ds.p2.y))
 
         if auto_output:
             ds_machine = self.model_machine.to_diag_seg()
@@ -60,7 +69,7 @@ class ProductionLine(SubFactory):
 
         for i in range(1, self.num_machines):
             mpos = self.model_machine.pos.eval()
-            m = P.AssemblyMachine(size=self.machine_size, x=mpos.x + i * self.machine_size, y=mpos.y)
+            m = P.AssemblyMachine(size=self.machine_size, x=mpos.x + i * self.machine_size, y=mpos.y, sol=self.sol)
             m.color='gray'
             self.buildings.append(m)
 
@@ -70,7 +79,7 @@ class ProductionLine(SubFactory):
 
                 ins2 = copy(ins)
                 ipos = ins.pos.eval()
-                ins2.pos = P.Point2D(ipos.x + i * self.machine_size, ipos.y)
+                ins2.pos = P.Point2D(ipos.x + i * self.machine_size, ipos.y, sol=self.sol)
                 self.inserters.append(ins2)
 
     def input(self, k: int) -> P.Point2D:
@@ -79,3 +88,124 @@ class ProductionLine(SubFactory):
 
     def output(self) -> P.Point2D:
         return self.output_belt.sink()
+
+
+class ProductionLineTemplate:
+    """ ProductionLine solved once in its own solver and kept in coordinates relative to its area.
+        Inputs enter on the left side and output leaves on the right one """
+    _CACHE: T.Dict[tuple, Future] = {}
+    _LOCK = threading.Lock()
+
+    def __init__(self, num_machines: int, machine_size: int, num_inputs: int, auto_output=False):
+        self.key = (num_machines, machine_size, num_inputs, auto_output)
+        sol = P.SolverWrapper.isolated()
+        pl = ProductionLine(num_machines=num_machines, machine_size=machine_size, num_inputs=num_inputs,
+                            auto_output=auto_output, sol=sol)
+        sol.add(pl.area.pos == (0, 0))
+        right = pl.area.size.x - 1
+        for k in range(num_inputs):
+            sol.add(pl.input(k).x == 0)
+        sol.add(pl.output().x == right)
+        pl.finalize()
+        if canonical_model(sol) is None:  # not sol.model(), so the template doesn't depend on generated names
+            raise ValueError(f'no layout for production line {self.key}')
+        pl.postprocess()
+
+        layout = extract_subfactory(pl)
+        self.size: T.Tuple[int, int] = tuple(layout['area'][2:])
+        self.buildings: T.List[T.List[int]] = layout['buildings']
+        self.inserters: T.List[list] = layout['inserters']
+        self.belts: T.List[T.List[T.List[int]]] = layout['belts']
+        self.inputs: T.List[T.Tuple[int, int]] = [pl.input(k).eval_as_tuple() for k in range(num_inputs)]
+        self.output: T.Tuple[int, int] = pl.output().eval_as_tuple()
+
+    @classmethod
+    def get(cls, num_machines: int, machine_size: int, num_inputs: int, auto_output=False) -> 'ProductionLineTemplate':
+        """ Template for given parameters, solved on first request.
+            Each template is solved in its own z3 context, so distinct ones may be requested from several threads """
+        key = (num_machines, machine_size, num_inputs, auto_output)
+        with cls._LOCK:
+            fut = cls._CACHE.get(key)
+            owner = fut is None
+            if owner:
+                fut = cls._CACHE[key] = Future()
+        if owner:
+            try:
+                fut.set_result(cls(*key))
+            except Exception as e:
+                with cls._LOCK:
+                    del cls._CACHE[key]
+                fut.set_exception(e)
+        return fut.result()
+
+    @classmethod
+    def solve_all(cls, keys: T.Iterable[tuple], workers: T.Optional[int] = None) -> T.Dict[tuple, 'ProductionLineTemplate']:
+        """ Gets templates for all keys solving missing ones in parallel """
+        keys = list(dict.fromkeys(keys))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            return dict(zip(keys, ex.map(lambda key: cls.get(*key), keys)))
+
+
+class TemplatedProductionLine(SubFactory):
+    """ Production line placed as a rigid rectangle from a precomputed template.
+        Only its position is solved for, machines, inserters and belts are materialized in postprocess.
+        With lazy=True the template is not solved yet, footprint and port offsets stay variables until bind() """
+    def __init__(self, num_machines: int, machine_size: int, num_inputs: int, auto_output=False, color='gray',
+                 lazy=False, sol: T.Optional[P.SolverWrapper] = None):
+        self.key = (num_machines, machine_size, num_inputs, auto_output)
+        self.num_machines = num_machines
+        self.machine_size = machine_size
+        self.num_inputs = num_inputs
+        self.template: T.Optional[ProductionLineTemplate] = None if lazy else ProductionLineTemplate.get(*self.key)
+
+        sol = P.resolve_solver(sol)
+        if self.template is None:
+            size = P.Point2D(sol=sol)
+            self._inputs = [P.Point2D(sol=sol) for _ in range(num_inputs)]
+            self._output = P.Point2D(sol=sol)
+        else:
+            size = P.Point2D(*self.template.size, sol=sol)
+            self._inputs = [P.Point2D(*p, sol=sol) for p in self.template.inputs]
+            self._output = P.Point2D(*self.template.output, sol=sol)
+        area = P.Rectangle(size=size, sol=sol)
+        area.color = color
+        area.opacity = 0.2
+        super().__init__(area=area, sol=sol)
+
+    def bind(self, template: ProductionLineTemplate):
+        """ Fixes footprint and ports of a lazy line to the solved template """
+        assert self.template is None and template.key == self.key
+        self.template = template
+        self.add(self.area.size == template.size)
+        for p, offset in zip(self._inputs, template.inputs):
+            self.add(p == offset)
+        self.add(self._output == template.output)
+
+    def finalize(self):
+        assert self.template is not None, 'lazy production line must be bound before finalization'
+        super().finalize()
+
+    def postprocess(self):
+        """ Create entities of the template at the solved position """
+        assert self.finalized
+
+        x0, y0 = self.area.pos.eval_as_tuple()
+        for x, y, w, h in self.template.buildings:
+            m = P.AssemblyMachine(size=w, x=x0 + x, y=y0 + y, sol=self.sol)
+            m.color = 'gray'
+            self.buildings.append(m)
+        for x, y, d, arm_len in self.template.inserters:
+            ins = P.Inserter.fixed(x0 + x, y0 + y, d, arm_len, sol=self.sol)
+            ins.color = 'y'
+            self.inserters.append(ins)
+        for corners in self.template.belts:
+            b = P.SegmentedBelt.fixed([(x0 + x, y0 + y) for x, y in corners], sol=self.sol)
+            b.color = 'gray'
+            self.segmented_belts.append(b)
+
+    def input(self, k: int) -> P.Point2D:
+        assert k < self.num_inputs
+        return self.area.pos + self._inputs[k].as_tuple()
+
+    def output(self) -> P.Point2D:
+        return self.area.pos + self._output.as_tuple()
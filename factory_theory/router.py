@@ -0,0 +1,163 @@
+""" Classical belt routing on a grid: multi-source A* with turn penalties and
+    negotiated congestion (PathFinder style rip-up and reroute) for several belts at once.
+    Routes are returned as corner lists compatible with SegmentedBelt, so they can be
+    checked, fixed or used as hints on the SMT side """
+import heapq
+import itertools
+import typing as T
+
+import z3
+
+from factory_theory import primitives as P
+from factory_theory.layout import occupied_cells
+
+Cell = T.Tuple[int, int]
+Bounds = T.Tuple[int, int, int, int]  # x_min, y_min, x_max, y_max, inclusive
+
+_MOVES = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+class RoutingError(Exception):
+    pass
+
+
+def obstacles_from_layout(layout: dict, exclude_belts: bool = False) -> T.Set[Cell]:
+    """ Cells taken by a solved layout (see layout.extract_layout) """
+    if exclude_belts:
+        layout = dict(layout, belts=[], production_lines=[dict(pl, belts=[]) for pl in layout.get('production_lines', [])])
+    return occupied_cells(layout)
+
+
+def bounds_around(cells: T.Iterable[Cell], margin: int = 2) -> Bounds:
+    cells = list(cells)
+    xs = [c[0] for c in cells]
+    ys = [c[1] for c in cells]
+    return min(xs) - margin, min(ys) - margin, max(xs) + margin, max(ys) + margin
+
+
+def route(sources: T.Iterable[Cell], targets: T.Iterable[Cell], blocked: T.Container[Cell], bounds: Bounds,
+          cell_cost: T.Optional[T.Callable[[Cell], float]] = None, turn_cost: float = 0.5) -> T.Optional[T.List[Cell]]:
+    """ Cheapest path of cells from any of sources to any of targets avoiding blocked cells.
+        Each cell costs 1 (plus cell_cost(cell) if given), each turn adds turn_cost, so straight routes
+        with few segments are preferred. Returns None if targets are unreachable """
+    targets = set(targets)
+    x0, y0, x1, y1 = bounds
+
+    def h(c: Cell) -> int:
+        return min(abs(c[0] - t[0]) + abs(c[1] - t[1]) for t in targets)
+
+    counter = itertools.count()  # tie breaker, keeps heap from comparing states
+    best = {}
+    parent = {}
+    heap = []
+    for s in set(sources):
+        if s in blocked:
+            continue
+        g = 1 + (cell_cost(s) if cell_cost else 0)
+        state = (s, None)
+        best[state] = g
+        parent[state] = None
+        heapq.heappush(heap, (g + h(s), next(counter), g, state))
+
+    while heap:
+        _, _, g, state = heapq.heappop(heap)
+        if g > best[state]:
+            continue
+        cell, move = state
+        if cell in targets:
+            path = []
+            while state is not None:
+                path.append(state[0])
+                state = parent[state]
+            return path[::-1]
+        for m in _MOVES:
+            nxt = (cell[0] + m[0], cell[1] + m[1])
+            if not (x0 <= nxt[0] <= x1 and y0 <= nxt[1] <= y1) or nxt in blocked:
+                continue
+            ng = g + 1 + (cell_cost(nxt) if cell_cost else 0) + (turn_cost if move is not None and move != m else 0)
+            nstate = (nxt, m)
+            if ng < best.get(nstate, float('inf')):
+                best[nstate] = ng
+                parent[nstate] = state
+                heapq.heappush(heap, (ng + h(nxt), next(counter), ng, nstate))
+    return None
+
+
+def route_all(nets: T.List[T.Tuple[T.Iterable[Cell], T.Iterable[Cell]]], blocked: T.Container[Cell], bounds: Bounds,
+              max_iters: int = 50, turn_cost: float = 0.5) -> T.List[T.List[Cell]]:
+    """ Routes several belts which must not share cells, nets are (sources, targets) pairs.
+        Negotiated congestion: belts may overlap at a price growing with the number of users (present cost)
+        and with the history of past conflicts on the cell, all belts are rerouted until overlaps vanish """
+    nets = [(set(srcs), set(tgts)) for srcs, tgts in nets]
+    terminals = [srcs | tgts for srcs, tgts in nets]
+    history: T.Dict[Cell, float] = {}
+    paths: T.List[T.Optional[T.List[Cell]]] = [None] * len(nets)
+    usage: T.Dict[Cell, int] = {}
+    present_factor = 0.5
+
+    for _ in range(max_iters):
+        for k, (srcs, tgts) in enumerate(nets):
+            if paths[k] is not None:  # rip up
+                for c in paths[k]:
+                    usage[c] -= 1
+            # terminals of other belts are never shared
+            others = set().union(*(t for j, t in enumerate(terminals) if j != k))
+
+            def cost(c: Cell) -> float:
+                return (1 + history.get(c, 0)) * (1 + present_factor * usage.get(c, 0)) - 1
+
+            path = route(srcs, tgts, _Blocked(blocked, others), bounds, cell_cost=cost, turn_cost=turn_cost)
+            if path is None:
+                raise RoutingError(f'belt {k} can not be routed')
+            paths[k] = path
+            for c in path:
+                usage[c] = usage.get(c, 0) + 1
+
+        congested = [c for c, n in usage.items() if n > 1]
+        if not congested:
+            return paths
+        for c in congested:
+            history[c] = history.get(c, 0) + 1
+        present_factor *= 2
+    raise RoutingError(f'congestion not resolved in {max_iters} iterations')
+
+
+class _Blocked:
+    """ Union of obstacle containers without copying them """
+    def __init__(self, *containers: T.Container[Cell]):
+        self.containers = containers
+
+    def __contains__(self, c) -> bool:
+        return any(c in cont for cont in self.containers)
+
+
+def path_to_corners(path: T.List[Cell]) -> T.List[Cell]:
+    """ Corner list of a path as used by SegmentedBelt: ends and turning cells.
+        Single cell path becomes a zero length segment """
+    if len(path) == 1:
+        return [path[0], path[0]]
+    corners = [path[0]]
+    for prev, cur, nxt in zip(path, path[1:], path[2:]):
+        if (cur[0] - prev[0], cur[1] - prev[1]) != (nxt[0] - cur[0], nxt[1] - cur[1]):
+            corners.append(cur)
+    corners.append(path[-1])
+    return corners
+
+
+def fix_belt(belt: P.SegmentedBelt, corners: T.List[Cell]) -> z3.BoolRef:
+    """ Constraint making belt follow given corners, the SMT side is then left to check the route """
+    n = len(corners) - 1
+    assert belt.max_segs is None or n <= belt.max_segs, 'route has more segments than the belt allows'
+    return z3.And([belt.num_segs == n] + [belt.corner(k) == c for k, c in enumerate(corners)])
+
+
+def hint_belt(belt: P.SegmentedBelt, corners: T.List[Cell]) -> bool:
+    """ Suggests corners as initial values for the search, belt stays free.
+        Needs bounded belt with enough segments and solver supporting hints, returns whether hints were taken """
+    n = len(corners) - 1
+    if not belt.bounded or n > belt.max_segs:
+        return False
+    hints = [(belt.num_segs, n)]
+    for k, (x, y) in enumerate(corners):
+        hints += [(belt.corners_x[k], x), (belt.corners_y[k], y)]
+    return all([belt.sol.hint(var, val) for var, val in hints])
@@ -0,0 +1,194 @@
+""" Persistent cache of solved layouts.
+    Problems are identified by a hash of their assertions where generated names (p{IDX}_x, seg_belt{IDX}_x, ...)
+    are replaced by canonical ones in order of first appearance, so an identical sub-problem built at a different
+    point of the program hits the same entry. Models are kept as SMT-LIB text and rebuilt without solving """
+import hashlib
+import json
+import re
+import sqlite3
+import typing as T
+import zlib
+
+import z3
+
+from . import portfolio as PF
+from .solver_wrapper import SolverWrapper, _objective
+
+_TOKEN = re.compile(r'\(|\)|\|[^|]*\||"(?:[^"]|"")*"|[^\s()]+')
+_SIMPLE_SYMBOL = re.compile(r'[A-Za-z~!@$%^&*_+=<>.?/-][0-9A-Za-z~!@$%^&*_+=<>.?/-]*')
+
+SExpr = T.Union[str, list]
+
+
+def _tokens(text: str) -> T.List[str]:
+    return _TOKEN.findall(text)
+
+
+def _symbol(name: str) -> str:
+    return name if _SIMPLE_SYMBOL.fullmatch(name) else f'|{name}|'
+
+
+def _rename(text: str, names: T.Dict[str, str]) -> str:
+    """ Replaces symbols from names mapping, everything else is kept """
+    def sub(m):
+        tok = m.group(0)
+        new = names.get(tok.strip('|'))
+        return tok if new is None else _symbol(new)
+    return _TOKEN.sub(sub, text)
+
+
+def _canonical(e: z3.ExprRef, names: T.Dict[str, str]) -> str:
+    """ Renamed token stream of expression, pretty printer line breaks depend on name lengths """
+    return ' '.join(_tokens(_rename(e.sexpr(), names)))
+
+
+def _parse(text: str) -> T.List[SExpr]:
+    """ Splits SMT-LIB text into top level s-expressions (nested lists of tokens) """
+    stack = [[]]
+    for tok in _tokens(text):
+        if tok == '(':
+            stack.append([])
+        elif tok == ')':
+            e = stack.pop()
+            stack[-1].append(e)
+        else:
+            stack[-1].append(tok)
+    assert len(stack) == 1, 'unbalanced parentheses'
+    return stack[0]
+
+
+def _unparse(e: SExpr) -> str:
+    return e if isinstance(e, str) else '(' + ' '.join(map(_unparse, e)) + ')'
+
+
+def canonical_names(exprs: T.List[z3.ExprRef]) -> T.Dict[str, str]:
+    """ Maps names of uninterpreted constants and functions to c!0, c!1, ... in order of first appearance """
+    decls = PF.collect_decls(exprs)
+    names = {}
+    for e in exprs:
+        for tok in _tokens(e.sexpr()):
+            tok = tok.strip('|')
+            if tok in decls and tok not in names:
+                names[tok] = f'c!{len(names)}'
+    return names
+
+
+def problem_key(assertions: T.List[z3.ExprRef], objectives=None, priority='lex') -> T.Tuple[str, T.Dict[str, str]]:
+    """ Hash of assertions plus objectives invariant to generated names.
+        Returns (key, {real name: canonical name}) """
+    if objectives is None:
+        objectives = []
+    elif not isinstance(objectives, list):
+        objectives = [objectives]
+    objectives = [_objective(obj) for obj in objectives]
+
+    names = canonical_names(list(assertions) + [expr for _, expr in objectives])
+    h = hashlib.sha1()
+    for a in assertions:
+        h.update(_canonical(a, names).encode())
+        h.update(b'\n')
+    h.update(json.dumps([[d, _canonical(expr, names)] for d, expr in objectives]).encode())
+    h.update(priority.encode())
+    return h.hexdigest(), names
+
+
+def dump_model(m: z3.ModelRef, names: T.Dict[str, str]) -> str:
+    """ Model as SMT-LIB definitions with canonical names """
+    return _rename(m.sexpr(), names)
+
+
+def load_model(text: str, names: T.Dict[str, str], decls: T.Dict[str, z3.FuncDeclRef],
+               ctx: z3.Context) -> z3.ModelRef:
+    """ Rebuilds model dumped by dump_model for a problem whose generated names are mapped by names.
+        decls - declarations of the current problem by their real names """
+    text = _rename(text, {canonical: real for real, canonical in names.items()})
+    defs = [e for e in _parse(text) if e[0] == 'define-fun']
+
+    # every definition becomes an equation we let z3 parse, auxiliary functions (k!N) get declared first.
+    # Datatype constructors come along with their sorts
+    known = dict(decls)
+    sorts = {d.range().name(): d.range() for d in decls.values()}
+
+    script = []
+    for _, name, args, rng, body in defs:
+        if name.strip('|') not in known:
+            script.append(_unparse(['declare-fun', name, [sort for _, sort in args], rng]))
+        if args:
+            app = [name] + [var for var, _ in args]
+            script.append(_unparse(['assert', ['forall', args, ['=', app, body]]]))
+        else:
+            script.append(_unparse(['assert', ['=', name, body]]))
+    equations = z3.parse_smt2_string('\n'.join(script), sorts=sorts, decls=known, ctx=ctx)
+
+    m = z3.Model(ctx=ctx)
+    for eq in equations:
+        if z3.is_quantifier(eq):
+            app, else_value = eq.body().children()
+            d = app.decl()
+            # bound variables are numbered from the innermost, function interpretations use argument positions
+            subst = [None] * d.arity()
+            for pos, arg in enumerate(app.children()):
+                subst[z3.get_var_index(arg)] = z3.Var(pos, d.domain(pos))
+            else_value = z3.substitute_vars(else_value, *subst)
+            z3.Z3_add_func_interp(ctx.ref(), m.model, d.ast, else_value.as_ast())
+        else:
+            const, value = eq.children()
+            m.update_value(const.decl(), z3.simplify(value))  # negative numbers are parsed as (- n)
+    return m
+
+
+def canonical_model(sol: SolverWrapper) -> T.Optional[z3.ModelRef]:
+    """ Solves assertions of sol renamed to canonical names and makes eval() use the result.
+        z3 search depends on names, so this way the same problem gets the same model wherever it was built """
+    assertions = list(sol.assertions())
+    names = canonical_names(assertions)
+    s = z3.Tactic('default', ctx=sol.ctx).solver()
+    s.from_string(_rename(sol.to_smt2(), names))
+    m = None
+    if s.check() == z3.sat:
+        m = load_model(s.model().sexpr(), names, PF.collect_decls(assertions), sol.ctx)
+    sol.use_model(m)
+    return m
+
+
+class SolutionCache:
+    """ sqlite backed LRU cache of solved problems: {problem key: (metric, model text or None if unsat)} """
+    def __init__(self, path: str = ':memory:', max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS solutions ('
+                        'key TEXT PRIMARY KEY, metric TEXT, model BLOB, last_used INTEGER)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _tick(self) -> int:
+        return self.db.execute('SELECT COALESCE(MAX(last_used), 0) + 1 FROM solutions').fetchone()[0]
+
+    def get(self, key: str) -> T.Optional[T.Tuple[T.Any, T.Optional[str]]]:
+        row = self.db.execute('SELECT metric, model FROM solutions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute('UPDATE solutions SET last_used = ? WHERE key = ?', (self._tick(), key))
+        self.db.commit()
+        metric, blob = row
+        return json.loads(metric), zlib.decompress(blob).decode() if blob is not None else None
+
+    def put(self, key: str, metric, model: T.Optional[str]):
+        blob = zlib.compress(model.encode()) if model is not None else None
+        self.db.execute('INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?)',
+                        (key, json.dumps(metric), blob, self._tick()))
+        self.db.execute('DELETE FROM solutions WHERE key NOT IN '
+                        '(SELECT key FROM solutions ORDER BY last_used DESC LIMIT ?)', (self.max_entries,))
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+    def __contains__(self, key: str):
+        return self.db.execute('SELECT 1 FROM solutions WHERE key = ?', (key,)).fetchone() is not None
+
+    def close(self):
+        self.db.close()
@@ -1,30 +1,182 @@
+import contextlib
 from time import time
 
+import typing as T
+
 import z3
 
 from .base_types import BasePoint2D, BaseSegment
+from . import portfolio as PF
+from .instrumentation import Instrumentation
 
 
 z3.set_param('model.completion', True)
 
+_NO_TIMEOUT = 4294967295  # z3 default, UINT_MAX milliseconds
+
 
 def _is_IntVal(val):
     return val.__class__.__name__ == 'IntVal'
 
 
+def _objective(obj) -> T.Tuple[str, z3.ArithRef]:
+    """ Normalizes objective to (direction, expression), plain expression means minimization """
+    if isinstance(obj, tuple):
+        direction, expr = obj
+        assert direction in ('min', 'max'), f'unknown objective direction {direction}'
+    else:
+        direction, expr = 'min', obj
+    if _is_IntVal(expr):
+        expr = expr.v
+    return direction, expr
+
+
+class Probe(T.NamedTuple):
+    """ Single bound probe of a minimization search """
+    lower: int
+    border: T.Optional[int]
+    upper: T.Optional[int]
+    result: str  # 'sat', 'unsat' or 'unknown'
+    value: T.Optional[int]  # scalar value if sat
+    elapsed: float  # seconds
+
+
 class SolverWrapper:
-    def __init__(self):
+    """ Solver together with its z3 context. Primitives and factories built against different wrappers
+        live in independent contexts, so they can be constructed and solved concurrently """
+    BACKENDS = ('binary', 'assumptions', 'optimize')
+    _GUARD_IDX = 0
+
+    def __init__(self, ctx: T.Optional[z3.Context] = None):
+        self.ctx = z3.main_ctx() if ctx is None else ctx
         self._sol = None
+        self._model = None
+        self.backend = 'binary'
+        self.optimize_timeout: T.Optional[float] = None
+        self.on_probe: T.Optional[T.Callable[[Probe], None]] = None
+        self.probes: T.List[Probe] = []  # of the last minimize()
+        self.proven = True  # last minimize() or model() finished: optimum (or unsat) proven, not cut by a timeout
+        self.instrumentation: T.Optional[Instrumentation] = None
+        self.portfolio: T.Optional[T.List[PF.Strategy]] = None
+        self.portfolio_timeout: T.Optional[float] = None
+        self.last_strategy: T.Optional[PF.Strategy] = None
         self.fresh_solver()
 
+    @classmethod
+    def isolated(cls) -> 'SolverWrapper':
+        """ Wrapper with its own fresh z3 context """
+        return cls(ctx=z3.Context())
+
     def fresh_solver(self, tactic='default'):
-        if isinstance(tactic, str):
-            tactic = z3.Tactic(tactic)
-        self._sol = tactic.solver()
+        if self.backend == 'optimize':
+            self._sol = z3.Optimize(ctx=self.ctx)
+        elif self.backend == 'assumptions' and tactic == 'default':
+            self._sol = z3.Solver(ctx=self.ctx)  # unlike tactic based solvers it's incremental and produces unsat cores
+        else:
+            if isinstance(tactic, str):
+                tactic = z3.Tactic(tactic, ctx=self.ctx)
+            self._sol = tactic.solver()
+        self._model = None
+
+    def set_backend(self, backend: str, timeout: T.Optional[float] = None):
+        """ Chooses how minimize() searches for optimum:
+            'binary' - binary_shrinking over a plain solver,
+            'assumptions' - incremental assumption_shrinking over a plain solver,
+            'optimize' - native z3.Optimize objectives.
+            timeout (seconds) applies to 'optimize', on expiry best solution found so far is used.
+            Takes effect with the next fresh_solver() (Factory calls it on construction) and survives it afterwards """
+        assert backend in self.BACKENDS, f'unknown backend {backend}'
+        self.backend = backend
+        self.optimize_timeout = timeout
+
+    def use_portfolio(self, strategies: T.Optional[T.List[PF.Strategy]] = PF.DEFAULT_PORTFOLIO, timeout=None):
+        """ Makes every check run as a parallel portfolio of strategies, None switches back to a single solver.
+            Setting survives fresh_solver() """
+        self.portfolio = strategies
+        self.portfolio_timeout = timeout
+
+    def instrument(self) -> Instrumentation:
+        """ Starts recording constraints, checks and probes (see instrumentation module), survives fresh_solver() """
+        self.instrumentation = Instrumentation()
+        return self.instrumentation
+
+    def span(self, name: str) -> T.ContextManager:
+        """ Named interval of the instrumentation trace, no-op if not instrumented """
+        return self.instrumentation.span(name) if self.instrumentation else contextlib.nullcontext()
 
     def add(self, *args):
+        if self.instrumentation:
+            self.instrumentation.constraints(args)
         self._sol.add(*args)
 
+    def push(self):
+        self._sol.push()
+
+    def pop(self):
+        self._sol.pop()
+
+    def assertions(self) -> z3.AstVector:
+        return self._sol.assertions()
+
+    def hint(self, var: z3.ExprRef, value) -> bool:
+        """ Suggests initial value of a variable for the next checks.
+            Not every solver takes hints (z3.Optimize of 'optimize' backend does), returns whether it was accepted """
+        if not isinstance(value, z3.ExprRef):
+            value = z3.IntVal(value, ctx=self.ctx)
+        try:
+            self._sol.set_initial_value(var, value)
+        except (z3.Z3Exception, AttributeError):
+            return False
+        return True
+
+    def to_smt2(self) -> str:
+        return self._sol.to_smt2()
+
+    def use_model(self, m: T.Optional[z3.ModelRef]):
+        """ Makes eval() work with externally obtained model, e.g. restored from a solution cache """
+        self._model = m
+
+    def _check(self, *assumptions) -> z3.CheckSatResult:
+        """ Checks current assertions, remembers model if any """
+        if self.instrumentation:
+            start = self.instrumentation.now()
+            res = self._check_once(*assumptions)
+            self.instrumentation.check(start, res, len(assumptions), self._sol)
+            return res
+        return self._check_once(*assumptions)
+
+    def _check_once(self, *assumptions) -> z3.CheckSatResult:
+        if self.portfolio and not isinstance(self._sol, z3.Optimize):
+            res, self._model = self._check_portfolio(*assumptions)
+        else:
+            res = self._sol.check(*assumptions)
+            self._model = self._sol.model() if res == z3.sat else None
+        return res
+
+    def _check_portfolio(self, *assumptions) -> T.Tuple[z3.CheckSatResult, T.Optional[z3.ModelRef]]:
+        self._sol.push()
+        self._sol.add(*assumptions)
+        try:
+            r, self.last_strategy, dump = PF.solve_portfolio(self.to_smt2(), self.portfolio,
+                                                             timeout=self.portfolio_timeout)
+            if r == 'unsat':
+                return z3.unsat, None
+            if r == 'unknown':
+                return z3.unknown, None
+
+            # Loading winner's model back, pinned check should be trivial for the local solver
+            self._sol.push()
+            self._sol.add(PF.model_pins(PF.collect_decls(self._sol.assertions()), dump))
+            res = self._sol.check()
+            model = self._sol.model() if res == z3.sat else None
+            self._sol.pop()
+            if res != z3.sat:
+                res = self._sol.check()
+                model = self._sol.model() if res == z3.sat else None
+            return res, model
+        finally:
+            self._sol.pop()
+
     def eval(self, arg):
         """ Smart evaluator, if base type is passed returns as is, if z3 sort - evaluates, if aggregate object - invokes .eval method """
         if isinstance(arg, int):
@@ -33,7 +185,7 @@ class SolverWrapper:
         if isinstance(arg, (BasePoint2D, BaseSegment)):
             return arg.eval()
 
-        res = self._sol.model().eval(arg)
+        res = self._model.eval(arg)
         if isinstance(res, (z3.IntNumRef, z3.ArithRef)):
             res = res.as_long()
         elif isinstance(res, z3.DatatypeRef):
@@ -42,10 +194,16 @@ class SolverWrapper:
             raise ValueError('unknown result', type(res), res)
         return res
 
+    def last_model(self) -> T.Optional[z3.ModelRef]:
+        """ Model of the last check or minimize() without checking again """
+        return self._model
+
     def model(self):
-        chk = self._sol.check()
+        chk = self._check()
+        if chk == z3.unknown:
+            self.proven = False
         if chk.r == 1:
-            return self._sol.model()
+            return self._model
 
     def shrinker_loop(self, scalar, init=None, restore=True):
         if _is_IntVal(scalar):  # FIXME hacky, but have to break dependency loop somehow
@@ -55,7 +213,7 @@ class SolverWrapper:
         if init:
             self._sol.add(scalar <= init)
         best_val = None
-        while self._sol.check().r == 1:
+        while self._check().r == 1:
             scalar_val = self.eval(scalar)
             best_val = scalar_val
             yield scalar_val
@@ -68,40 +226,55 @@ class SolverWrapper:
 
         if restore and best_val is not None:
             self._sol.add(scalar == best_val)
-            chk = self._sol.check()
+            chk = self._check()
             assert chk.r == 1
 
-    def binary_shrinking(self, scalar, lower=0, upper=None):
+    def binary_shrinking(self, scalar, lower=0, upper=None, on_probe: T.Optional[T.Callable[[Probe], None]] = None):
+        """ Binary search of scalar's minimum, every probe rebuilds bounds in a fresh scope.
+            upper is expected to be attainable, if it's not the search continues above it without bounds.
+            A probe coming back unknown (portfolio timeout) stops the search with the best value found so far
+            and clears proven. Probes are reported to on_probe if given, printed otherwise """
         if _is_IntVal(scalar):
             scalar = scalar.v
 
         self._sol.push()
 
-        best_val = None
+        best_val = best_model = None
+        finished = True
 
-        while upper is None or upper - lower >= 1:
+        # upper itself is probed last if everything below it is infeasible
+        while upper is None or upper - lower >= (1 if best_val is not None else 0):
             if upper is not None:
                 border = (lower + upper) // 2
             else:
                 border = None
-            print('LBU', lower, border, upper)
+            if on_probe is None:
+                print('LBU', lower, border, upper)
             t0 = time()
 
             self._sol.add(lower <= scalar)
 
-            if border:
+            if border is not None:
                 self._sol.add(scalar <= border)
-            res = self._sol.check()
+            res = self._check()
             dt = time() - t0
-            print(f'R={res.r}; T={dt:0.3f}')
+            scalar_val = self.eval(scalar) if res.r == 1 else None
+            probe = Probe(lower, border, upper, str(res), scalar_val, dt)
+            self._record_probe(probe)
+            if on_probe is None:
+                print(f'R={res.r}; T={dt:0.3f}')
+                print('V=', 'unsat' if scalar_val is None else scalar_val)
+            else:
+                on_probe(probe)
             if res.r == 1:
-                scalar_val = self.eval(scalar)
-                print('V=', scalar_val)
                 upper = scalar_val
                 if best_val is None or best_val > scalar_val:
-                    best_val = scalar_val
+                    best_val, best_model = scalar_val, self._model
+            elif res == z3.unknown:  # neither a solution nor a proof there's none below border
+                finished = self.proven = False
+                break
             elif border is None:
-                print('V=unsat')
+                self._sol.pop()
                 return None  # No solution at all
             else:
                 lower = border + 1
@@ -112,11 +285,204 @@ class SolverWrapper:
         # Have to repeat check to restore model so it can be accessed by client code
         self._sol.pop()
 
+        if best_val is None:
+            if not finished:
+                return None
+            # everything up to given upper bound is infeasible
+            return self.binary_shrinking(scalar, lower, None, on_probe=on_probe)
+
         if res.r != 1:
-            assert best_val is not None
             self._sol.add(scalar == best_val)
-            chk = self._sol.check()
-            assert chk.r == 1
+            if self._check() != z3.sat:  # timed out again, the model is known anyway
+                self._model = best_model
+                self.proven = False
 
         return best_val
 
+    def assumption_shrinking(self, scalar, lower=0, upper=None,
+                             on_probe: T.Optional[T.Callable[[Probe], None]] = None):
+        """ Binary search of scalar's minimum keeping solver's learned state between probes.
+            Every bound is a guarded literal 'guard => scalar <= bound' asserted once and enabled via check(assumptions).
+            Each probe also assumes the weakest possible improvement (scalar < best), if unsat core shows
+            it's the culprit the search finishes right away, generally lower bound jumps past the bounds in the core.
+            As with binary_shrinking, infeasible upper bound makes the search continue above it
+            and unknown result stops the search """
+        if _is_IntVal(scalar):
+            scalar = scalar.v
+
+        if not isinstance(self._sol, z3.Optimize):
+            self._sol.set('core.minimize', True)
+        self._sol.push()
+        self.__class__._GUARD_IDX += 1
+        prefix = f'__bound{self._GUARD_IDX}'
+        guards = {}
+
+        def at_most(bound: int) -> z3.BoolRef:
+            if bound not in guards:
+                guards[bound] = z3.Bool(f'{prefix}_le_{bound}', ctx=self.ctx)
+                self._sol.add(z3.Implies(guards[bound], scalar <= bound))
+            return guards[bound]
+
+        lower_guard = z3.Bool(f'{prefix}_lower', ctx=self.ctx)
+        self._sol.add(z3.Implies(lower_guard, lower <= scalar))
+
+        best_val = None
+        best_model = None
+        finished = True
+        while upper is None or upper - lower >= (1 if best_val is not None else 0):
+            border = None if upper is None else (lower + upper) // 2
+            assumptions = [lower_guard]
+            if border is not None:
+                assumptions.append(at_most(border))
+                if upper - 1 > border:
+                    assumptions.append(at_most(upper - 1))
+
+            t0 = time()
+            res = self._check(*assumptions)
+            dt = time() - t0
+
+            scalar_val = self.eval(scalar) if res == z3.sat else None
+            probe = Probe(lower, border, upper, str(res), scalar_val, dt)
+            self._record_probe(probe)
+            if on_probe is not None:
+                on_probe(probe)
+
+            if res == z3.sat:
+                upper = scalar_val
+                best_val, best_model = scalar_val, self._model
+            elif res == z3.unsat:
+                core = set(c.get_id() for c in self._core(assumptions))
+                core_bounds = [b for b, g in guards.items() if g.get_id() in core]
+                if not core_bounds:
+                    break  # infeasible regardless of bounds
+                lower = min(core_bounds) + 1  # conjunction of bounds in core is the tightest of them
+                self._sol.add(scalar >= lower)  # proven, so keeping it as a plain fact is safe
+            else:
+                finished = self.proven = False  # timed out, best value so far is the result
+                break
+
+        self._sol.pop()
+
+        if best_val is None and upper is not None and finished:
+            return self.assumption_shrinking(scalar, lower, None, on_probe=on_probe)
+        if best_val is not None:
+            self._sol.add(scalar == best_val)
+        self._model = best_model
+        return best_val
+
+    def _record_probe(self, probe: Probe):
+        self.probes.append(probe)
+        if self.instrumentation:
+            self.instrumentation.probe(probe)
+
+    def _core(self, assumptions) -> T.List[z3.BoolRef]:
+        """ Unsat core of the last check, all assumptions if solver can't tell (tactic based solvers give empty cores) """
+        if self.portfolio and not isinstance(self._sol, z3.Optimize):
+            return assumptions
+        try:
+            core = list(self._sol.unsat_core())
+        except z3.Z3Exception:
+            return assumptions
+        return core if core else assumptions
+
+    def minimize(self, metrics, priority='lex', lower=0, upper: T.Optional[int] = None):
+        """ Minimizes metric (or list of objectives) with the configured backend.
+            Objectives are expressions to minimize or ('max', expr) / ('min', expr) tuples.
+            lower and upper bound the first objective for the shrinking backends, lower must be valid,
+            upper should be attainable (see binary_shrinking), optimize backend ignores them.
+            Optimum is fixed in the solver afterwards, so model() reproduces it.
+            Returns value of a single metric or list of values, None if there is no solution.
+            proven tells whether the search finished, it's False if a timeout cut it short """
+        single = not isinstance(metrics, (list, tuple)) or isinstance(metrics, tuple) and isinstance(metrics[0], str)
+        objectives = [metrics] if single else list(metrics)
+        self.probes = []
+        self.proven = True
+
+        if self.backend == 'optimize':
+            values = self.optimize(objectives, priority=priority, timeout=self.optimize_timeout)
+        else:
+            if priority != 'lex':
+                raise ValueError(f'priority {priority} is supported only by optimize backend')
+            values = []
+            for k, (direction, expr) in enumerate(map(_objective, objectives)):
+                if direction != 'min':
+                    raise ValueError('maximization is supported only by optimize backend')
+                lo, up = (lower, upper) if k == 0 else (0, None)
+                if self.backend == 'assumptions':
+                    val = self.assumption_shrinking(expr, lo, up, on_probe=self.on_probe)
+                else:
+                    val = self.binary_shrinking(expr, lo, up, on_probe=self.on_probe)
+                if val is None:
+                    return None
+                self.add(expr == val)  # lexicographic: later objectives can't spoil earlier ones
+                values.append(val)
+
+        if values is None:
+            return None
+        return values[0] if single else values
+
+    def optimize(self, objectives: list, priority='lex', timeout: T.Optional[float] = None) -> T.Optional[T.List[int]]:
+        """ Solves objectives with z3.Optimize, priority is one of 'lex', 'box', 'pareto'
+            (for pareto first point of the front is taken, see pareto_front).
+            On timeout the best model found so far is used and proven is cleared. Returns values of objectives """
+        assert isinstance(self._sol, z3.Optimize), 'optimize requires optimize backend'
+        objectives = [_objective(o) for o in objectives]
+        opt = self._sol
+
+        best = []
+        opt.set_on_model(lambda m: best.append(m))
+        opt.set(priority=priority)
+        opt.set(timeout=int(timeout * 1000) if timeout else _NO_TIMEOUT)
+
+        opt.push()
+        for direction, expr in objectives:
+            if direction == 'min':
+                opt.minimize(expr)
+            else:
+                opt.maximize(expr)
+
+        start = self.instrumentation.now() if self.instrumentation else None
+        res = opt.check()
+        if self.instrumentation:
+            self.instrumentation.check(start, res, 0, opt)
+        if res == z3.sat:
+            model = opt.model()
+        else:
+            model = best[-1] if res == z3.unknown and best else None
+            self.proven = res != z3.unknown
+        opt.pop()
+        opt.set(timeout=_NO_TIMEOUT)
+
+        if model is None:
+            self._model = None
+            return None
+
+        values = [model.eval(expr, model_completion=True).as_long() for _, expr in objectives]
+        for (_, expr), val in zip(objectives, values):
+            opt.add(expr == val)
+        self._model = model
+        return values
+
+    def pareto_front(self, objectives: list, timeout: T.Optional[float] = None) -> T.Iterator[T.List[int]]:
+        """ Iterates over Pareto optimal values of objectives, model of the current point is accessible via eval """
+        assert isinstance(self._sol, z3.Optimize), 'pareto_front requires optimize backend'
+        objectives = [_objective(o) for o in objectives]
+        opt = self._sol
+        opt.set(priority='pareto')
+        if timeout:
+            opt.set(timeout=int(timeout * 1000))
+
+        opt.push()
+        for direction, expr in objectives:
+            if direction == 'min':
+                opt.minimize(expr)
+            else:
+                opt.maximize(expr)
+        try:
+            while opt.check() == z3.sat:
+                self._model = opt.model()
+                yield [self._model.eval(expr, model_completion=True).as_long() for _, expr in objectives]
+        finally:
+            opt.pop()
+            opt.set(priority='lex')
+            opt.set(timeout=_NO_TIMEOUT)
@@ -1,37 +1,59 @@
+import math
 import typing as T
+import warnings
 
 import z3 as Z
 
+from factory_theory import bounds as B
+from factory_theory import placement as PL
 from factory_theory import primitives as P
+from factory_theory import symmetry as S
+from factory_theory.solver_wrapper import _objective
+
+
+class WarmStartError(Exception):
+    pass
 
 
 class SubFactory:
-    def __init__(self, area: T.Optional = None):
-        self.area = P.Rectangle(size=None) if area is None else area
+    def __init__(self, area: T.Optional = None, sol: T.Optional[P.SolverWrapper] = None):
+        self.sol = P.resolve_solver(sol)
+        self.area = P.Rectangle(size=None, sol=self.sol) if area is None else area
         # These are elements managed by this subfactory
         self.buildings: T.List[P.Rectangle] = []
         self.inserters: T.List[P.Inserter] = []
         self.segmented_belts: T.List[P.SegmentedBelt] = []
 
         self.areas: T.List[P.Rectangle] = []
+        self.connections: T.List[tuple] = []  # (obj1, inserter, obj2) made by connect_with_inserter
+
+        # skip non-intersection constraints for pairs whose position bounds don't overlap
+        self.prune_pairs = True
+        self.pair_stats: T.Dict[str, T.Tuple[int, int]] = {}  # kind -> (pruned, total)
+        # order interchangeable buildings and belts, see add_symmetry_breaking
+        self.break_symmetries = False
+        self.symmetry_classes: T.List[list] = []
 
+        self.warm_pinned = 0  # entities pinned by warm_start
         self.finalized = False
 
     # Constructing
-    def new_machine(self, color: str, size=3):
-        m = P.AssemblyMachine(size=size)
+    def new_machine(self, color: str, size=3, pos: T.Optional[T.Tuple[int, int]] = None):
+        """ pos - fixed position, the machine is placed by the solver without it """
+        x, y = pos if pos is not None else (None, None)
+        m = P.AssemblyMachine(size=size, x=x, y=y, sol=self.sol)
         m.color = color
         self.buildings.append(m)
         return m
 
     def new_inserter(self, unit_len_only=True, color: str = 'y'):
-        ins = P.Inserter(unit_len_only=unit_len_only)
+        ins = P.Inserter(unit_len_only=unit_len_only, sol=self.sol)
         ins.color = color
         self.inserters.append(ins)
         return ins
 
-    def new_segmented_belt(self, max_segs=None, color: str = 'gray'):
-        b = P.SegmentedBelt(max_segs=max_segs)
+    def new_segmented_belt(self, max_segs=None, color: str = 'gray', bounded=False):
+        b = P.SegmentedBelt(max_segs=max_segs, bounded=bounded, sol=self.sol)
         b.color = color
         self.segmented_belts.append(b)
         return b
@@ -40,14 +62,14 @@ class SubFactory:
         if p1 and p2:
             if isinstance(p1, tuple):
                 assert len(p1) == 2
-                p1 = P.Point2D(*p1)
+                p1 = P.Point2D(*p1, sol=self.sol)
             if isinstance(p2, tuple):
                 assert len(p2) == 2
-                p2 = P.Point2D(*p2)
+                p2 = P.Point2D(*p2, sol=self.sol)
 
-            r = P.Rectangle(size=P.Point2D(p2.x - p1.x + 1, p2.y - p1.y + 1), x=p1.x, y=p1.y)
+            r = P.Rectangle(size=P.Point2D(p2.x - p1.x + 1, p2.y - p1.y + 1, sol=self.sol), x=p1.x, y=p1.y, sol=self.sol)
         elif p1 is None and p2 is None:
-            r = P.Rectangle(size=None)
+            r = P.Rectangle(size=None, sol=self.sol)
         else:
             raise ValueError('area must be either fully specified or fully symbolic')
 
@@ -63,21 +85,184 @@ class SubFactory:
 
         ins = self.new_inserter(unit_len_only=unit_len_only)
         if isinstance(obj1, P.Point2D):
-            P.SOL.add(obj1 == ins.source())
+            self.add(obj1 == ins.source())
         else:
-            P.SOL.add(obj1.contains(ins.source()))
+            self.add(obj1.contains(ins.source()))
 
         if isinstance(obj2, P.Point2D):
-            P.SOL.add(obj2 == ins.sink())
+            self.add(obj2 == ins.sink())
         else:
-            P.SOL.add(obj2.contains(ins.sink()))
+            self.add(obj2.contains(ins.sink()))
 
+        self.connections.append((obj1, ins, obj2))
         return ins
 
-    @classmethod
     def add(self, constraint):
         """ Add arbitrary constraint """
-        P.SOL.add(constraint)
+        self.sol.add(constraint)
+
+    # Warm start
+    def warm_start(self, layout: dict, changed: T.Optional[list] = None, radius: int = 0) -> T.Tuple[int, int]:
+        """ Reuses a prior solution (see layout.extract_layout), entities are matched to it by list index.
+            Without changed, prior positions are only hints for the solver (see SolverWrapper.hint).
+            With changed entities, ones farther than radius cells from the prior position of any changed entity
+            are pinned to their prior positions, the rest stay free and get hints.
+            Hints need a solver taking them, without one hints only mode raises WarmStartError, pinning warns.
+            If the pins leave no layout, finalize_and_model raises WarmStartError.
+            Returns numbers of (pinned, hinted) entities, hinted ones took at least one hint """
+        entities = self._prior_entities(layout)
+        centers = [box for e, box, _ in entities if changed is not None and any(e is c for c in changed)]
+
+        free = [(e, prior) for e, box, prior in entities
+                if changed is None or any(_box_distance(box, c) <= radius for c in centers)]
+        hintable = [(e, pairs) for e, pairs in ((e, _hints(e, prior)) for e, prior in free) if pairs]
+        if hintable and not self.sol.hint(*hintable[0][1][0]):
+            if changed is None:
+                raise WarmStartError('solver takes no hints, use optimize backend or pin entities with changed')
+            warnings.warn(f'solver takes no hints, {len(free)} free entities start from scratch')
+            hintable = []
+
+        pinned = 0
+        for e, box, prior in entities:
+            if not any(e is f for f, _ in free):
+                self.add(Z.And(_pins(e, prior)))
+                pinned += 1
+        hinted = sum(any([self.sol.hint(var, val) for var, val in pairs]) for _, pairs in hintable)  # applies all
+        self.warm_pinned += pinned
+        return pinned, hinted
+
+    def _prior_entities(self, layout: dict) -> T.List[tuple]:
+        """ [(entity, prior bounding box, prior)] for entities present in the prior layout """
+        res = []
+        for b, (x, y, w, h) in zip(self.buildings, layout['buildings']):
+            res.append((b, (x, x + w - 1, y, y + h - 1), (x, y)))
+        for ins, (x, y, d, arm_len) in zip(self.inserters, layout['inserters']):
+            res.append((ins, (x, x, y, y), (x, y, d, arm_len)))
+        for sb, corners in zip(self.segmented_belts, layout['belts']):
+            xs, ys = [c[0] for c in corners], [c[1] for c in corners]
+            res.append((sb, (min(xs), max(xs), min(ys), max(ys)), [tuple(c) for c in corners]))
+        return res
+
+    # Metric bounds
+    def metric_lower_bound(self, metric) -> float:
+        """ Lower bound of a linear metric, -inf if nothing is known.
+            Belt lengths (SegmentedBelt.len of bounded belts) are at least distances between belt ends,
+            area sides together have to fit every building and the sum of building areas,
+            remaining terms are bounded by propagated intervals (see bounds.Bounds) """
+        bounds = B.Bounds(self.sol.assertions())
+        lin = B._linear(Z.simplify(_objective(metric)[1]))
+        if lin is None:
+            return -math.inf
+        terms, res = dict(lin[0]), lin[1]
+
+        for sb in self.segmented_belts:
+            if sb.max_segs is None:
+                continue
+            k = _multiple(terms, B._linear(Z.simplify(sb.len())))
+            if k:
+                belt_terms, belt_const = B._linear(Z.simplify(sb.len()))
+                for tid in belt_terms:
+                    del terms[tid]
+                res += k * (bounds.belt_len_lower(sb) - belt_const)
+
+        sx, sy = [_term_id(v) for v in (self.area.size.x, self.area.size.y)]
+        cx, cy = terms.get(sx, (0, None))[0], terms.get(sy, (0, None))[0]
+        if self.buildings and (cx > 0 or cy > 0):
+            sizes = [(max(0, bounds.expr(b.size.x)[0]), max(0, bounds.expr(b.size.y)[0])) for b in self.buildings]
+            w_lo = max(bounds.expr(self.area.size.x)[0], max(w for w, _ in sizes))
+            h_lo = max(bounds.expr(self.area.size.y)[0], max(h for _, h in sizes))
+            if cx > 0 and cy > 0:
+                res += B.min_perimeter(cx, cy, int(w_lo), int(h_lo), sum(w * h for w, h in sizes))
+                del terms[sx], terms[sy]
+            elif cx > 0:
+                res += cx * w_lo
+                del terms[sx]
+            else:
+                res += cy * h_lo
+                del terms[sy]
+
+        for c, t in terms.values():
+            res += B._scale(c, bounds.term(t))[0]
+        return res
+
+    def metric_upper_bound(self, metric) -> float:
+        """ Upper bound of a linear metric from propagated intervals, inf if nothing is known """
+        return B.Bounds(self.sol.assertions()).expr(_objective(metric)[1])[1]
+
+    # Symmetries
+    def add_symmetry_breaking(self, objectives: T.Iterable[Z.ExprRef] = ()) -> int:
+        """ Finds classes of interchangeable buildings and belts and orders each class lexicographically
+            by position (belts by source), so the solver doesn't walk through permutations in unsat proofs.
+            An entity moves together with inserters connected to it, two entities are interchangeable
+            if swapping them maps current assertions and objectives onto themselves.
+            Call after finalize, returns number of added constraints """
+        syms = S.Symmetries(list(self.sol.assertions()) + list(objectives))
+        attached: T.Dict[int, list] = {}
+        for obj1, ins, obj2 in self.connections:
+            for o in (obj1, obj2):
+                attached.setdefault(id(o), []).append(ins)
+
+        def unit_vars(e) -> list:
+            return sum([S.entity_vars(u) for u in [e] + attached.get(id(e), [])], [])
+
+        self.symmetry_classes = []
+        added = 0
+        for kind in (self.buildings, self.segmented_belts):
+            classes: T.List[list] = []  # every member is checked against the first one
+            for e in kind:
+                for cls in classes:
+                    renaming = S.swap(unit_vars(cls[0]), unit_vars(e))
+                    if renaming and syms.invariant(renaming):
+                        cls.append(e)
+                        break
+                else:
+                    classes.append([e])
+
+            for cls in classes:
+                if len(cls) < 2:
+                    continue
+                self.symmetry_classes.append(cls)
+                for e1, e2 in zip(cls, cls[1:]):
+                    self.add(S.lex_leq(*[_order_key(e) for e in (e1, e2)]))
+                    added += 1
+        return added
+
+    # Heuristic placement
+    def greedy_placement(self, gap: int = 1, iters: int = 200, seed: int = 0,
+                         wire_weight: float = 0.5) -> T.Optional[PL.Placement]:
+        """ Places buildings by placement.anneal keeping ones connected by inserters (directly or via a belt) close.
+            Positions fixed by current assertions are respected, other constraints are not,
+            so the result has to be checked by the solver. None if some building has no fixed size """
+        if not self.buildings:
+            return None
+        bounds = B.Bounds(self.sol.assertions())
+        sizes, fixed = [], {}
+        for i, b in enumerate(self.buildings):
+            (w, w_hi), (h, h_hi) = bounds.expr(b.size.x), bounds.expr(b.size.y)
+            if w != w_hi or h != h_hi:
+                return None
+            sizes.append((int(w), int(h)))
+            x_lo, x_hi, y_lo, y_hi = bounds.point_box(b.pos)
+            if x_lo == x_hi and y_lo == y_hi:
+                fixed[i] = (int(x_lo), int(y_lo))
+        return PL.anneal(sizes, self._building_nets(), fixed, gap=gap, wire_weight=wire_weight, iters=iters, seed=seed)
+
+    def _building_nets(self) -> T.List[PL.Net]:
+        """ Pairs of buildings connected by an inserter or sharing a belt """
+        idx = {id(b): i for i, b in enumerate(self.buildings)}
+        nets = set()
+        by_belt: T.Dict[int, T.Set[int]] = {}
+        for obj1, _, obj2 in self.connections:
+            ends = [idx.get(id(o)) for o in (obj1, obj2)]
+            if None not in ends and ends[0] != ends[1]:
+                nets.add(tuple(sorted(ends)))
+            for o, other in ((obj1, ends[1]), (obj2, ends[0])):
+                if isinstance(o, P.SegmentedBelt) and other is not None:
+                    by_belt.setdefault(id(o), set()).add(other)
+        for members in by_belt.values():
+            members = sorted(members)
+            nets.update((i, j) for k, i in enumerate(members) for j in members[k + 1:])
+        return sorted(nets)
 
     # Finalization
     def finalize(self):
@@ -95,24 +280,60 @@ class SubFactory:
         pass
 
     def _add_non_intersecting_all(self):
+        pairs = self._candidate_pairs()
+
         # forbid intra-class intersections
-        P.SOL.add(P.non_intersecting_rectangles(self.buildings))
+        cases = [b1.non_intersecting(b2) for b1, b2 in pairs('buildings', self.buildings)]
+        self.add(Z.And(cases) if cases else True)
 
-        for ins1, ins2 in self._forall_commutative_pairs(self.inserters):
-            P.SOL.add(Z.Not(ins1.pos == ins2.pos))
+        for ins1, ins2 in pairs('inserters', self.inserters):
+            self.add(Z.Not(ins1.pos == ins2.pos))
 
-        for sb1, sb2 in self._forall_commutative_pairs(self.segmented_belts):
-            P.SOL.add(P.non_intersecting_seg_belts(sb1, sb2))
+        for sb1, sb2 in pairs('belts', self.segmented_belts):
+            self.add(P.non_intersecting_seg_belts(sb1, sb2))
 
         # forbid inter-class intersections
-        for b, ins in self._forall_pairs(self.buildings, self.inserters):
-            P.SOL.add(Z.Not(b.contains(ins.pos)))
+        for b, ins in pairs('buildings-inserters', self.buildings, self.inserters):
+            self.add(Z.Not(b.contains(ins.pos)))
+
+        for b, sb in pairs('buildings-belts', self.buildings, self.segmented_belts):
+            self.add(P.non_intersecting_seg_belt_diag_seg(sb, b.to_diag_seg()))
+
+        for ins, sb in pairs('inserters-belts', self.inserters, self.segmented_belts):
+            self.add(sb.not_contains(ins.pos))
+
+    def _candidate_pairs(self) -> T.Callable:
+        """ Returns pairs(kind, col1, col2=None) enumerating entity pairs which may intersect.
+            Without pruning these are all pairs, otherwise ones whose bounding boxes
+            (propagated from current assertions plus containment in the area) overlap """
+        self.pair_stats = {}
+        boxes = {}
+        if self.prune_pairs:
+            facts = list(self.sol.assertions()) + [b.inside(self.area) for b in self.buildings]
+            bounds = B.Bounds(facts)
+            boxes.update((id(b), bounds.rect_box(b)) for b in self.buildings)
+            boxes.update((id(ins), bounds.point_box(ins.pos)) for ins in self.inserters)
+            boxes.update((id(sb), bounds.belt_box(sb)) for sb in self.segmented_belts)
 
-        for b, sb in self._forall_pairs(self.buildings, self.segmented_belts):
-            P.SOL.add(P.non_intersecting_seg_belt_diag_seg(sb, b.to_diag_seg()))
+        def pairs(kind: str, col1: list, col2: T.Optional[list] = None):
+            if self.prune_pairs:
+                idx = B.overlapping_pairs([boxes[id(e)] for e in col1],
+                                          None if col2 is None else [boxes[id(e)] for e in col2])
+                res = [(col1[i], (col1 if col2 is None else col2)[j]) for i, j in idx]
+            elif col2 is None:
+                res = list(self._forall_commutative_pairs(col1))
+            else:
+                res = list(self._forall_pairs(col1, col2))
+            total = len(col1) * (len(col1) - 1) // 2 if col2 is None else len(col1) * len(col2)
+            self.pair_stats[kind] = (total - len(res), total)
+            return res
+        return pairs
 
-        for ins, sb in self._forall_pairs(self.inserters, self.segmented_belts):
-            P.SOL.add(sb.not_contains(ins.pos))
+    def pruning_report(self) -> str:
+        pruned = sum(p for p, _ in self.pair_stats.values())
+        total = sum(t for _, t in self.pair_stats.values())
+        details = ', '.join(f'{kind} {p}/{t}' for kind, (p, t) in self.pair_stats.items() if t)
+        return f'pruned {pruned} of {total} non-intersection constraints' + (f' ({details})' if details else '')
 
     @staticmethod
     def _forall_commutative_pairs(collection: list):
@@ -124,4 +345,62 @@ class SubFactory:
     def _forall_pairs(col1: list, col2: list):
         for e1 in col1:
             for e2 in col2:
-                yield e1, e2
\ No newline at end of file
+                yield e1, e2
+
+
+def _order_key(e) -> list:
+    p = e.pos if isinstance(e, P.Rectangle) else e.source()
+    return [p.x, p.y]
+
+
+def _term_id(e) -> T.Optional[int]:
+    lin = B._linear(Z.simplify(e)) if isinstance(e, Z.ExprRef) else None
+    if lin is None or len(lin[0]) != 1:
+        return None
+    return next(iter(lin[0]))
+
+
+def _multiple(terms: dict, sub) -> T.Optional[int]:
+    """ k > 0 such that linear form terms contains k times all terms of sub, None if there is no such """
+    if sub is None or not sub[0]:
+        return None
+    k = None
+    for tid, (c, _) in sub[0].items():
+        if tid not in terms or terms[tid][0] % c:
+            return None
+        if k is None:
+            k = terms[tid][0] // c
+        if k <= 0 or terms[tid][0] != k * c:
+            return None
+    return k
+
+
+def _box_distance(b1: tuple, b2: tuple) -> int:
+    """ Chebyshev gap between boxes (x_lo, x_hi, y_lo, y_hi), 0 if they touch or overlap """
+    return max(0, b2[0] - b1[1], b1[0] - b2[1], b2[2] - b1[3], b1[2] - b2[3])
+
+
+def _pins(e, prior) -> T.List[Z.BoolRef]:
+    if isinstance(e, P.Rectangle):
+        return [e.pos == prior]
+    if isinstance(e, P.Inserter):
+        x, y, d, arm_len = prior
+        return [e.pos == (x, y), e.dir.v == P.DirVal(value=d, sol=e.sol).v, e.arm_len.v == arm_len]
+    corners = prior
+    return [e.num_segs == len(corners) - 1] + [e.corner(k) == c for k, c in enumerate(corners)]
+
+
+def _hints(e, prior) -> T.List[tuple]:
+    """ (variable, value) pairs, only plain variables can take initial values """
+    if isinstance(e, P.Rectangle):
+        pairs = [(e.pos.x, prior[0]), (e.pos.y, prior[1])]
+    elif isinstance(e, P.Inserter):
+        x, y, d, arm_len = prior
+        pairs = [(e.pos.x, x), (e.pos.y, y), (e.dir.v, P.DirVal(value=d, sol=e.sol).v), (e.arm_len.v, arm_len)]
+    else:
+        corners = prior
+        pairs = [(e.num_segs, len(corners) - 1)]
+        if e.bounded:
+            for k, (x, y) in enumerate(corners[:e.max_segs + 1]):
+                pairs += [(e.corners_x[k], x), (e.corners_y[k], y)]
+    return [(var, val) for var, val in pairs if Z.is_const(var) and not Z.is_int_value(var)]
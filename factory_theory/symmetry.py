@@ -0,0 +1,139 @@
+""" Detection of interchangeable entities and symmetry breaking constraints.
+    Entities are interchangeable if swapping their variables maps the set of assertions onto itself,
+    assertions are compared modulo order of arguments of commutative operations """
+import typing as T
+
+import z3
+
+from factory_theory import primitives as P
+
+_COMMUTATIVE = {z3.Z3_OP_AND, z3.Z3_OP_OR, z3.Z3_OP_ADD, z3.Z3_OP_MUL, z3.Z3_OP_EQ, z3.Z3_OP_DISTINCT,
+                z3.Z3_OP_XOR, z3.Z3_OP_IFF}
+
+
+def conjuncts(exprs: T.Iterable[z3.ExprRef]) -> T.List[z3.ExprRef]:
+    """ Top level conjunctions split into parts """
+    res = []
+    todo = list(exprs)[::-1]
+    while todo:
+        e = todo.pop()
+        if z3.is_and(e):
+            todo.extend(e.children()[::-1])
+        else:
+            res.append(e)
+    return res
+
+
+def entity_vars(e) -> list:
+    """ Variables and values describing an entity, in the same order for entities of the same kind """
+    if isinstance(e, P.Rectangle):
+        return [e.pos.x, e.pos.y, e.size.x, e.size.y]
+    if isinstance(e, P.Inserter):
+        return [e.pos.x, e.pos.y, e.dir.v, e.arm_len.v]
+    if isinstance(e, P.SegmentedBelt):
+        corners = list(e.corners_x) + list(e.corners_y) if e.bounded else [e.corners_x, e.corners_y]
+        return [e.num_segs] + corners
+    raise ValueError('unsupported entity', type(e))
+
+
+def _name(v) -> T.Optional[str]:
+    """ Name of an uninterpreted constant or function, None for values """
+    if isinstance(v, z3.FuncDeclRef):
+        return v.name()
+    if z3.is_const(v) and v.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+        return v.decl().name()
+    return None
+
+
+def swap(vars1: list, vars2: list) -> T.Optional[T.Dict[str, str]]:
+    """ Renaming exchanging variables of two entities, None if they differ in fixed values """
+    if len(vars1) != len(vars2):
+        return None
+    res = {}
+    for v1, v2 in zip(vars1, vars2):
+        n1, n2 = _name(v1), _name(v2)
+        if n1 is None and n2 is None:
+            if str(v1) != str(v2):
+                return None
+        elif n1 is None or n2 is None:
+            return None
+        elif n1 != n2:
+            res[n1], res[n2] = n2, n1
+    return res
+
+
+class Symmetries:
+    """ Checks permutations of variable names against a fixed set of assertions """
+    def __init__(self, exprs: T.Iterable[z3.ExprRef]):
+        self.exprs = conjuncts(exprs)
+        self._by_name: T.Dict[str, T.Set[int]] = {}
+        for k, e in enumerate(self.exprs):
+            for name in self._names(e):
+                self._by_name.setdefault(name, set()).add(k)
+        self._ids: T.Dict[tuple, int] = {}  # interned canonical forms
+        self._plain: T.Dict[int, int] = {}  # canonical forms without renaming by ast id
+
+    @staticmethod
+    def _names(e: z3.ExprRef) -> T.Set[str]:
+        res, seen, todo = set(), set(), [e]
+        while todo:
+            e = todo.pop()
+            if e.get_id() in seen:
+                continue
+            seen.add(e.get_id())
+            if z3.is_quantifier(e):
+                todo.append(e.body())
+            elif z3.is_app(e):
+                if e.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                    res.add(e.decl().name())
+                todo.extend(e.children())
+        return res
+
+    def _canonical(self, e: z3.ExprRef, renaming: T.Dict[str, str], memo: T.Dict[int, int]) -> int:
+        """ Interned id of e with renamed symbols and sorted arguments of commutative operations """
+        key = e.get_id()
+        if key in memo:
+            return memo[key]
+        if z3.is_quantifier(e):
+            form = ('q', e.is_forall(), e.num_vars(),
+                    tuple(str(e.var_sort(k)) for k in range(e.num_vars())),
+                    self._canonical(e.body(), renaming, memo))
+        elif z3.is_var(e):
+            form = ('v', z3.get_var_index(e))
+        else:
+            d = e.decl()
+            args = [self._canonical(c, renaming, memo) for c in e.children()]
+            if d.kind() == z3.Z3_OP_UNINTERPRETED:
+                head = ('u', renaming.get(d.name(), d.name()))
+            elif e.num_args() == 0:
+                head = ('c', e.sexpr())  # numerals, constructors and the like
+            else:
+                head = ('o', d.kind(), d.name())
+            if d.kind() in _COMMUTATIVE:
+                args.sort()
+            form = head + tuple(args)
+        res = memo[key] = self._ids.setdefault(form, len(self._ids))
+        return res
+
+    def invariant(self, renaming: T.Dict[str, str]) -> bool:
+        """ Whether renaming maps the assertions onto themselves """
+        affected = set()
+        for name in renaming:
+            affected |= self._by_name.get(name, set())
+        exprs = [self.exprs[k] for k in affected]
+        before = sorted(self._canonical(e, {}, self._plain) for e in exprs)
+        memo = {}
+        after = sorted(self._canonical(e, renaming, memo) for e in exprs)
+        return before == after
+
+
+def lex_leq(vals1: T.List[z3.ArithRef], vals2: T.List[z3.ArithRef]) -> z3.BoolRef:
+    """ vals1 <= vals2 lexicographically """
+    res = z3.BoolVal(True, ctx=_ctx(vals1 + vals2))
+    for v1, v2 in reversed(list(zip(vals1, vals2))):
+        res = z3.Or(v1 < v2, z3.And(v1 == v2, res))
+    return res
+
+
+def _ctx(vals) -> T.Optional[z3.Context]:
+    return next((v.ctx for v in vals if isinstance(v, z3.ExprRef)), None)
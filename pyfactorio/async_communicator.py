@@ -0,0 +1,108 @@
+""" asyncio counterpart of Communicator: the same NUL terminated protocol, but requests are pipelined.
+    The server answers in order, so replies are matched to a FIFO of pending requests """
+import asyncio
+import collections
+import typing as T
+
+
+class AsyncCommunicator:
+    """ Several Lua calls in flight over one connection. At most max_in_flight requests wait for replies,
+        further eval calls wait for a slot (backpressure). A timed out request keeps its place in the FIFO
+        until its reply arrives and is dropped, otherwise the replies after it would be shifted """
+    READ_LIMIT = 2 ** 20  # stream buffer, longer replies are read in parts of this size
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_in_flight: int = 16,
+                 timeout: T.Optional[float] = 10.):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.pending: T.Deque[asyncio.Future] = collections.deque()  # in order of sending
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._error: T.Optional[Exception] = None
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_replies())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=1268, **kwargs) -> 'AsyncCommunicator':
+        reader, writer = await asyncio.open_connection(host, port, limit=cls.READ_LIMIT)
+        return cls(reader, writer, **kwargs)
+
+    async def eval(self, lua_str: str, timeout: T.Optional[float] = ...) -> str:
+        """ Result of lua_str, raises asyncio.TimeoutError if it doesn't come in timeout seconds
+            (the default of the communicator, None waits forever) """
+        if timeout is ...:
+            timeout = self.timeout
+        await self._slots.acquire()
+        if self._error is not None:
+            self._slots.release()
+            raise self._error
+        fut = asyncio.get_running_loop().create_future()
+        # appending and writing without an await in between keeps pending in the order of the stream
+        self.pending.append(fut)
+        self.writer.write(lua_str.encode('ascii') + b'\0')
+        await self.writer.drain()
+        return await asyncio.wait_for(fut, timeout)
+
+    async def eval_many(self, lua_strs: T.Iterable[str], timeout: T.Optional[float] = ...) -> T.List[str]:
+        """ Results of all requests, sent without waiting for each other """
+        return list(await asyncio.gather(*(self.eval(s, timeout) for s in lua_strs)))
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    async def _read_replies(self):
+        try:
+            while True:
+                ans = await self._read_reply()
+                fut = self.pending.popleft()
+                self._slots.release()
+                if not fut.done():  # cancelled by timeout otherwise
+                    fut.set_result(ans.decode('ascii'))
+        except asyncio.IncompleteReadError as e:
+            self._fail(ConnectionError('connection closed by server') if not e.partial else
+                       ConnectionError(f'connection closed in the middle of a reply: {e.partial[:50]!r}'))
+        except IndexError:
+            self._fail(ConnectionError('reply to no request'))
+        except OSError as e:
+            self._fail(e)
+        except asyncio.CancelledError:
+            self._fail(ConnectionError('communicator closed'))
+            raise
+
+    async def _read_reply(self) -> bytes:
+        """ Bytes up to the next NUL, a reply longer than the buffer is collected part by part """
+        parts = []
+        while True:
+            try:
+                parts.append(await self.reader.readuntil(b'\0'))
+                return b''.join(parts)[:-1]
+            except asyncio.LimitOverrunError as e:
+                parts.append(await self.reader.readexactly(e.consumed))
+
+    def _fail(self, error: Exception):
+        """ Fails all waiting requests and the ones coming after. Released slots wake up eval calls
+            waiting for them, which see the error and pass their slot on """
+        self._error = error
+        while self.pending:
+            fut = self.pending.popleft()
+            if not fut.done():
+                fut.set_exception(error)
+            self._slots.release()
+
+    async def close(self):
+        self._reader_task.cancel()
+        try:
+            await self._reader_task
+        except asyncio.CancelledError:
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -1,30 +1,90 @@
 import os.path as osp
 import socket
+import threading
+import typing as T
+from concurrent.futures import Future
+from time import perf_counter
+
+import numpy as np
 
 from factory_theory.primitives import Point2D
 
 
+class FrameReader:
+    """ NUL terminated frames from a socket. Data is received straight into a preallocated bytearray,
+        consumed frames are dropped by moving the rest to the front, the buffer doubles when a frame doesn't fit.
+        Every byte is scanned for the terminator once, so a reply of n bytes takes O(n) """
+    def __init__(self, sock: socket.socket, buffer_size: int = 2 ** 20):
+        self.sock = sock
+        self.buf = bytearray(buffer_size)
+        self.start = 0  # of unconsumed data
+        self.end = 0  # of received data
+        self.scanned = 0  # no terminator in buf[start:scanned]
+        # metrics
+        self.bytes_received = 0
+        self.frames = 0
+        self.recv_calls = 0
+        self.recv_time = 0.
+
+    def read_frame(self) -> bytes:
+        """ Next frame without the terminator, raises ConnectionError if connection closes first """
+        while True:
+            k = self.buf.find(0, self.scanned, self.end)
+            if k >= 0:
+                frame = bytes(self.buf[self.start:k])
+                self.start = self.scanned = k + 1
+                if self.start == self.end:
+                    self.start = self.end = self.scanned = 0
+                self.frames += 1
+                return frame
+            self.scanned = self.end
+            self._fill()
+
+    def _fill(self):
+        if self.end == len(self.buf):
+            if self.start > len(self.buf) // 2:
+                n = self.end - self.start
+                self.buf[:n] = self.buf[self.start:self.end]
+                self.start, self.end, self.scanned = 0, n, self.scanned - self.start
+            else:
+                self.buf.extend(bytes(len(self.buf)))
+        t0 = perf_counter()
+        with memoryview(self.buf) as view:
+            n = self.sock.recv_into(view[self.end:])
+        self.recv_time += perf_counter() - t0
+        self.recv_calls += 1
+        if n == 0:
+            pending = self.end - self.start
+            raise ConnectionError('connection closed' + (f' in the middle of a frame, {pending} bytes received'
+                                                         if pending else ''))
+        self.end += n
+        self.bytes_received += n
+
+    def metrics(self) -> dict:
+        return {'bytes': self.bytes_received, 'frames': self.frames, 'recv_calls': self.recv_calls,
+                'recv_time': self.recv_time, 'buffer': len(self.buf),
+                'throughput': self.bytes_received / self.recv_time if self.recv_time else 0.}
+
+
 class Communicator:
     """ Object implementing basic factorio communication functionality """
     BUFFER_SIZE = 2 ** 20
 
-    def __init__(self, host='127.0.0.1', port=1268):
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.s.connect((host, port))
+    def __init__(self, host='127.0.0.1', port=1268, sock: socket.socket = None):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect((host, port))
+        self.s = sock
+        self.reader = FrameReader(self.s, self.BUFFER_SIZE)
+        self.lock = threading.Lock()  # request and its reply, the event dispatcher polls from its thread
 
     def eval(self, lua_str: str):
-        self.s.send(lua_str.encode('ascii') + b'\0')
-        res = self._receive_answer()
-        return res[:-1]
+        with self.lock:
+            self.s.sendall(lua_str.encode('ascii') + b'\0')
+            return self._receive_answer()
 
     def _receive_answer(self):
-        ans = b''
-        while True:
-            r = self.s.recv(self.BUFFER_SIZE)
-            ans += r
-            if ans[-1] == 0:
-                break
-        return ans.decode('ascii')
+        return self.reader.read_frame().decode('ascii')
 
     def close(self):
         self.s.close()
@@ -38,46 +98,191 @@ def readfile(path):
 import json
 
 
+class LuaError(RuntimeError):
+    pass
+
+
+class Call(T.NamedTuple):
+    """ High-level request: body of a Lua function and conversion of its result decoded from json """
+    lua: str
+    decode: T.Callable[[T.Any], T.Any] = lambda v: v
+
+
+def _xy(p) -> T.Tuple[float, float]:
+    if isinstance(p, tuple):
+        assert len(p) == 2
+        return p[0], p[1]
+    return p.x, p.y
+
+
+def _lua_filter(name=None, type=None) -> str:
+    """ Lua table of find_entities_filtered options, name and type are strings or lists of them """
+    fields = []
+    for key, v in (('name', name), ('type', type)):
+        if v is None:
+            continue
+        v = [v] if isinstance(v, str) else list(v)
+        fields.append(f'{key} = {{{", ".join(json.dumps(x) for x in v)}}}')
+    return '{' + ', '.join(fields) + '}' if fields else 'nil'
+
+
+ENTITY_DTYPE = np.dtype([('x', np.float64), ('y', np.float64), ('amount', np.int64), ('name', 'U64')])
+
+
+def decode_columns(res: dict) -> np.ndarray:
+    """ Reply of find_entities_columns as structured array with ENTITY_DTYPE """
+    x = np.fromstring(res['x'], sep=',')
+    ents = np.empty(len(x), dtype=ENTITY_DTYPE)
+    ents['x'] = x
+    ents['y'] = np.fromstring(res['y'], sep=',')
+    ents['amount'] = np.fromstring(res['amount'], sep=',')
+    names = np.array(list(res['names'] or []) or [''])  # table_to_json writes an empty list as {}
+    ents['name'] = names[np.fromstring(res['name'], sep=',').astype(np.int64)]
+    return ents
+
+
+def batch_chunk(calls: T.List[Call]) -> str:
+    """ Lua chunk running calls one by one, an error of one doesn't stop the others.
+        Returns json array with {"v": result} or {"err": message} for every call """
+    lines = ['local res = {}']
+    for k, c in enumerate(calls):
+        lines.append(f'do local ok, v = pcall(function() {c.lua} end) '
+                     f'res[{k + 1}] = game.table_to_json(ok and {{v = v}} or {{err = tostring(v)}}) end')
+    lines.append("return '[' .. table.concat(res, ',') .. ']'")
+    return '\n'.join(lines)
+
+
+def module_bundle(names: T.List[str]) -> str:
+    """ Scripts of modules as one chunk, each in its own block so their locals don't clash """
+    return '\n'.join(f'do\n{readfile(osp.join(osp.dirname(__file__), "scripts", name + ".lua"))}\nend'
+                     for name in names)
+
+
+class Batch:
+    """ Collects high-level calls and sends them in a single round trip, at flush or at the end of with block.
+        Calls return futures resolved by the flush """
+    def __init__(self, sc: 'SmartCommunicator'):
+        self.sc = sc
+        self.calls: T.List[T.Tuple[Call, Future]] = []
+
+    def add(self, call: Call) -> Future:
+        fut = Future()
+        self.calls.append((call, fut))
+        return fut
+
+    def find_entities(self, p1, p2, name=None, type=None) -> Future:
+        return self.add(self.sc.find_entities_call(p1, p2, name, type))
+
+    def find_entities_columns(self, p1, p2, name=None, type=None) -> Future:
+        return self.add(self.sc.find_entities_columns_call(p1, p2, name, type))
+
+    def get_player_pos(self) -> Future:
+        return self.add(self.sc.player_pos_call())
+
+    def walk_to(self, pos) -> Future:
+        return self.add(self.sc.walk_to_call(pos))
+
+    def flush(self):
+        calls, self.calls = self.calls, []
+        if not calls:
+            return
+        try:
+            results = self.sc.eval_calls([c for c, _ in calls])
+        except Exception as e:
+            for _, fut in calls:
+                fut.set_exception(e)
+            raise
+        for (_, fut), (ok, v) in zip(calls, results):
+            if ok:
+                fut.set_result(v)
+            else:
+                fut.set_exception(LuaError(v))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            for _, fut in self.calls:
+                fut.cancel()
+            self.calls = []
+
+
 class SmartCommunicator:
     """ Smarter communicator supporting high-level requests """
+    MODULES = ['events', 'get_direction', 'queue', 'find_entities', 'walk']
+
     def __init__(self, comm=None):
         self.comm = Communicator() if comm is None else comm
-
-        self.load_module('get_direction')
-        self.load_module('queue')
-        self.load_module('find_entities')
-        self.load_module('walk')
+        self.load_modules(self.MODULES)
 
     def load_module(self, name):
-        txt = readfile(osp.join(osp.dirname(__file__), 'scripts', name + '.lua'))
-        res = self.comm.eval(txt)
-        assert res == 'nil'
-
-    def find_entities(self, p1, p2):
-        if isinstance(p1, tuple):
-            assert len(p1) == 2
-            p1x, p1y = p1[0], p1[1]
-        else:
-            p1x, p1y = p1.x, p1.y
+        self.load_modules([name])
 
-        if isinstance(p2, tuple):
-            assert len(p2) == 2
-            p2x, p2y = p2[0], p2[1]
-        else:
-            p2x, p2y = p2.x, p2.y
+    def load_modules(self, names):
+        """ All modules in one round trip """
+        res = self.comm.eval(module_bundle(names))
+        assert res == 'nil'
 
-        entities_str = self.comm.eval(f"return game.table_to_json(find_entities({p1x}, {p1y}, {p2x}, {p2y}))")
+    def batch(self) -> Batch:
+        return Batch(self)
 
+    def eval_calls(self, calls: T.List[Call]) -> T.List[T.Tuple[bool, T.Any]]:
+        """ (True, decoded result) or (False, Lua error message) for every call, in a single round trip """
+        ans = self.comm.eval(batch_chunk(calls))
         try:
-            res = json.loads(entities_str)
+            parts = json.loads(ans)
         except json.JSONDecodeError as e:
-            print(f'Got error "{e}" decoding json string "{entities_str[:50]}"')
+            print(f'Got error "{e}" decoding json string "{ans[:50]}"')
             raise e
+        res = []
+        for c, part in zip(calls, parts):
+            part = part or {}  # table_to_json of an empty table, result was nil
+            if 'err' in part:
+                res.append((False, part['err']))
+            else:
+                res.append((True, c.decode(part.get('v'))))
         return res
 
+    def run(self, call: Call):
+        (ok, v), = self.eval_calls([call])
+        if not ok:
+            raise LuaError(v)
+        return v
+
+    @staticmethod
+    def find_entities_call(p1, p2, name=None, type=None) -> Call:
+        (p1x, p1y), (p2x, p2y) = _xy(p1), _xy(p2)
+        return Call(f'return find_entities({p1x}, {p1y}, {p2x}, {p2y}, {_lua_filter(name, type)})')
+
+    @staticmethod
+    def find_entities_columns_call(p1, p2, name=None, type=None) -> Call:
+        (p1x, p1y), (p2x, p2y) = _xy(p1), _xy(p2)
+        return Call(f'return find_entities_columns({p1x}, {p1y}, {p2x}, {p2y}, {_lua_filter(name, type)})',
+                    decode_columns)
+
+    @staticmethod
+    def player_pos_call() -> Call:
+        return Call('return game.players[1].position', lambda res: Point2D(res['x'], res['y']))
+
+    @staticmethod
+    def walk_to_call(pos) -> Call:
+        return Call('walk_queue:put({x=%d,y=%d})' % (pos.x, pos.y))
+
+    def find_entities(self, p1, p2, name=None, type=None):
+        """ Entities in the box as dicts with position, type, name and amount for resources.
+            name and type (strings or lists of them) filter entities on the game side """
+        return self.run(self.find_entities_call(p1, p2, name, type))
+
+    def find_entities_columns(self, p1, p2, name=None, type=None) -> np.ndarray:
+        """ Same as find_entities as structured array with ENTITY_DTYPE, amount is 0 for non-resources.
+            Columns go as plain numbers, several times smaller than the json of dicts """
+        return self.run(self.find_entities_columns_call(p1, p2, name, type))
+
     def get_player_pos(self):
-        res = json.loads(self.comm.eval('return game.table_to_json(game.players[1].position)'))
-        return Point2D(res['x'], res['y'])
+        return self.run(self.player_pos_call())
 
     def walk_to(self, pos):
-        self.comm.eval('walk_queue:put({x=%d,y=%d})' % (pos.x, pos.y))
\ No newline at end of file
+        self.run(self.walk_to_call(pos))
@@ -0,0 +1,185 @@
+""" Game events for the Python side. scripts/events.lua buffers subscribed events (walk_done, built, mined,
+    position every N ticks), EventDispatcher takes the buffer in one request every interval and delivers events
+    to callbacks and waiters. The protocol is request/reply, the game can't write to the socket on its own,
+    so this is a cheap poll rather than a true push, events arrive within interval of being buffered """
+import asyncio
+import threading
+import typing as T
+
+from pyfactorio.communicator import SmartCommunicator, Call
+
+Event = T.Dict[str, T.Any]  # {'kind', 'tick', ...}, fields depend on kind
+
+
+class EventDispatcher:
+    def __init__(self, sc: SmartCommunicator, kinds: T.Iterable[str] = ('walk_done', 'built', 'mined'),
+                 position_every: int = 0, interval: float = 0.05):
+        """ kinds - events buffered in the game, position_every - period in ticks of position events (0 - none) """
+        self.sc = sc
+        self.interval = interval
+        self.dropped = 0  # events lost to overflow of the game side buffer
+        self.error: T.Optional[Exception] = None  # which stopped the polling thread
+        self._callbacks: T.Dict[str, T.List[T.Callable[[Event], None]]] = {}
+        self._fail_callbacks: T.List[T.Callable[[Exception], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: T.Optional[threading.Thread] = None
+        self.subscribe_game(kinds, position_every)
+
+    def subscribe_game(self, kinds: T.Iterable[str], position_every: int = 0):
+        """ Which events the game buffers """
+        fields = [f'{k} = true' for k in kinds if k != 'position']
+        if position_every:
+            fields.append(f'position = {int(position_every)}')
+        self.sc.run(Call(f'subscribe_events({{{"; ".join(fields)}}})'))
+
+    def on(self, kind: str, callback: T.Callable[[Event], None]) -> T.Callable[[], None]:
+        """ Calls callback (in the dispatcher thread) for every event of kind. Returns function unsubscribing it """
+        with self._lock:
+            self._callbacks.setdefault(kind, []).append(callback)
+
+        def off():
+            with self._lock:
+                if callback in self._callbacks.get(kind, []):
+                    self._callbacks[kind].remove(callback)
+        return off
+
+    def _on_fail(self, callback: T.Callable[[Exception], None]) -> T.Callable[[], None]:
+        """ Calls callback with the error stopping the polling thread, right away if it has stopped already """
+        with self._lock:
+            error = self.error
+            if error is None:
+                self._fail_callbacks.append(callback)
+        if error is not None:
+            callback(error)
+
+        def off():
+            with self._lock:
+                if callback in self._fail_callbacks:
+                    self._fail_callbacks.remove(callback)
+        return off
+
+    def poll(self) -> int:
+        """ Takes buffered events and delivers them. Returns number of events """
+        res = self.sc.run(Call('return take_events()'))
+        events = res['events'] or []  # table_to_json writes an empty list as {}
+        self.dropped += res['dropped']
+        for e in events:
+            with self._lock:
+                callbacks = list(self._callbacks.get(e['kind'], []))
+            for cb in callbacks:
+                try:
+                    cb(e)
+                except Exception as ex:
+                    print(f'Event callback {cb} failed on {e}: {ex!r}')
+        return len(events)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                self.poll()
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error: Exception):
+        """ Fails all waiters and the ones coming after, until restart """
+        with self._lock:
+            self.error = error
+            callbacks, self._fail_callbacks = self._fail_callbacks, []
+        for cb in callbacks:
+            cb(error)
+
+    def start(self) -> 'EventDispatcher':
+        """ Starts polling in a daemon thread """
+        assert self._thread is None
+        self._stop.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='factorio-events', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Waiting. Subscription goes before the action causing the event, so the event can't be missed
+    def _waiter(self, kind: str, predicate: T.Callable[[Event], bool]):
+        got = threading.Event()
+        res = []
+
+        def cb(e):
+            if not got.is_set() and predicate(e):
+                res.append(e)
+                got.set()
+        offs = [self.on(kind, cb), self._on_fail(lambda _: got.set())]
+
+        def wait(timeout: T.Optional[float]) -> Event:
+            if not got.wait(timeout):
+                raise TimeoutError(f'no {kind} event in {timeout}s')
+            if not res:
+                raise self.error
+            return res[0]
+        return wait, lambda: [off() for off in offs]
+
+    def _future(self, kind: str, predicate: T.Callable[[Event], bool]):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        def cb(e):
+            if predicate(e):
+                loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(e))
+
+        def fail(error):
+            loop.call_soon_threadsafe(lambda: fut.done() or fut.set_exception(error))
+        offs = [self.on(kind, cb), self._on_fail(fail)]
+        return fut, lambda: [off() for off in offs]
+
+    def wait_for(self, kind: str, predicate: T.Callable[[Event], bool] = lambda e: True,
+                 timeout: T.Optional[float] = None) -> Event:
+        """ Blocks until an event of kind satisfying predicate, raises TimeoutError.
+            Needs start(), raises the error of the polling thread if it fails meanwhile """
+        wait, off = self._waiter(kind, predicate)
+        try:
+            return wait(timeout)
+        finally:
+            off()
+
+    async def wait_async(self, kind: str, predicate: T.Callable[[Event], bool] = lambda e: True,
+                         timeout: T.Optional[float] = None) -> Event:
+        """ wait_for for asyncio code, raises asyncio.TimeoutError """
+        fut, off = self._future(kind, predicate)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            off()
+
+    # Actions completing with events
+    @staticmethod
+    def _reached(pos) -> T.Callable[[Event], bool]:
+        x, y = int(pos.x), int(pos.y)
+        return lambda e: (e['target']['x'], e['target']['y']) == (x, y)
+
+    def walk_to(self, pos, timeout: T.Optional[float] = None) -> Event:
+        """ SmartCommunicator.walk_to returning when the player gets there, with the walk_done event """
+        wait, off = self._waiter('walk_done', self._reached(pos))
+        try:
+            self.sc.walk_to(pos)
+            return wait(timeout)
+        finally:
+            off()
+
+    async def walk_to_async(self, pos, timeout: T.Optional[float] = None) -> Event:
+        fut, off = self._future('walk_done', self._reached(pos))
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.sc.walk_to, pos)
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            off()
@@ -0,0 +1,101 @@
+""" Local copy of the map kept chunk by chunk. Chunks are fetched in bounded requests, several per round trip,
+    and refetched only when the game reports a change in them (scripts/chunk_tracker.lua) """
+import math
+import typing as T
+
+import numpy as np
+
+from pyfactorio.communicator import SmartCommunicator, Call, ENTITY_DTYPE, decode_columns, _xy
+
+CHUNK_SIZE = 32  # as in scripts/chunk_tracker.lua
+Chunk = T.Tuple[int, int]
+
+
+class ChunkData(T.NamedTuple):
+    version: int  # of the chunk in the game when it was fetched
+    entities: np.ndarray  # with ENTITY_DTYPE, positioned inside the chunk
+
+
+def chunk_of(x: float, y: float) -> Chunk:
+    return math.floor(x / CHUNK_SIZE), math.floor(y / CHUNK_SIZE)
+
+
+def chunks_in(p1, p2) -> T.List[Chunk]:
+    """ Chunks intersecting the box from p1 to p2 """
+    (x1, y1), (x2, y2) = _xy(p1), _xy(p2)
+    (cx1, cy1), (cx2, cy2) = chunk_of(min(x1, x2), min(y1, y2)), chunk_of(max(x1, x2), max(y1, y2))
+    return [(cx, cy) for cy in range(cy1, cy2 + 1) for cx in range(cx1, cx2 + 1)]
+
+
+def _scan_chunk_call(chunk: Chunk) -> Call:
+    cx, cy = chunk
+
+    def decode(res):
+        ents = decode_columns(res)
+        # entities whose boxes only overlap the chunk belong to their neighbours
+        inside = (np.floor(ents['x'] / CHUNK_SIZE) == cx) & (np.floor(ents['y'] / CHUNK_SIZE) == cy)
+        return ChunkData(res['version'], ents[inside])
+
+    return Call(f'return scan_chunk({cx}, {cy})', decode)
+
+
+class MapScanner:
+    """ Chunk cache over SmartCommunicator. scan fetches chunks not seen yet, refresh refetches the ones changed
+        since, queries run on the cache without round trips. Resource amounts change without events, a chunk
+        with mined ore is refetched only when something is built or removed in it (or by scan(..., force=True)) """
+    def __init__(self, sc: SmartCommunicator, chunks_per_request: int = 16):
+        self.sc = sc
+        self.chunks_per_request = chunks_per_request
+        self.chunks: T.Dict[Chunk, ChunkData] = {}
+        self.requests = 0
+        sc.load_module('chunk_tracker')
+        self.version, _ = self._changes_since(0)  # of the game's change counter, changes up to it are in the cache
+
+    def _changes_since(self, version: int) -> T.Tuple[int, T.Dict[Chunk, int]]:
+        self.requests += 1
+        res = self.sc.run(Call(f'return chunks_changed_since({version})'))
+        return res['version'], {(c['x'], c['y']): c['v'] for c in res['chunks'] or []}
+
+    def fetch(self, chunks: T.Iterable[Chunk]) -> int:
+        """ Fetches chunks to the cache, chunks_per_request of them in a round trip. Returns number of chunks """
+        chunks = list(chunks)
+        for k in range(0, len(chunks), self.chunks_per_request):
+            part = chunks[k:k + self.chunks_per_request]
+            with self.sc.batch() as b:
+                futures = [b.add(_scan_chunk_call(c)) for c in part]
+            self.requests += 1
+            for c, fut in zip(part, futures):
+                self.chunks[c] = fut.result()
+        return len(chunks)
+
+    def scan(self, p1, p2, force: bool = False) -> int:
+        """ Makes sure chunks of the box are in the cache. Returns number of chunks fetched """
+        return self.fetch(c for c in chunks_in(p1, p2) if force or c not in self.chunks)
+
+    def refresh(self) -> int:
+        """ Refetches cached chunks changed in the game since last refresh. Returns number of chunks fetched """
+        version, changed = self._changes_since(self.version)
+        stale = [c for c, v in changed.items() if c in self.chunks and v > self.chunks[c].version]
+        self.version = version
+        return self.fetch(stale)
+
+    def entities(self, p1=None, p2=None, name=None) -> np.ndarray:
+        """ Cached entities with ENTITY_DTYPE, optionally in the box from p1 to p2 and with name (string or list) """
+        if p1 is None:
+            parts = [d.entities for d in self.chunks.values()]
+        else:
+            parts = [self.chunks[c].entities for c in chunks_in(p1, p2) if c in self.chunks]
+        ents = np.concatenate(parts) if parts else np.empty(0, dtype=ENTITY_DTYPE)
+        mask = np.ones(len(ents), dtype=bool)
+        if p1 is not None:
+            (x1, y1), (x2, y2) = _xy(p1), _xy(p2)
+            mask &= (ents['x'] >= min(x1, x2)) & (ents['x'] <= max(x1, x2))
+            mask &= (ents['y'] >= min(y1, y2)) & (ents['y'] <= max(y1, y2))
+        if name is not None:
+            mask &= np.isin(ents['name'], [name] if isinstance(name, str) else list(name))
+        return ents[mask]
+
+    def counts(self, p1=None, p2=None) -> T.Dict[str, int]:
+        """ Number of cached entities by name """
+        names, counts = np.unique(self.entities(p1, p2)['name'], return_counts=True)
+        return dict(zip(names.tolist(), counts.tolist()))
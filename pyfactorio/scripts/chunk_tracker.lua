@@ -0,0 +1,43 @@
+-- Versions of 32x32 chunks: every build, mine or death of an entity stamps its chunk
+-- with the next value of a global counter, clients ask for chunks changed since the counter they saw
+_G.chunk_versions = _G.chunk_versions or {}
+_G.chunk_counter = _G.chunk_counter or 0
+
+local function touch(entity)
+  if not (entity and entity.valid) then
+    return
+  end
+  local cx = math.floor(entity.position.x / 32)
+  local cy = math.floor(entity.position.y / 32)
+  chunk_counter = chunk_counter + 1
+  chunk_versions[cx .. ',' .. cy] = {x = cx; y = cy; v = chunk_counter}
+end
+
+local function on_change(event)
+  touch(event.created_entity or event.entity)
+end
+
+function chunks_changed_since(version)
+  local res = {}
+  for _, c in pairs(chunk_versions) do
+    if c.v > version then
+      res[#res + 1] = c
+    end
+  end
+  return {version = chunk_counter; chunks = res}
+end
+
+function scan_chunk(cx, cy)
+  local res = find_entities_columns(cx * 32, cy * 32, cx * 32 + 32, cy * 32 + 32)
+  local c = chunk_versions[cx .. ',' .. cy]
+  res.version = c and c.v or 0
+  return res
+end
+
+add_event_handler({defines.events.on_built_entity, defines.events.on_robot_built_entity,
+                   defines.events.on_player_mined_entity, defines.events.on_robot_mined_entity,
+                   defines.events.on_entity_died, defines.events.on_resource_depleted,
+                   defines.events.script_raised_built, defines.events.script_raised_destroy}, 'chunk_tracker', on_change)
+
+_G.chunks_changed_since = chunks_changed_since
+_G.scan_chunk = scan_chunk
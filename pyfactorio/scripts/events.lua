@@ -0,0 +1,78 @@
+-- script.on_event keeps one handler per event, modules add theirs here under a key instead,
+-- loading a module again replaces its handler
+_G.event_handlers = _G.event_handlers or {}
+
+function add_event_handler(ids, key, handler)
+  if type(ids) ~= 'table' then
+    ids = {ids}
+  end
+  for _, id in pairs(ids) do
+    local hs = event_handlers[id]
+    if not hs then
+      hs = {}
+      event_handlers[id] = hs
+      script.on_event(id, function(event)
+        for _, h in pairs(hs) do
+          h(event)
+        end
+      end)
+    end
+    hs[key] = handler
+  end
+end
+
+-- Events for the Python side, buffered until it takes them.
+-- Kinds nobody subscribed to are not buffered, position is pushed every event_subscriptions.position ticks
+_G.event_buffer = _G.event_buffer or {}
+_G.event_subscriptions = _G.event_subscriptions or {}
+_G.event_buffer_limit = 10000
+_G.events_dropped = _G.events_dropped or 0
+
+function push_event(kind, data)
+  if not event_subscriptions[kind] then
+    return
+  end
+  if #event_buffer >= event_buffer_limit then
+    events_dropped = events_dropped + 1
+    return
+  end
+  data.kind = kind
+  data.tick = game.tick
+  event_buffer[#event_buffer + 1] = data
+end
+
+function subscribe_events(kinds)
+  _G.event_subscriptions = kinds
+end
+
+function take_events()
+  local res = {events = event_buffer; dropped = events_dropped}
+  _G.event_buffer = {}
+  _G.events_dropped = 0
+  return res
+end
+
+local function entity_event(kind)
+  return function(event)
+    local e = event.created_entity or event.entity
+    if e and e.valid then
+      push_event(kind, {name = e.name; type = e.type; position = e.position})
+    end
+  end
+end
+
+add_event_handler({defines.events.on_built_entity, defines.events.on_robot_built_entity,
+                   defines.events.script_raised_built}, 'events', entity_event('built'))
+add_event_handler({defines.events.on_player_mined_entity, defines.events.on_robot_mined_entity,
+                   defines.events.on_entity_died, defines.events.script_raised_destroy}, 'events', entity_event('mined'))
+add_event_handler(defines.events.on_tick, 'events', function(event)
+  local every = event_subscriptions.position
+  if every and event.tick % every == 0 then
+    push_event('position', {position = game.players[1].position})
+  end
+end)
+
+_G.add_event_handler = add_event_handler
+_G.push_event = push_event
+_G.subscribe_events = subscribe_events
+_G.take_events = take_events
@@ -1,7 +1,14 @@
-function find_entities(x1,y1, x2,y2)
+local function find_filtered(x1,y1, x2,y2, filter)
+  local f = {area = {{x1, y1}, {x2, y2}}}
+  for k,v in pairs(filter or {}) do
+    f[k] = v
+  end
+  return game.get_surface('nauvis').find_entities_filtered(f)
+end
+
+function find_entities(x1,y1, x2,y2, filter)
   local ret = {}
-  local surf=game.get_surface('nauvis')
-  local ents = surf.find_entities({{x1, y1}, {x2,y2}})
+  local ents = find_filtered(x1,y1, x2,y2, filter)
   for k,v in pairs(ents) do
     ret[k] = {position = v.position; type = v.type; name = v.name}
     if v.type == 'resource' then -- v.mineable then
@@ -11,4 +18,26 @@ function find_entities(x1,y1, x2,y2)
   return ret
 end
 
+-- Same entities as parallel columns of comma separated numbers, names are 0-based indices into list of distinct names
+function find_entities_columns(x1,y1, x2,y2, filter)
+  local xs, ys, amounts, name_ids = {}, {}, {}, {}
+  local names, ids = {}, {}
+  local ents = find_filtered(x1,y1, x2,y2, filter)
+  for k,v in ipairs(ents) do
+    xs[k] = v.position.x
+    ys[k] = v.position.y
+    amounts[k] = v.type == 'resource' and v.amount or 0
+    local id = ids[v.name]
+    if not id then
+      names[#names + 1] = v.name
+      id = #names - 1
+      ids[v.name] = id
+    end
+    name_ids[k] = id
+  end
+  return {names = names; x = table.concat(xs, ','); y = table.concat(ys, ',');
+          amount = table.concat(amounts, ','); name = table.concat(name_ids, ',')}
+end
+
 _G.find_entities = find_entities
+_G.find_entities_columns = find_entities_columns
@@ -1,5 +1,5 @@
 _G.walk_queue = Queue:new()
-script.on_event(defines.events.on_tick, 
+add_event_handler(defines.events.on_tick, 'walk',
 function() 
     local player = game.players[1]
     if walk_queue:size() > 0 then
@@ -12,6 +12,7 @@ function()
         game.players[1].walking_state = {walking = true, direction = dir}
       else
         walk_queue:get()
+        push_event('walk_done', {target = tgt; position = player.position; left = walk_queue:size()})
       end
     end
 end)
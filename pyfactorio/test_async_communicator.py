@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+from time import time
+
+from pyfactorio.async_communicator import AsyncCommunicator
+
+
+class FakeFactorio:
+    """ Stand-in for the game speaking the same protocol. respond(request) gives the reply, or (reply, delay),
+        or None to drop the connection. Replies go out in order of requests, like the game sends them """
+    def __init__(self, respond=lambda s: s, latency=0.):
+        self.respond = respond
+        self.latency = latency
+        self.received = []
+        self.max_outstanding = 0
+        self._outstanding = 0
+        self._writers = []
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        for w in self._writers:
+            w.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        self._writers.append(writer)
+        replies = asyncio.Queue()
+
+        async def send():
+            while True:
+                at, ans = await replies.get()
+                if ans is None:
+                    writer.close()
+                    return
+                await asyncio.sleep(at - loop.time())
+                writer.write(ans.encode('ascii') + b'\0')
+                await writer.drain()
+                self._outstanding -= 1
+
+        sender = loop.create_task(send())
+        try:
+            while True:
+                req = (await reader.readuntil(b'\0'))[:-1].decode('ascii')
+                self.received.append(req)
+                self._outstanding += 1
+                self.max_outstanding = max(self.max_outstanding, self._outstanding)
+                ans = self.respond(req)
+                ans, delay = ans if isinstance(ans, tuple) else (ans, self.latency)
+                replies.put_nowait((loop.time() + delay, ans))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await asyncio.wait([sender], timeout=1)
+            sender.cancel()
+
+
+class TestAsyncCommunicator(unittest.IsolatedAsyncioTestCase):
+    async def test_eval(self):
+        async with FakeFactorio(lambda s: 'nil' if s.startswith('x') else s.upper()) as srv:
+            async with await AsyncCommunicator.connect(port=srv.port) as comm:
+                self.assertEqual('RETURN 1', await comm.eval('return 1'))
+                self.assertEqual('nil', await comm.eval('x = 1'))
+        self.assertEqual(['return 1', 'x = 1'], srv.received)
+
+    async def test_long_reply(self):
+        big = 'x' * (3 * AsyncCommunicator.READ_LIMIT + 5)
+        async with FakeFactorio(lambda s: big if s == 'big' else s) as srv:
+            async with await AsyncCommunicator.connect(port=srv.port) as comm:
+                self.assertEqual([big, 'return 1', big], await comm.eval_many(['big', 'return 1', 'big']))
+                self.assertEqual('return 2', await comm.eval('return 2'))
+
+    async def test_pipelining(self):
+        async with FakeFactorio(latency=0.1) as srv:
+            async with await AsyncCommunicator.connect(port=srv.port) as comm:
+                t0 = time()
+                res = await comm.eval_many([f'return {k}' for k in range(10)])
+                elapsed = time() - t0
+        self.assertEqual([f'return {k}' for k in range(10)], res)
+        self.assertLess(elapsed, 0.5)  # one after another would take a second
+        self.assertEqual(10, srv.max_outstanding)
+
+    async def test_backpressure(self):
+        async with FakeFactorio(latency=0.02) as srv:
+            async with await AsyncCommunicator.connect(port=srv.port, max_in_flight=3) as comm:
+                res = await comm.eval_many([str(k) for k in range(12)])
+        self.assertEqual([str(k) for k in range(12)], res)
+        self.assertEqual(3, srv.max_outstanding)
+
+    async def test_timeout(self):
+        async with FakeFactorio(lambda s: (s, 0.3) if s == 'slow' else s) as srv:
+            async with await AsyncCommunicator.connect(port=srv.port, timeout=0.1) as comm:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await comm.eval('slow')
+                self.assertEqual(1, comm.in_flight)
+                # late reply to the timed out request must not be taken for this one
+                self.assertEqual('fast', await comm.eval('fast', timeout=1))
+                self.assertEqual(0, comm.in_flight)
+
+    async def test_connection_closed(self):
+        async with FakeFactorio(lambda s: None if s == 'quit' else (s, 0.1)) as srv:
+            async with await AsyncCommunicator.connect(port=srv.port, max_in_flight=2) as comm:
+                waiting = [asyncio.ensure_future(comm.eval(s)) for s in ['a', 'quit', 'b', 'c']]
+                res = await asyncio.gather(*waiting, return_exceptions=True)
+                self.assertEqual('a', res[0])
+                for r in res[1:]:
+                    self.assertIsInstance(r, ConnectionError)
+                with self.assertRaises(ConnectionError):
+                    await comm.eval('d')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os.path as osp
+import unittest
+
+import numpy as np
+
+from cognition.entity_parsing import entity_block
+from factory_theory.primitives import Point2D
+from pyfactorio.communicator import SmartCommunicator, LuaError, readfile
+
+
+class FakeComm:
+    """ Records requests, answers with given replies, modules load with nil """
+    def __init__(self, replies=()):
+        self.requests = []
+        self.replies = list(replies)
+
+    def eval(self, lua_str):
+        self.requests.append(lua_str)
+        return 'nil' if len(self.requests) == 1 else self.replies.pop(0)
+
+
+class TestBatching(unittest.TestCase):
+    def test_modules_bundle(self):
+        comm = FakeComm()
+        SmartCommunicator(comm)
+        self.assertEqual(1, len(comm.requests))
+        for name in SmartCommunicator.MODULES:
+            self.assertIn(f'do\n{readfile(osp.join(osp.dirname(__file__), "scripts", name + ".lua"))}\nend',
+                          comm.requests[0])
+
+    def test_batch(self):
+        ents = [{'position': {'x': 1.5, 'y': 2.5}, 'type': 'resource', 'name': 'coal', 'amount': 100}]
+        reply = json.dumps([{'v': {'x': 3, 'y': 4}}, {'v': ents}, {}, {'err': 'attempt to index nil'}])
+        comm = FakeComm([reply])
+        sc = SmartCommunicator(comm)
+        with sc.batch() as b:
+            pos = b.get_player_pos()
+            found = b.find_entities((0, 0), Point2D(10, 10))
+            walk = b.walk_to(Point2D(5, 6))
+            bad = b.add(sc.player_pos_call())
+            self.assertFalse(pos.done())
+        self.assertEqual(2, len(comm.requests))
+        chunk = comm.requests[1]
+        self.assertIn('find_entities(0, 0, 10, 10, nil)', chunk)
+        self.assertIn('walk_queue:put({x=5,y=6})', chunk)
+        self.assertEqual(4, chunk.count('pcall'))
+
+        self.assertEqual(Point2D(3, 4), pos.result())
+        self.assertEqual(ents, found.result())
+        self.assertIsNone(walk.result())
+        self.assertIsInstance(bad.exception(), LuaError)
+
+    def test_single_calls(self):
+        comm = FakeComm([json.dumps([{'v': {'x': 1, 'y': -2}}]), json.dumps([{'err': 'no player'}])])
+        sc = SmartCommunicator(comm)
+        self.assertEqual(Point2D(1, -2), sc.get_player_pos())
+        with self.assertRaisesRegex(LuaError, 'no player'):
+            sc.get_player_pos()
+
+    def test_failed_round_trip(self):
+        class Broken(FakeComm):
+            def eval(self, lua_str):
+                if self.requests:
+                    raise ConnectionError('closed')
+                return super().eval(lua_str)
+
+        sc = SmartCommunicator(Broken())
+        b = sc.batch()
+        pos = b.get_player_pos()
+        with self.assertRaises(ConnectionError):
+            b.flush()
+        self.assertIsInstance(pos.exception(), ConnectionError)
+
+
+    def test_find_entities_columns(self):
+        reply = json.dumps([{'v': {'names': ['iron-ore', 'coal'], 'x': '0.5,1.5,-0.5,2.5', 'y': '0.5,0.5,0.5,3.5',
+                                   'amount': '10,20,30,0', 'name': '0,0,0,1'}},
+                            {'v': {'names': {}, 'x': '', 'y': '', 'amount': '', 'name': ''}}])
+        comm = FakeComm([reply])
+        sc = SmartCommunicator(comm)
+        with sc.batch() as b:
+            ents = b.find_entities_columns((-1, -1), (4, 4), name=['iron-ore', 'coal'], type='resource')
+            empty = b.find_entities_columns((100, 100), (110, 110))
+        self.assertIn('find_entities_columns(-1, -1, 4, 4, {name = {"iron-ore", "coal"}, type = {"resource"}})',
+                      comm.requests[1])
+        self.assertIn('find_entities_columns(100, 100, 110, 110, nil)', comm.requests[1])
+
+        ents = ents.result()
+        np.testing.assert_array_equal([0.5, 1.5, -0.5, 2.5], ents['x'])
+        np.testing.assert_array_equal([10, 20, 30, 0], ents['amount'])
+        self.assertEqual(['iron-ore'] * 3 + ['coal'], ents['name'].tolist())
+        self.assertEqual(0, len(empty.result()))
+
+        dicts = [{'position': {'x': e['x'], 'y': e['y']}, 'name': e['name'], 'amount': int(e['amount'])} for e in ents]
+        b1, b2 = entity_block(dicts, 'iron-ore'), entity_block(ents, 'iron-ore')
+        self.assertEqual((b1.p1.x, b1.p1.y, b1.p2.x, b1.p2.y), (b2.p1.x, b2.p1.y, b2.p2.x, b2.p2.y))
+
+
+if __name__ == '__main__':
+    unittest.main()
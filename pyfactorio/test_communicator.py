@@ -1,8 +1,8 @@
-from time import sleep
 import pytest
 import unittest
 
 from .communicator import SmartCommunicator
+from .events import EventDispatcher
 
 
 class TestDemoTasks(unittest.TestCase):
@@ -15,17 +15,16 @@ class TestDemoTasks(unittest.TestCase):
         assert -1000 < pos.y < 1000
 
     def test_move(self):
-        pos = self.sc.get_player_pos()
-        tpos = pos + (2, 2)
+        with EventDispatcher(self.sc) as events:
+            pos = self.sc.get_player_pos()
+            tpos = pos + (2, 2)
 
-        self.sc.walk_to(tpos)
-        sleep(0.5)
+            events.walk_to(tpos, timeout=5)
 
-        pos2 = self.sc.get_player_pos()
-        assert (tpos.x - pos2.x)**2 + (tpos.y - pos2.y)**2 < 2
+            pos2 = self.sc.get_player_pos()
+            assert (tpos.x - pos2.x)**2 + (tpos.y - pos2.y)**2 < 2
 
-        self.sc.walk_to(pos)
-        sleep(0.5)
+            events.walk_to(pos, timeout=5)
 
-        pos3 = self.sc.get_player_pos()
-        assert (pos.x - pos3.x)**2 + (pos.y - pos3.y)**2 < 2
+            pos3 = self.sc.get_player_pos()
+            assert (pos.x - pos3.x)**2 + (pos.y - pos3.y)**2 < 2
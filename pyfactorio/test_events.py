@@ -0,0 +1,120 @@
+import asyncio
+import json
+import re
+import threading
+import unittest
+
+from factory_theory.primitives import Point2D
+from pyfactorio.communicator import SmartCommunicator
+from pyfactorio.events import EventDispatcher
+
+
+class FakeGame:
+    """ Plays scripts/events.lua and walk.lua: every take_events is a tick, on which the player
+        reaches the first target of the walk queue """
+    def __init__(self):
+        self.subscriptions = {}
+        self.buffer = []
+        self.walk_queue = []
+        self.tick = 0
+        self.lock = threading.Lock()
+
+    def push(self, kind, **data):
+        if kind in self.subscriptions:
+            self.buffer.append(dict(data, kind=kind, tick=self.tick))
+
+    def _call(self, body):
+        if body.startswith('subscribe_events'):
+            self.subscriptions = dict(re.findall(r'(\w+) = (\w+)', body))
+            return None
+        m = re.fullmatch(r'walk_queue:put\(\{x=(-?\d+),y=(-?\d+)\}\)', body)
+        if m:
+            self.walk_queue.append({'x': int(m[1]), 'y': int(m[2])})
+            return None
+        assert body == 'return take_events()', body
+        self.tick += 1
+        if self.walk_queue:
+            tgt = self.walk_queue.pop(0)
+            self.push('walk_done', target=tgt, position=tgt, left=len(self.walk_queue))
+        res, self.buffer = self.buffer or {}, []
+        return {'events': res, 'dropped': 0}
+
+    def eval(self, lua_str):
+        with self.lock:
+            if lua_str.startswith('do\n'):
+                return 'nil'
+            bodies = re.findall(r'pcall\(function\(\) (.*?) end\)', lua_str)
+            return json.dumps([{} if r is None else {'v': r} for r in map(self._call, bodies)])
+
+
+class BrokenGame(FakeGame):
+    """ Connection lost on the second take_events """
+    def _call(self, body):
+        if body == 'return take_events()' and self.tick > 0:
+            raise ConnectionError('connection lost')
+        return super()._call(body)
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.game = FakeGame()
+        self.sc = SmartCommunicator(self.game)
+
+    def test_callbacks(self):
+        events = EventDispatcher(self.sc, kinds=['built'])
+        self.assertEqual({'built': 'true'}, self.game.subscriptions)
+        got = []
+        off = events.on('built', got.append)
+        self.game.push('built', name='stone-furnace', position={'x': 1, 'y': 2})
+        self.game.push('mined', name='tree')  # not subscribed
+        self.assertEqual(1, events.poll())
+        self.assertEqual(['stone-furnace'], [e['name'] for e in got])
+        off()
+        self.game.push('built', name='stone-furnace', position={'x': 1, 'y': 2})
+        self.assertEqual(1, events.poll())
+        self.assertEqual(1, len(got))
+        self.assertEqual(0, events.poll())
+
+    def test_walk_to(self):
+        with EventDispatcher(self.sc, interval=0.01) as events:
+            self.sc.walk_to(Point2D(1, 1))
+            e = events.walk_to(Point2D(3, -4), timeout=5)
+            self.assertEqual({'x': 3, 'y': -4}, e['target'])
+            with self.assertRaises(TimeoutError):
+                events.wait_for('walk_done', timeout=0.05)
+            self.assertEqual([], events._callbacks['walk_done'])
+
+    def test_walk_to_async(self):
+        async def walk(events):
+            return await asyncio.gather(events.wait_async('walk_done', lambda e: e['target']['x'] == 5, timeout=5),
+                                        events.walk_to_async(Point2D(5, 5), timeout=5))
+
+        with EventDispatcher(self.sc, interval=0.01) as events:
+            waited, done = asyncio.run(walk(events))
+        self.assertIs(done, waited)
+        self.assertEqual({'x': 5, 'y': 5}, done['target'])
+
+    def test_polling_fails(self):
+        sc = SmartCommunicator(BrokenGame())
+        with EventDispatcher(sc, interval=0.01) as events:
+            with self.assertRaises(ConnectionError):
+                events.wait_for('built')
+            self.assertIsInstance(events.error, ConnectionError)
+            with self.assertRaises(ConnectionError):
+                events.wait_for('built', timeout=5)  # failed already
+            with self.assertRaises(ConnectionError):
+                asyncio.run(events.wait_async('built', timeout=5))
+            self.assertEqual([], events._fail_callbacks)
+
+    def test_polling_fails_async(self):
+        async def wait(events):
+            return await events.wait_async('walk_done')
+
+        sc = SmartCommunicator(BrokenGame())
+        with EventDispatcher(sc, interval=0.01) as events:
+            with self.assertRaises(ConnectionError):
+                asyncio.run(wait(events))
+
+
+if __name__ == '__main__':
+    unittest.main()
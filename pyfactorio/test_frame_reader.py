@@ -0,0 +1,77 @@
+import socket
+import threading
+import unittest
+from time import time
+
+from pyfactorio.communicator import Communicator, FrameReader
+
+
+class TestFrameReader(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_frames(self):
+        r = FrameReader(self.b, buffer_size=8)
+        self.a.sendall(b'one\0two\0\0thr')
+        self.assertEqual(b'one', r.read_frame())
+        self.assertEqual(b'two', r.read_frame())
+        self.assertEqual(b'', r.read_frame())
+        self.a.sendall(b'ee\0')
+        self.assertEqual(b'three', r.read_frame())
+        self.assertEqual(4, r.frames)
+        self.assertEqual(15, r.metrics()['bytes'])
+
+    def test_bigger_than_buffer(self):
+        r = FrameReader(self.b, buffer_size=16)
+        frame = bytes(range(1, 256)) * 1000
+        sender = threading.Thread(target=self.a.sendall, args=(frame + b'\0' + b'x\0',))
+        sender.start()
+        self.assertEqual(frame, r.read_frame())
+        self.assertEqual(b'x', r.read_frame())
+        sender.join()
+        self.assertLess(len(r.buf), 2 * len(frame) + 16)
+
+    def test_eof(self):
+        r = FrameReader(self.b)
+        self.a.sendall(b'done\0')
+        self.a.close()
+        self.assertEqual(b'done', r.read_frame())
+        with self.assertRaisesRegex(ConnectionError, 'closed$'):
+            r.read_frame()
+
+    def test_eof_in_frame(self):
+        r = FrameReader(self.b)
+        self.a.sendall(b'partial')
+        self.a.close()
+        with self.assertRaisesRegex(ConnectionError, '7 bytes'):
+            r.read_frame()
+
+    def test_communicator(self):
+        """ Multi-megabyte reply in small chunks, the way big find_entities dumps come """
+        reply = b'{"name":"iron-ore","amount":1000},' * 200000
+
+        def serve():
+            req = b''
+            while not req.endswith(b'\0'):
+                req += self.a.recv(100)
+            assert req == b'return dump()\0'
+            data = reply + b'\0'
+            for k in range(0, len(data), 4096):
+                self.a.sendall(data[k:k + 4096])
+
+        server = threading.Thread(target=serve)
+        server.start()
+        comm = Communicator(sock=self.b)
+        t0 = time()
+        self.assertEqual(reply.decode('ascii'), comm.eval('return dump()'))
+        self.assertLess(time() - t0, 5)
+        server.join()
+        self.assertEqual(len(reply) + 1, comm.reader.metrics()['bytes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import math
+import re
+import unittest
+
+from pyfactorio.communicator import SmartCommunicator
+from pyfactorio.map_scanner import MapScanner, chunks_in
+
+
+class FakeGame:
+    """ Answers scan_chunk and chunks_changed_since calls of batch chunks from a list of entities,
+        the way scripts/chunk_tracker.lua does. Entities have a radius, area queries return overlapping ones """
+    def __init__(self, entities):
+        self.entities = list(entities)
+        self.versions = {}
+        self.counter = 0
+        self.evals = 0
+
+    def build(self, x, y, name, r=0.5):
+        self.entities.append({'x': x, 'y': y, 'name': name, 'amount': 0, 'r': r})
+        self.counter += 1
+        self.versions[(math.floor(x / 32), math.floor(y / 32))] = self.counter
+
+    def _call(self, body):
+        m = re.fullmatch(r'return scan_chunk\((-?\d+), (-?\d+)\)', body)
+        if m:
+            cx, cy = int(m[1]), int(m[2])
+            ents = [e for e in self.entities
+                    if e['x'] + e['r'] > cx * 32 and e['x'] - e['r'] < cx * 32 + 32 and
+                    e['y'] + e['r'] > cy * 32 and e['y'] - e['r'] < cy * 32 + 32]
+            names = sorted({e['name'] for e in ents})
+            return {'names': names or {}, 'x': ','.join(str(e['x']) for e in ents),
+                    'y': ','.join(str(e['y']) for e in ents), 'amount': ','.join(str(e['amount']) for e in ents),
+                    'name': ','.join(str(names.index(e['name'])) for e in ents),
+                    'version': self.versions.get((cx, cy), 0)}
+        m = re.fullmatch(r'return chunks_changed_since\((\d+)\)', body)
+        assert m, body
+        return {'version': self.counter,
+                'chunks': [{'x': c[0], 'y': c[1], 'v': v} for c, v in self.versions.items() if v > int(m[1])] or {}}
+
+    def eval(self, lua_str):
+        self.evals += 1
+        if lua_str.startswith('do\n'):
+            return 'nil'
+        return json.dumps([{'v': self._call(body)} for body in re.findall(r'pcall\(function\(\) (.*?) end\)', lua_str)])
+
+
+class TestMapScanner(unittest.TestCase):
+    def setUp(self):
+        ores = [{'x': x + 0.5, 'y': y + 0.5, 'name': 'iron-ore', 'amount': 100, 'r': 0.5}
+                for x in range(-40, 40) for y in range(-8, 8)]
+        self.game = FakeGame(ores + [{'x': 31.5, 'y': 2.5, 'name': 'assembling-machine-1', 'amount': 0, 'r': 1.5}])
+        self.scanner = MapScanner(SmartCommunicator(self.game), chunks_per_request=4)
+
+    def test_chunks_in(self):
+        self.assertEqual([(-1, -1), (0, -1), (-1, 0), (0, 0)], chunks_in((-1, -1), (0.5, 31.9)))
+
+    def test_scan(self):
+        evals = self.game.evals
+        self.assertEqual(8, self.scanner.scan((-40, -8), (39, 7)))  # 4x2 chunks
+        self.assertEqual(2, self.game.evals - evals)  # 4 chunks per round trip
+        self.assertEqual(0, self.scanner.scan((-10, -8), (10, 7)))  # all cached
+        self.assertEqual(2, self.game.evals - evals)
+
+        # machine overlaps chunk (1, 0) but belongs to (0, 0)
+        self.assertEqual({'iron-ore': 80 * 16, 'assembling-machine-1': 1}, self.scanner.counts())
+        self.assertEqual(4 * 4, len(self.scanner.entities((0, 0), (3.9, 3.9), name='iron-ore')))
+        self.assertEqual(1, len(self.scanner.entities(name=['assembling-machine-1', 'stone'])))
+
+    def test_refresh(self):
+        self.scanner.scan((0, 0), (31, 31))
+        self.game.build(10.5, 10.5, 'stone-furnace', r=1)
+        self.game.build(100.5, 100.5, 'stone-furnace', r=1)  # not cached, not refetched
+        evals = self.game.evals
+        self.assertEqual(1, self.scanner.refresh())
+        self.assertEqual(2, self.game.evals - evals)
+        self.assertEqual(1, len(self.scanner.entities(name='stone-furnace')))
+        self.assertEqual(0, self.scanner.refresh())
+        self.assertEqual(1, self.scanner.chunks[(0, 0)].version)
+
+
+if __name__ == '__main__':
+    unittest.main()
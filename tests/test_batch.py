@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from time import sleep, time
+
+from factory_theory.batch import LayoutStore, run_batch, spec_key
+from factory_theory.layout import occupied_cells
+
+
+def build_processing_line(f, l1, l2):
+    """ Same task as TestFactory.test_processing_line_input_output_locations """
+    pl = f.new_production_line(num_machines=4, machine_size=3, num_inputs=1, color='g')
+    f.add(pl.area.pos == (0, 0))
+    f.add(pl.input(0) == tuple(l1))
+    f.add(pl.output() == tuple(l2))
+
+
+def build_two_machines(f):
+    m1 = f.new_machine('g')
+    m2 = f.new_machine('r')
+    b = f.new_segmented_belt()
+    f.add(b.num_segs == 1)
+    f.connect_with_inserter(m1, b)
+    f.connect_with_inserter(b, m2)
+    return f.area.size.x + f.area.size.y
+
+
+def build_slowly(f):
+    sleep(30)
+
+
+def build_until(f, deadline):
+    f.new_machine('g')
+    sleep(max(0.0, deadline - time()))
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = LayoutStore(os.path.join(self.tmp.name, 'layouts.db'))
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_batch_and_rerun(self):
+        locs = [(0, 0), (11, 6), (11, 0)]
+        specs = [{'builder': 'test_batch:build_processing_line', 'params': {'l1': [0, 0], 'l2': list(l2)}}
+                 for l2 in locs]
+        specs.append({'name': 'two machines', 'builder': 'test_batch:build_two_machines'})
+
+        statuses = run_batch(specs, self.store, workers=2, memory_limit_mb=2048)
+        self.assertEqual(['unsat', 'solved', 'unsat', 'solved'], [statuses[spec_key(s)] for s in specs])
+
+        res = self.store.get(spec_key(specs[-1]))
+        self.assertEqual(9, res['metric'])
+        self.assertEqual('two machines', res['name'])
+        self.assertEqual(2, len(res['layout']['buildings']))
+        self.assertEqual(2 * 9 + 2 + 2, len(occupied_cells(res['layout'])))
+
+        line = self.store.get(spec_key(specs[1]))['layout']['production_lines'][0]
+        self.assertEqual(4, len(line['buildings']))
+
+        statuses = run_batch(specs, self.store, workers=2)
+        self.assertEqual(['cached'] * 4, list(statuses.values()))
+
+    def test_timeout(self):
+        spec = {'builder': 'test_batch:build_slowly'}
+        statuses = run_batch([spec], self.store, timeout=1)
+        self.assertEqual('timeout', statuses[spec_key(spec)])
+        self.assertFalse(self.store.is_final(spec_key(spec)))
+
+    def test_finish_at_timeout(self):
+        """ Jobs finishing together right at the timeout are either solved or timed out, late results are dropped.
+            Which one each racing job gets depends on its spawn time, only the first and the last are certain """
+        start, timeout = time(), 4
+        specs = [{'builder': 'test_batch:build_until', 'params': {'deadline': 0}}]
+        specs += [{'builder': 'test_batch:build_until', 'params': {'deadline': start + timeout + s}}
+                  for s in (-0.05, -0.02, 0, 0.02, 0.05)]
+        specs.append({'builder': 'test_batch:build_slowly'})
+        statuses = run_batch(specs, self.store, workers=len(specs), timeout=timeout)
+        got = [statuses[spec_key(s)] for s in specs]
+        self.assertEqual('solved', got[0])
+        self.assertEqual('timeout', got[-1])
+        self.assertTrue(set(got) <= {'solved', 'timeout'}, got)
+        self.assertEqual(got, [self.store.get(spec_key(s))['status'] for s in specs])
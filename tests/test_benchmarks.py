@@ -0,0 +1,27 @@
+import unittest
+
+from benchmarks.run import compare, measure
+
+
+def _results(**entries):
+    return {'meta': {}, 'results': {'case': entries}}
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_compare(self):
+        base = _results(**{'2': {'times': [1.], 'median': 1., 'min': 1., 'value': 5},
+                           '4': {'times': [0.01], 'median': 0.01, 'min': 0.01, 'value': 7}})
+        self.assertEqual([], compare(_results(**{'2': {'times': [1.4], 'median': 1.4, 'min': 1.4, 'value': 5}}), base))
+        # small absolute differences are noise
+        self.assertEqual([], compare(_results(**{'4': {'times': [0.1], 'median': 0.1, 'min': 0.1, 'value': 7}}), base))
+        self.assertEqual(1, len(compare(_results(**{'2': {'times': [2.], 'median': 2., 'min': 2., 'value': 5}}), base)))
+        self.assertEqual(1, len(compare(_results(**{'2': {'times': [1.], 'median': 1., 'min': 1., 'value': 6}}), base)))
+        self.assertEqual(1, len(compare(_results(**{'2': {'times': [], 'value': None, 'errors': ['timeout']}}), base)))
+        # sizes missing in baseline aren't compared
+        self.assertEqual([], compare(_results(**{'8': {'times': [9.], 'median': 9., 'min': 9., 'value': 1}}), base))
+
+    def test_measure(self):
+        res = measure('production_line', 2, 0, timeout=120)
+        self.assertEqual(13, res['value'])
+        self.assertIn('elapsed', res)
+        self.assertIn('error', measure('production_line', 2, 0, timeout=0.01))
@@ -0,0 +1,115 @@
+import math
+import random
+import unittest
+
+from factory_theory.bounds import Bounds, boxes_overlap, min_perimeter, overlapping_pairs
+from factory_theory.factory import Factory
+from factory_theory.primitives import IntVal, Point2D, SegmentedBelt
+
+
+class TestBounds(unittest.TestCase):
+    def test_propagation(self):
+        x, y = IntVal(), IntVal()
+        b = Bounds([x.v >= 0, x.v + y.v <= 10, y.v > 2, 2 * y.v <= 9])
+        self.assertEqual((0, 7), b.expr(x.v))
+        self.assertEqual((3, 4), b.expr(y.v))
+        self.assertEqual((6, 14), b.expr(x.v + y.v + 3))
+
+    def test_fixed_belt_ends(self):
+        sb = SegmentedBelt()
+        p = Point2D()
+        b = Bounds([sb.num_segs == 1, sb.source() == (2, 5), sb.sink() == (9, 5), p.x - 1 == sb.sink().x])
+        self.assertEqual((2, 9, 5, 5), b.belt_box(sb))
+        self.assertEqual((10, 10), b.expr(p.x))
+
+    def test_overlapping_pairs(self):
+        rng = random.Random(0)
+
+        def box():
+            x, y = rng.randrange(50), rng.randrange(50)
+            return x, x + rng.randrange(8), y, y + rng.randrange(8)
+
+        boxes1 = [box() for _ in range(60)]
+        boxes2 = [box() for _ in range(40)]
+        self.assertEqual([(i, j) for i in range(60) for j in range(i + 1, 60) if boxes_overlap(boxes1[i], boxes1[j])],
+                         overlapping_pairs(boxes1))
+        self.assertEqual([(i, j) for i in range(60) for j in range(40) if boxes_overlap(boxes1[i], boxes2[j])],
+                         overlapping_pairs(boxes1, boxes2))
+
+
+class TestPruning(unittest.TestCase):
+    @staticmethod
+    def _fixed_machines(prune: bool):
+        f = Factory()
+        f.prune_pairs = prune
+        for k in range(6):
+            m = f.new_machine('r')
+            f.add(m.pos == (4 * k, 0))
+            b = f.new_segmented_belt()
+            f.add(b.num_segs == 1)
+            b.fix_ends((4 * k, -2), (4 * k + 2, -2))
+            f.connect_with_inserter(m, b)
+        res = f.finalize_and_model(minimize_metric=f.area.size.x + f.area.size.y)
+        return f, res[1]
+
+    def test_fixed_machines(self):
+        f, metric = self._fixed_machines(prune=True)
+        self.assertEqual((15, 15), f.pair_stats['buildings'])
+        self.assertEqual((15, 15), f.pair_stats['belts'])
+        self.assertEqual((36, 36), f.pair_stats['buildings-belts'])
+        self.assertEqual((30, 36), f.pair_stats['buildings-inserters'])  # each machine with its own inserter
+        self.assertIn('pruned', f.pruning_report())
+
+        f, metric_plain = self._fixed_machines(prune=False)
+        self.assertEqual(0, sum(p for p, _ in f.pair_stats.values()))
+        self.assertEqual(metric_plain, metric)
+
+
+class TestMetricBounds(unittest.TestCase):
+    def test_min_perimeter(self):
+        self.assertEqual(11, min_perimeter(1, 1, 3, 3, 27))
+        self.assertEqual(12, min_perimeter(1, 1, 3, 3, 36))
+        self.assertEqual(3 * 2 + 9, min_perimeter(3, 1, 1, 1, 18))  # narrow and tall when width is expensive
+        self.assertEqual(10, min_perimeter(1, 1, 8, 1, 9))
+
+    def test_belt_lengths(self):
+        f = Factory()
+        b1 = f.new_segmented_belt(max_segs=3, bounded=True)
+        b1.fix_ends((0, 0), (5, 7))
+        b2 = f.new_segmented_belt(max_segs=2)
+        b2.fix_ends((0, 3), (2, 3))
+        self.assertEqual(13, f.metric_lower_bound(b1.len()))
+        self.assertEqual(2 * 13 + 4 + 3, f.metric_lower_bound(2 * b1.len() + 4 + b2.len()))
+        self.assertEqual(-math.inf, f.metric_lower_bound(b1.len() - b2.len()))
+
+        f.sol.on_probe = lambda p: None
+        _, metric = f.finalize_and_model(2 * b1.len() + 4 + b2.len(), lower='auto')
+        self.assertEqual(33, metric)
+        self.assertEqual((33, None), f.metric_bounds)
+
+    def test_machine_chain(self):
+        f = Factory()
+        machines = [f.new_machine('g') for _ in range(3)]
+        for m1, m2 in zip(machines, machines[1:]):
+            b = f.new_segmented_belt(max_segs=2, bounded=True)
+            f.connect_with_inserter(m1, b)
+            f.connect_with_inserter(b, m2)
+        f.add(machines[0].pos == (0, 0))
+        metric = f.area.size.x + f.area.size.y
+        self.assertEqual(11, f.metric_lower_bound(metric))  # 27 cells hold 3 machines at best
+
+        f.sol.on_probe = lambda p: None
+        _, res = f.finalize_and_model(metric, lower='auto', upper='auto')
+        self.assertEqual(12, res)
+        lower, upper = f.metric_bounds
+        self.assertEqual(11, lower)
+        self.assertGreaterEqual(upper, 12)
+        self.assertLessEqual(len(f.sol.probes), 3)
+        self.assertTrue(f.search_report().startswith(f'metric bounds [11, {upper}], {len(f.sol.probes)} probes'))
+
+    def test_no_metric(self):
+        f = Factory()
+        f.new_machine('g')
+        f.finalize_and_model(lower='auto', upper='placement')
+        self.assertEqual((0, None), f.metric_bounds)
+        self.assertTrue(f.search_report().startswith('metric bounds [0, None]'))
@@ -72,6 +72,25 @@ class TestDemoTasks(unittest.TestCase):
         self.assertGreater(len(sizes), 0)
         self.assertEqual(9, sizes[-1])  # number got from experiments with visualization
 
+    def test_three_bounded_seg_belts(self):
+        """ Same as test_three_seg_belts, but with quantifier free encoding """
+        belts = [SegmentedBelt(max_segs=5, bounded=True) for _ in range(3)]
+
+        SOL.add(non_intersecting_seg_belts(belts[0], belts[1]))
+        SOL.add(non_intersecting_seg_belts(belts[0], belts[2]))
+        SOL.add(non_intersecting_seg_belts(belts[1], belts[2]))
+
+        belts[0].fix_ends((0,0), (20, 20))
+        belts[1].fix_ends((0,10), (20, 10))
+        belts[2].fix_ends((0,20), (20, 0))
+
+        sz = IntVal()
+        SOL.add(sz.v == sum(b.num_segs for b in belts))
+
+        sizes = list(SOL.shrinker_loop(sz, init=38, restore=False))
+        self.assertGreater(len(sizes), 0)
+        self.assertEqual(9, sizes[-1])
+
     def test_factory_minification(self):
         from factory_theory.factory import Factory
 
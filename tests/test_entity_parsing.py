@@ -0,0 +1,109 @@
+import random
+import unittest
+
+import numpy as np
+
+from cognition.entity_parsing import entity_block
+from factory_theory.primitives import Point2D, Segment
+
+
+def reference_entity_block(entities, name):
+    """ Original implementation walking segment points over a dict of positions """
+    enmap = {}
+    coords = []
+    amounts = []
+
+    for e in entities:
+        if e['name'] == name:
+            pos = int(e['position']['x']), int(e['position']['y'])
+            coords.append(pos)
+            amounts.append(e['amount'])
+
+            enmap[pos] = e['amount']
+
+    coords = np.array(coords)
+    amounts = np.array(amounts)
+
+    center = np.sum(coords * amounts.reshape(-1, 1), axis=0) / np.sum(amounts)
+    pc = Point2D(int(center[0]), int(center[1]))
+    block = Segment(pc, pc)
+
+    def fully_occupied(s: Segment):
+        for p in s.enumerate_points():
+            if (p.x, p.y) not in enmap:
+                return False
+        return True
+
+    while True:
+        enlarged = False
+
+        if fully_occupied(block.left_neigh()):
+            block.p1 = block.p1.left()
+            enlarged = True
+
+        if fully_occupied(block.right_neigh()):
+            block.p2 = block.p2.right()
+            enlarged = True
+
+        if fully_occupied(block.top_neigh()):
+            block.p1 = block.p1.top()
+            enlarged = True
+
+        if fully_occupied(block.bottom_neigh()):
+            block.p2 = block.p2.bottom()
+            enlarged = True
+
+        if not enlarged:
+            break
+
+    return block
+
+
+def patch(rnd, x0, y0, rx, ry, holes=0.02, name='iron-ore'):
+    """ Elliptic patch with ragged border and random holes, centered at x0, y0 """
+    res = []
+    for x in range(x0 - rx, x0 + rx + 1):
+        for y in range(y0 - ry, y0 + ry + 1):
+            d = ((x - x0) / rx) ** 2 + ((y - y0) / ry) ** 2
+            if d <= 1 - 0.3 * rnd.random() and rnd.random() >= holes:
+                res.append({'position': {'x': x + 0.5, 'y': y + 0.5}, 'type': 'resource', 'name': name,
+                            'amount': rnd.randint(100, 1000)})
+    return res
+
+
+def _box(s):
+    return s.p1.x, s.p1.y, s.p2.x, s.p2.y
+
+
+class TestEntityBlock(unittest.TestCase):
+    def test_same_as_reference(self):
+        rnd = random.Random(0)
+        for k in range(40):
+            ents = patch(rnd, rnd.randint(-50, 50), rnd.randint(-50, 50), rnd.randint(1, 15), rnd.randint(1, 15),
+                         holes=rnd.choice([0, 0.01, 0.1, 0.5]))
+            ents += patch(rnd, rnd.randint(-50, 50), rnd.randint(-50, 50), 5, 5, name='coal')
+            rnd.shuffle(ents)
+            if not any(e['name'] == 'iron-ore' for e in ents):
+                continue
+            expected = _box(reference_entity_block(ents, 'iron-ore'))
+            self.assertEqual(expected, _box(entity_block(ents, 'iron-ore')), k)
+
+            arr = np.array([(e['position']['x'], e['position']['y'], e['amount'], e['name']) for e in ents],
+                           dtype=[('x', float), ('y', float), ('amount', int), ('name', 'U16')])
+            self.assertEqual(expected, _box(entity_block(arr, 'iron-ore')), k)
+
+    def test_full_rectangle(self):
+        ents = [{'position': {'x': x + 0.5, 'y': y + 0.5}, 'name': 'stone', 'amount': 10}
+                for x in range(1, 11) for y in range(2, 5)]
+        self.assertEqual((1, 2, 10, 4), _box(entity_block(ents, 'stone')))
+
+    def test_center_not_covered(self):
+        """ Ring around an empty center, no side can grow """
+        ents = [{'position': {'x': x, 'y': y}, 'name': 'stone', 'amount': 10}
+                for x in range(-2, 3) for y in range(-2, 3) if max(abs(x), abs(y)) == 2]
+        self.assertEqual((0, 0, 0, 0), _box(entity_block(ents, 'stone')))
+        self.assertEqual((0, 0, 0, 0), _box(reference_entity_block(ents, 'stone')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
 import unittest
 
+import z3
+
 from factory_theory.factory import Factory
+from factory_theory.subfactory import WarmStartError
+from factory_theory.primitives import SOL, IntVal, Point2D, SolverWrapper
+from factory_theory.solution_cache import SolutionCache
+from factory_theory.layout import extract_layout, occupied_cells
+from factory_theory.portfolio import collect_decls
+from factory_theory.production_line import ProductionLineTemplate
 
 
 class TestFactory(unittest.TestCase):
@@ -64,3 +73,296 @@ class TestFactory(unittest.TestCase):
                 self.assertIsNotNone(m, f'should be solution for l1={l1}, l2={l2}')
             else:
                 self.assertIsNone(m, f'should be unsolvable for l1={l1}, l2={l2}')
+
+    def test_lexicographic(self):
+        f = self.f
+        m1 = f.new_machine('g')
+        m2 = f.new_machine('r')
+        b = f.new_segmented_belt(max_segs=3)
+        f.connect_with_inserter(m1, b)
+        f.connect_with_inserter(b, m2)
+
+        m, metric = f.finalize_and_model(minimize_metric=[f.area.size.x + f.area.size.y, b.len()])
+        self.assertEqual([9, 2], metric)
+
+
+class TestFactoryOptimize(TestFactory):
+    """ Same tasks solved by z3.Optimize backend """
+    def setUp(self) -> None:
+        SOL.set_backend('optimize')
+        super().setUp()
+
+    def tearDown(self) -> None:
+        SOL.set_backend('binary')
+        SOL.fresh_solver()
+
+    def test_pareto(self):
+        f = self.f
+        m1 = f.new_machine('g')
+        f.add(m1.pos == (0, 0))
+        m2 = f.new_machine('r')
+        f.finalize()
+
+        front = list(SOL.pareto_front([f.area.size.x, f.area.size.y]))
+        self.assertEqual([[3, 6], [6, 3]], sorted(front))
+
+    def test_timeout_returns_best_found(self):
+        """ Distinct values with minimal sum: models come quickly, proving the optimum is pigeonhole hard """
+        n = 12
+        vs = [IntVal() for _ in range(n)]
+        for v in vs:
+            SOL.add(0 <= v.v, v.v <= 3 * n)
+        SOL.add(z3.Distinct([v.v for v in vs]))
+        total = z3.Sum([v.v for v in vs])
+
+        values = SOL.optimize([total], timeout=0.5)
+        self.assertIsNotNone(values)
+        self.assertGreater(values[0], n * (n - 1) // 2)  # not the optimum 0 + 1 + ... + n-1
+        self.assertFalse(SOL.proven)
+        self.assertEqual(values[0], SOL.eval(total))
+        found = [SOL.eval(v.v) for v in vs]
+        self.assertEqual(n, len(set(found)))
+        self.assertEqual(values[0], sum(found))
+
+
+class TestFactoryAssumptions(TestFactory):
+    """ Same tasks solved by incremental assumption based search """
+    def setUp(self) -> None:
+        SOL.set_backend('assumptions')
+        super().setUp()
+
+    def tearDown(self) -> None:
+        SOL.set_backend('binary')
+        SOL.fresh_solver()
+
+
+class TestIsolatedFactories(unittest.TestCase):
+    """ Factories built against their own solvers don't share any state """
+    @staticmethod
+    def _solve_line(sol: SolverWrapper):
+        f = Factory(sol=sol)
+        p1 = f.new_production_line(num_machines=4, machine_size=3, num_inputs=1, color='g')
+        m1 = f.new_machine('r')
+        f.connect_with_inserter(m1, p1.input(0))
+        metric = f.area.size.x + f.area.size.y
+        m, best = f.finalize_and_model(minimize_metric=metric)
+        ys = set(b.pos.eval_as_tuple()[1] for b in p1.buildings)
+        return best, len(p1.buildings), len(ys)
+
+    def test_concurrent_solving(self):
+        expected = self._solve_line(SolverWrapper.isolated())
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            results = list(ex.map(lambda _: self._solve_line(SolverWrapper.isolated()), range(6)))
+        self.assertEqual([expected] * 6, results)
+
+    def test_global_solver_untouched(self):
+        SOL.fresh_solver()
+        p = Point2D()
+        SOL.add(p == (5, 7))
+
+        self._solve_line(SolverWrapper.isolated())
+
+        self.assertIsNotNone(SOL.model())
+        self.assertEqual((5, 7), p.eval_as_tuple())
+
+
+class TestSolutionCache(unittest.TestCase):
+    """ Repeated problems are restored from cache instead of being solved """
+    def setUp(self) -> None:
+        self.cache = SolutionCache()
+
+    def tearDown(self) -> None:
+        self.cache.close()
+
+    def _two_machines(self):
+        f = Factory()
+        m1 = f.new_machine('g')
+        m2 = f.new_machine('r')
+        b = f.new_segmented_belt()
+        f.add(b.num_segs == 1)
+        f.connect_with_inserter(m1, b)
+        f.connect_with_inserter(b, m2)
+        res = f.finalize_and_model(minimize_metric=f.area.size.x + f.area.size.y, cache=self.cache)
+        return res[1], [m.pos.eval_as_tuple() for m in f.buildings], b.eval_corners()
+
+    def test_hit_restores_layout(self):
+        expected = self._two_machines()
+        IntVal()  # shifts generated names
+        self.assertEqual(expected, self._two_machines())
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+        self.assertEqual(9, expected[0])
+
+    def test_production_line(self):
+        def solve(l2):
+            f = Factory()
+            pl = f.new_production_line(num_machines=4, machine_size=3, num_inputs=1, color='g')
+            f.add(pl.area.pos == (0, 0))
+            f.add(pl.input(0) == (0, 0))
+            f.add(pl.output() == l2)
+            res = f.finalize_and_model(cache=self.cache)
+            return res and [b.pos.eval_as_tuple() for b in pl.buildings]
+
+        self.assertIsNone(solve((11, 0)))
+        self.assertIsNone(solve((11, 0)))
+        positions = solve((11, 6))
+        self.assertEqual(positions, solve((11, 6)))
+        self.assertEqual((2, 2), (self.cache.hits, self.cache.misses))
+
+    def test_timeout_not_cached(self):
+        """ Best layout found before a timeout is not an optimum to restore later """
+        SOL.set_backend('optimize', timeout=0.5)
+        try:
+            f = Factory()
+            vs = [IntVal() for _ in range(12)]  # hard instance of TestFactoryOptimize.test_timeout_returns_best_found
+            for v in vs:
+                f.add(z3.And(0 <= v.v, v.v <= 36))
+            f.add(z3.Distinct([v.v for v in vs]))
+            _, metric = f.finalize_and_model(minimize_metric=z3.Sum([v.v for v in vs]), cache=self.cache)
+            self.assertGreaterEqual(metric, 66)  # may even be the optimum, but not proven one
+            self.assertFalse(f.sol.proven)
+            self.assertEqual(0, len(self.cache))
+        finally:
+            SOL.set_backend('binary')
+            SOL.fresh_solver()
+
+        self._two_machines()
+        self.assertTrue(SOL.proven)
+        self.assertEqual(1, len(self.cache))
+
+    def test_lru_eviction(self):
+        cache = SolutionCache(max_entries=2)
+        cache.put('a', 1, None)
+        cache.put('b', 2, None)
+        cache.get('a')
+        cache.put('c', 3, None)
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        cache.close()
+
+
+class TestTemplatedProductionLine(unittest.TestCase):
+    """ Production lines placed from precomputed templates """
+    def test_template_reused(self):
+        t1 = ProductionLineTemplate.get(num_machines=4, machine_size=3, num_inputs=1)
+        t2 = ProductionLineTemplate.get(num_machines=4, machine_size=3, num_inputs=1)
+        self.assertIs(t1, t2)
+        self.assertEqual((12, 7), t1.size)
+        self.assertEqual(0, t1.inputs[0][0])
+        self.assertEqual(11, t1.output[0])
+
+    @staticmethod
+    def _two_lines(templated: bool):
+        f = Factory()
+        p1 = f.new_production_line(num_machines=4, machine_size=3, num_inputs=1, color='g', templated=templated)
+        p2 = f.new_production_line(num_machines=4, machine_size=3, num_inputs=1, color='r', templated=templated)
+        f.connect_with_inserter(p1.output(), p2.input(0))
+        num_decls = len(collect_decls(SOL.assertions()))
+        res = f.finalize_and_model(minimize_metric=f.area.size.x + f.area.size.y)
+        return f, res[1], num_decls
+
+    def test_placement(self):
+        f, metric, num_decls = self._two_lines(templated=True)
+        layout = extract_layout(f)
+        p1, p2 = layout['production_lines']
+        self.assertEqual(4, len(p2['buildings']))
+        self.assertEqual(8, len(p2['inserters']))
+        cells = [occupied_cells(dict(pl, production_lines=[])) for pl in (p1, p2)]
+        self.assertFalse(cells[0] & cells[1])
+
+        out = f.production_lines[0].output().eval_as_tuple()
+        self.assertIn(list(out), p1['belts'][-1])
+
+        _, _, num_decls_plain = self._two_lines(templated=False)
+        self.assertLess(4 * num_decls, num_decls_plain)
+
+    def test_hierarchical(self):
+        f = Factory(hierarchical=True, workers=3)
+        p1 = f.new_production_line(num_machines=3, machine_size=3, num_inputs=1, color='g')
+        p2 = f.new_production_line(num_machines=2, machine_size=3, num_inputs=2, color='r')
+        p3 = f.new_production_line(num_machines=5, machine_size=3, num_inputs=1, auto_output=True, color='b')
+        f.connect_with_inserter(p1.output(), p2.input(1))
+        f.connect_with_inserter(p3.output(), p2.input(0))
+
+        m, metric = f.finalize_and_model(minimize_metric=f.area.size.x + f.area.size.y)
+        self.assertEqual([(9, 7), (6, 8), (15, 7)], [pl.area.size.eval_as_tuple() for pl in f.production_lines])
+        self.assertEqual(41, metric)
+
+        layout = extract_layout(f)
+        cells = [occupied_cells(dict(pl, production_lines=[])) for pl in layout['production_lines']]
+        self.assertEqual(sum(map(len, cells)), len(set().union(*cells)))
+        self.assertEqual([3, 2, 5], [len(pl['buildings']) for pl in layout['production_lines']])
+
+
+class TestWarmStart(unittest.TestCase):
+    """ Re-layout starting from a prior solution """
+    @staticmethod
+    def _chain(f: Factory, n: int, first_pos=None):
+        machines = [f.new_machine('g', pos=first_pos if k == 0 else None) for k in range(n)]
+        for m1, m2 in zip(machines, machines[1:]):
+            b = f.new_segmented_belt(max_segs=2, bounded=True)
+            f.connect_with_inserter(m1, b)
+            f.connect_with_inserter(b, m2)
+        return machines
+
+    @staticmethod
+    def _row_layout(n: int) -> dict:
+        """ Chain of _chain in a row: machine, inserter, two cells of belt, inserter, next machine """
+        layout = {'buildings': [[7 * k, 0, 3, 3] for k in range(n)], 'inserters': [], 'belts': []}
+        for k in range(n - 1):
+            layout['inserters'] += [[7 * k + 3, 1, 'r', 1], [7 * k + 6, 1, 'r', 1]]
+            layout['belts'].append([[7 * k + 4, 1], [7 * k + 5, 1]])
+        return layout
+
+    def test_pin_far_entities(self):
+        prior = self._row_layout(4)
+        f = Factory()
+        self._chain(f, 4)
+        self.assertEqual((4 + 6 + 3, 0), f.warm_start(prior, changed=[]))  # everything pinned
+        self.assertIsNotNone(f.finalize_and_model())
+
+        f = Factory()
+        last = self._chain(f, 4)[-1]
+        f.add(last.pos == (21, -3))  # the edit: last machine moves up, its belt has to turn
+        with self.assertWarns(UserWarning):  # default backend takes no hints
+            pinned, hinted = f.warm_start(prior, changed=[last], radius=2)
+        self.assertEqual((4 + 6 + 3 - 3, 0), (pinned, hinted))  # last machine, its inserter and belt are free
+        self.assertIsNotNone(f.finalize_and_model())
+        layout = extract_layout(f)
+        self.assertEqual(prior['buildings'][:3], layout['buildings'][:3])
+        self.assertEqual([21, -3, 3, 3], layout['buildings'][-1])
+
+        f = Factory()
+        last = self._chain(f, 4)[-1]
+        f.add(last.pos == (21, -3))
+        with self.assertWarns(UserWarning):
+            f.warm_start(prior, changed=[last], radius=1)  # the belt is pinned, no way up to the machine
+        with self.assertRaises(WarmStartError):
+            f.finalize_and_model()
+
+    def test_hints_only(self):
+        SOL.set_backend('optimize')
+        try:
+            f = Factory()
+            self._chain(f, 3)
+            m, metric = f.finalize_and_model(minimize_metric=f.area.size.x + f.area.size.y)
+            prior = extract_layout(f)
+
+            f = Factory()
+            self._chain(f, 3)
+            self.assertEqual((0, 9), f.warm_start(prior))  # 3 machines, 2 belts, 4 inserters
+            m, metric2 = f.finalize_and_model(minimize_metric=f.area.size.x + f.area.size.y)
+            self.assertEqual(metric, metric2)
+
+            f = Factory()
+            self._chain(f, 3, first_pos=tuple(prior['buildings'][0][:2]))
+            self.assertEqual((0, 8), f.warm_start(prior))  # fixed machine has nothing to hint
+            self.assertEqual(metric, f.finalize_and_model(minimize_metric=f.area.size.x + f.area.size.y)[1])
+        finally:
+            SOL.set_backend('binary')
+            SOL.fresh_solver()
+
+        f = Factory()
+        self._chain(f, 3)
+        with self.assertRaises(WarmStartError):  # default solver takes no hints
+            f.warm_start(prior)
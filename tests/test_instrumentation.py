@@ -0,0 +1,54 @@
+import json
+import os
+import tempfile
+import unittest
+
+from factory_theory.factory import Factory
+from factory_theory.primitives import SolverWrapper
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_factory(self):
+        sol = SolverWrapper.isolated()
+        ins = sol.instrument()
+        sol.on_probe = lambda p: None
+        f = Factory(sol=sol)
+        m1 = f.new_machine('g')
+        m2 = f.new_machine('r')
+        b = f.new_segmented_belt()
+        f.add(b.num_segs == 1)
+        f.connect_with_inserter(m1, b)
+        f.connect_with_inserter(b, m2)
+        _, metric = f.finalize_and_model(f.area.size.x + f.area.size.y)
+        self.assertEqual(9, metric)
+
+        self.assertEqual(1, ins.origins['TestInstrumentation.test_factory']['constraints'])
+        self.assertEqual(4, ins.origins['SubFactory.connect_with_inserter']['constraints'])
+        self.assertGreater(ins.origins['SegmentedBelt.__init__']['quantifiers'], 0)
+        self.assertIn('SubFactory._add_non_intersecting_all', ins.origins)
+        self.assertIn('SubFactory.finalize', ins.origins)
+
+        self.assertEqual(len(sol.probes), len(ins.probes))
+        self.assertGreaterEqual(len(ins.checks), len(ins.probes))
+        self.assertTrue(all(c['elapsed'] >= 0 for c in ins.checks))
+        self.assertIn('conflicts', ins.checks[-1]['statistics'])
+        self.assertEqual(['finalize', 'bounds', 'solve'], [s['name'] for s in ins.spans])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ins.save_chrome_trace(os.path.join(tmp, 'trace.json'))
+            ins.save_json(os.path.join(tmp, 'stats.json'))
+            with open(os.path.join(tmp, 'trace.json')) as fp:
+                trace = json.load(fp)
+            with open(os.path.join(tmp, 'stats.json')) as fp:
+                stats = json.load(fp)
+        phases = {(e['cat'], e['ph']) for e in trace['traceEvents']}
+        self.assertEqual({('span', 'X'), ('check', 'X'), ('probe', 'i')}, phases)
+        self.assertEqual(ins.summary()['constraints'], stats['summary']['constraints'])
+        self.assertIn('SubFactory.connect_with_inserter', ins.report())
+
+    def test_disabled(self):
+        sol = SolverWrapper.isolated()
+        f = Factory(sol=sol)
+        f.new_machine('g')
+        f.finalize_and_model()
+        self.assertIsNone(sol.instrumentation)
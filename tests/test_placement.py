@@ -0,0 +1,86 @@
+import unittest
+
+from factory_theory.factory import Factory
+from factory_theory.placement import anneal, place
+
+
+def _cells(positions, sizes, gap=0):
+    """ Cells of rectangles grown by gap // 2 and (gap + 1) // 2 on opposite sides, disjoint iff gap is kept """
+    res = []
+    for (x, y), (w, h) in zip(positions, sizes):
+        res.append({(x + i, y + j) for i in range(-(gap // 2), w + (gap + 1) // 2)
+                    for j in range(-(gap // 2), h + (gap + 1) // 2)})
+    return res
+
+
+class TestPlacement(unittest.TestCase):
+    def test_gap(self):
+        sizes = [(3, 3)] * 6 + [(5, 2), (1, 4)]
+        for gap in (0, 1, 2):
+            p = place(sizes, gap=gap)
+            cells = _cells(p.positions, sizes, gap)
+            self.assertEqual(sum(map(len, cells)), len(set().union(*cells)))
+            xs = [x for x, _ in p.positions]
+            self.assertEqual(p.width, max(x + w for x, (w, _) in zip(xs, sizes)) - min(xs))
+
+    def test_fixed(self):
+        sizes = [(3, 3)] * 4
+        p = place(sizes, fixed={2: (10, -5)})
+        self.assertEqual((10, -5), p.positions[2])
+        cells = _cells(p.positions, sizes, 1)
+        self.assertEqual(sum(map(len, cells)), len(set().union(*cells)))
+
+    def test_wire(self):
+        """ Chain of machines stays together """
+        sizes = [(3, 3)] * 5
+        nets = [(i, i + 1) for i in range(4)]
+        p = place(sizes, nets)
+        self.assertEqual(4 * 4, p.wire)
+
+    def test_anneal(self):
+        sizes = [(3, 3), (5, 5), (2, 6), (4, 2), (3, 3), (1, 1), (6, 2)]
+        nets = [(0, 4), (1, 6), (2, 5)]
+        greedy = place(sizes, nets)
+        p = anneal(sizes, nets, iters=100, seed=1)
+        self.assertLessEqual(p.cost, greedy.cost)
+        self.assertEqual(p, anneal(sizes, nets, iters=100, seed=1))
+
+
+class TestPlacementBound(unittest.TestCase):
+    @staticmethod
+    def _chain(f: Factory, n: int):
+        machines = [f.new_machine('g') for _ in range(n)]
+        for m1, m2 in zip(machines, machines[1:]):
+            b = f.new_segmented_belt(max_segs=2, bounded=True)
+            f.connect_with_inserter(m1, b)
+            f.connect_with_inserter(b, m2)
+        f.add(machines[0].pos == (0, 0))
+        return machines
+
+    def test_nets(self):
+        f = Factory()
+        self._chain(f, 3)
+        m = f.new_machine('r')
+        f.connect_with_inserter(f.buildings[0], m)
+        self.assertEqual([(0, 1), (0, 3), (1, 2)], f._building_nets())
+
+    def test_bound(self):
+        f = Factory()
+        self._chain(f, 3)
+        f.finalize()
+        placement = f.greedy_placement()
+        self.assertEqual((0, 0), placement.positions[0])
+        upper = f.placement_bound(f.area.size.x + f.area.size.y, placement)
+        self.assertGreaterEqual(upper, placement.width + placement.height)
+
+        f = Factory()
+        self._chain(f, 3)
+        probes = []
+        f.sol.on_probe = probes.append
+        try:
+            _, res = f.finalize_and_model(minimize_metric=f.area.size.x + f.area.size.y, upper='placement')
+        finally:
+            f.sol.on_probe = None
+        self.assertEqual(12, res)  # same optimum as without the bound, 4 probes
+        self.assertEqual(upper, probes[0].upper)
+        self.assertEqual(4, len(probes))
@@ -3,9 +3,9 @@ import z3
 
 from factory_theory.primitives import SOL, neighs, Abs, IntVal, \
     Point2D, Belt, \
-    SegmentedBelt, Segment, non_intersecting_segs, non_intersecting_seg_belt_diag_seg, \
+    SegmentedBelt, Segment, non_intersecting_segs, non_intersecting_seg_belts, non_intersecting_seg_belt_diag_seg, \
     Rectangle, \
-    Dir, dir_to_disp, Inserter
+    Dir, dir_to_disp, Inserter, SolverWrapper
 
 
 class TestBase(unittest.TestCase):
@@ -89,6 +89,116 @@ class TestSol(TestBase):
         self.assertEqual(dists[-1], 0)
         self.assertEqual(p1c, (2,3))
 
+    def test_assumption_shrinking(self):
+        SOL.set_backend('assumptions')
+        SOL.fresh_solver()
+        try:
+            p1 = Point2D()
+            dst = IntVal()
+            SOL.add(dst.v == Abs(p1.x - 2) + Abs(p1.y - 3) + 7)
+            probes = []
+            best = SOL.assumption_shrinking(dst, 0, 100, on_probe=probes.append)
+
+            self.assertEqual(7, best)
+            self.assertEqual((2, 3), p1.eval_as_tuple())
+            self.assertEqual('sat', probes[0].result)
+            self.assertTrue(all(p.elapsed >= 0 for p in probes))
+            # optimum must be proven by unsat probe right below it
+            self.assertTrue(any(p.result == 'unsat' and p.border == 6 for p in probes))
+            self.assertIsNotNone(SOL.model())
+            self.assertEqual(7, SOL.eval(dst.v))
+        finally:
+            SOL.set_backend('binary')
+            SOL.fresh_solver()
+
+    def test_shrinking_infeasible_upper(self):
+        """ Upper bound below the optimum only costs extra probes """
+        p1 = Point2D()
+        dst = IntVal()
+        SOL.add(dst.v == Abs(p1.x - 2) + Abs(p1.y - 3) + 7)
+        probes = []
+        self.assertEqual(7, SOL.binary_shrinking(dst, 0, 5, on_probe=probes.append))
+        self.assertEqual('unsat', probes[0].result)
+        self.assertEqual(7, SOL.eval(dst.v))
+
+        SOL.fresh_solver()
+        SOL.add(dst.v == Abs(p1.x - 2) + Abs(p1.y - 3) + 7)
+        self.assertEqual(7, SOL.assumption_shrinking(dst, 0, 5))
+
+    def test_shrinking_upper_is_optimum(self):
+        """ Upper bound equal to the optimum is checked within the bounds """
+        p1 = Point2D()
+        SOL.add(p1.x >= 5)
+        probes = []
+        self.assertEqual(5, SOL.binary_shrinking(p1.x, 0, 5, on_probe=probes.append))
+        self.assertEqual([(2, 'unsat'), (4, 'unsat'), (5, 'sat')], [(p.border, p.result) for p in probes])
+        self.assertEqual(5, SOL.eval(p1.x))
+
+        SOL.fresh_solver()
+        SOL.add(p1.x >= 5)
+        SOL.probes = []
+        self.assertEqual(5, SOL.assumption_shrinking(p1.x, 0, 5))
+        self.assertTrue(all(p.border is not None for p in SOL.probes))
+
+    def test_shrinking_unknown(self):
+        """ Timed out probe stops the search with the best value so far, it isn't taken for infeasibility """
+        def timing_out(sol, sat_checks):
+            check = sol._check
+
+            def checked(*assumptions):
+                nonlocal sat_checks
+                sat_checks -= 1
+                if sat_checks < 0:
+                    sol._model = None
+                    return z3.unknown
+                return check(*assumptions)
+            sol._check = checked
+
+        for shrinking in ('binary_shrinking', 'assumption_shrinking'):
+            sol = SolverWrapper.isolated()
+            x = z3.Int('x', ctx=sol.ctx)
+            sol.add(x >= 5, x <= 1000)
+            timing_out(sol, 1)
+            val = getattr(sol, shrinking)(x, 0, None, on_probe=lambda p: None)
+            self.assertEqual(['sat', 'unknown'], [p.result for p in sol.probes], shrinking)
+            self.assertEqual(sol.probes[0].value, val)
+            self.assertEqual(val, sol.eval(x))
+            self.assertFalse(sol.proven)
+
+            sol = SolverWrapper.isolated()
+            x = z3.Int('x', ctx=sol.ctx)
+            sol.add(x >= 5)
+            timing_out(sol, 0)
+            self.assertIsNone(getattr(sol, shrinking)(x, 0, 50, on_probe=lambda p: None))
+            self.assertEqual(['unknown'], [p.result for p in sol.probes], shrinking)
+            self.assertFalse(sol.proven)
+
+    def test_assumption_shrinking_unsat(self):
+        p1 = Point2D()
+        SOL.add(p1.x > 3, p1.x < 2)
+        self.assertIsNone(SOL.assumption_shrinking(p1.x, 0, None))
+
+    def test_portfolio(self):
+        from factory_theory.portfolio import Strategy
+
+        SOL.use_portfolio([Strategy('default', seed=0), Strategy('smt', seed=1), Strategy(logic='QF_LIA', seed=2)])
+        try:
+            sb = SegmentedBelt()
+            sb.fix_ends(source=(0, 0), sink=(5, 5))
+            ins = Inserter()
+            SOL.add(ins.sink() == sb.corner(1))
+
+            for d in SOL.shrinker_loop(sb.num_segs, init=4):
+                pass
+            self.assertEqual(2, d)
+            self.assertIsNotNone(SOL.last_strategy)
+
+            corners = sb.eval_corners()
+            self.assertEqual(3, len(corners))
+            self.assertEqual(corners[1], ins.sink().eval_as_tuple())
+        finally:
+            SOL.use_portfolio(None)
+
 
 class TestBelts(TestBase):
     def test_belt(self):
@@ -287,3 +397,102 @@ class TestInserters(TestBase):
             pass
         print('arm', in1.arm_len.eval())
         self.assertEqual(-8, res)
+
+
+class TestBoundedBelts(TestBase):
+    def test_bounded_belt(self):
+        belt = Belt(max_len=12)
+        belt.fix_ends(source=(1,1), sink=(5,5))
+        self.assertIsNotNone(SOL.model())
+
+        pts = belt.eval_points()
+        for i in range(len(pts)-1):
+            self.assertTrue(self.check_near(pts[i], pts[i+1]))
+        self.assertEqual(len(set(pts)), len(pts))
+        self.assertEqual(belt.source().eval_as_tuple(), (1, 1))
+        self.assertEqual(belt.sink().eval_as_tuple(), (5, 5))
+
+    def test_bounded_belt_shrink(self):
+        belt = Belt(max_len=12)
+        belt.fix_ends(source=(1,1), sink=(5,5))
+        lens = []
+        for l in SOL.shrinker_loop(belt.belt_len):
+            lens.append(l)
+
+        self.assertEqual(lens[-1], 9)
+
+    def test_bounded_belt_too_short(self):
+        belt = Belt(max_len=8)
+        belt.fix_ends(source=(1,1), sink=(5,5))
+        self.assertIsNone(SOL.model())
+
+    def test_bounded_two_seg_belt(self):
+        sbelt = SegmentedBelt(max_segs=3, bounded=True)
+        sbelt.fix_ends(source=(10, 10), sink=(15, 15))
+        SOL.add(sbelt.num_segs == 2)
+        self.assertIsNotNone(SOL.model())
+
+        corners = sbelt.eval_corners()
+        self.assertEqual(corners[0], (10, 10))
+        self.assertTrue(corners[1] in [(15, 10), (10, 15)])
+        self.assertEqual(corners[2], (15, 15))
+
+    def test_bounded_seg_belt_shrink(self):
+        sbelt = SegmentedBelt(max_segs=10, bounded=True)
+        sbelt.fix_ends(source=(10,10), sink=(15,15))
+        seg_nums = []
+        for l in SOL.shrinker_loop(sbelt.num_segs):
+            seg_nums.append(l)
+        self.assertEqual(seg_nums[-1], 2)
+
+    def test_bounded_segbelt_and_dseg(self):
+        sb = SegmentedBelt(max_segs=6, bounded=True)
+        SOL.add(sb.corner(0) == Point2D(0, 0))
+        SOL.add(sb.corner(1) == Point2D(10, 0))
+        SOL.add(sb.sink() == Point2D(20, 0))
+        SOL.add(sb.num_segs >= 2)
+        ds = Segment(Point2D(12, 0), Point2D(15, 3), is_diag=True)
+        SOL.add(non_intersecting_seg_belt_diag_seg(sb, ds))
+        d = None
+        for d in SOL.shrinker_loop(sb.num_segs):
+            pass
+        self.assertEqual(4, d)
+
+    def test_bounded_seg_belt_enumerate(self):
+        sb = SegmentedBelt(max_segs=4, bounded=True)
+        SOL.add(sb.source() == (0,0))
+        SOL.add(sb.sink() == (5,5))
+
+        for d in SOL.shrinker_loop(sb.len()):
+            pass
+        self.assertEqual(11, d)
+
+        pts = list(sb.enumerate_points())
+        self.assertEqual(11, len(pts))
+        for p0, p in zip(pts, pts[1:]):
+            self.assertTrue(self.check_near(p0.as_tuple(), p.as_tuple()))
+
+    def test_mixed_seg_belts(self):
+        """ bounded and quantified belts can be combined in one problem """
+        sb1 = SegmentedBelt(max_segs=3, bounded=True)
+        sb2 = SegmentedBelt()
+        sb1.fix_ends((0, 5), (10, 5))
+        sb2.fix_ends((5, 0), (5, 10))
+        SOL.add(sb2.num_segs <= 3)
+        SOL.add(non_intersecting_seg_belts(sb1, sb2))
+        self.assertIsNotNone(SOL.model())
+
+        pts1 = set(p.as_tuple() for p in sb1.enumerate_points())
+        pts2 = set(p.as_tuple() for p in sb2.enumerate_points())
+        self.assertEqual(set(), pts1 & pts2)
+
+    def test_mixed_seg_belts_one_quantifier(self):
+        sb1 = SegmentedBelt(max_segs=3, bounded=True)
+        sb2 = SegmentedBelt()
+        for c in (non_intersecting_seg_belts(sb1, sb2), non_intersecting_seg_belts(sb2, sb1)):
+            self.assertTrue(z3.is_quantifier(c))
+            self.assertFalse(z3.is_quantifier(c.body().arg(1)))  # bounded belt unrolled inside
+
+        with self.assertRaises(ValueError):
+            sb2.len()
+        self.assertIsInstance(sb2.len(2), z3.ArithRef)
@@ -0,0 +1,112 @@
+import random
+import unittest
+
+import numpy as np
+
+from cognition.entity_parsing import entity_block
+from cognition.resource_analysis import patches, tiles, label, PATCH_DTYPE
+
+
+def _ents(cells, name='iron-ore', amount=lambda x, y: 10):
+    return [{'position': {'x': x + 0.5, 'y': y + 0.5}, 'type': 'resource', 'name': name, 'amount': amount(x, y)}
+            for x, y in cells]
+
+
+def _rect(x1, y1, x2, y2):
+    return [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+
+
+def _components(cells, connectivity):
+    """ Reference labelling by flood fill """
+    cells, res = set(cells), []
+    steps = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    if connectivity == 8:
+        steps += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+    while cells:
+        todo = [cells.pop()]
+        comp = set(todo)
+        while todo:
+            x, y = todo.pop()
+            for dx, dy in steps:
+                if (x + dx, y + dy) in cells:
+                    cells.remove((x + dx, y + dy))
+                    comp.add((x + dx, y + dy))
+                    todo.append((x + dx, y + dy))
+        res.append(frozenset(comp))
+    return set(res)
+
+
+class TestResourceAnalysis(unittest.TestCase):
+    def test_label(self):
+        rnd = random.Random(0)
+        for density in (0.2, 0.5, 0.7):
+            cells = [(x, y) for x in range(1, 60) for y in range(1, 40) if rnd.random() < density]
+            t = tiles(_ents(cells))
+            for connectivity in (4, 8):
+                labels = label(t, connectivity)
+                got = {}
+                for x, y, lab in zip(t.x.tolist(), t.y.tolist(), labels.tolist()):
+                    got.setdefault(lab, set()).add((x, y))
+                self.assertEqual(_components(cells, connectivity), set(map(frozenset, got.values())))
+
+    def test_resources_apart(self):
+        """ Touching tiles of different resources are different patches """
+        t = tiles(_ents(_rect(1, 1, 3, 3)) + _ents(_rect(4, 1, 5, 3), name='copper-ore'))
+        self.assertEqual(2, len(set(label(t).tolist())))
+
+    def test_patches(self):
+        cells = _rect(1, 1, 10, 5) + [(11, 3)] + _rect(2, 6, 4, 7)  # 50 + 1 + 6 tiles
+        ents = _ents(cells, amount=lambda x, y: x) + _ents(_rect(30, 30, 31, 31), name='coal', amount=lambda x, y: 50)
+        ents += _ents([(60, 60)])
+        ents += _ents([(1, 1)], amount=lambda x, y: 5)  # same tile again
+        p = patches(ents)
+        self.assertEqual(PATCH_DTYPE, p.dtype)
+        self.assertEqual(['iron-ore', 'coal', 'iron-ore'], p['name'].tolist())  # biggest amount first
+
+        iron = p[0]
+        self.assertEqual(57, iron['tiles'])
+        self.assertEqual(sum(x for x, _ in cells) + 5, iron['amount'])
+        self.assertEqual((1, 1, 11, 7), (iron['x_min'], iron['y_min'], iron['x_max'], iron['y_max']))
+        rect = _rect(iron['rect_x1'], iron['rect_y1'], iron['rect_x2'], iron['rect_y2'])
+        self.assertTrue(set(rect) <= set(cells))
+        self.assertEqual((1, 1, 10, 5), (iron['rect_x1'], iron['rect_y1'], iron['rect_x2'], iron['rect_y2']))
+        self.assertEqual(len(rect), iron['rect_tiles'])
+        self.assertEqual(sum(x for x, _ in rect) + 5, iron['rect_amount'])
+
+        coal = p[1]
+        self.assertEqual((4, 200, 30.5, 30.5), (coal['tiles'], coal['amount'], coal['cx'], coal['cy']))
+        self.assertEqual((1, 60, 60), (p[2]['rect_tiles'], p[2]['rect_x1'], p[2]['rect_y2']))
+
+        self.assertEqual(['iron-ore', 'coal'], patches(ents, min_tiles=2)['name'].tolist())
+        self.assertEqual(0, len(patches([])))
+
+    def test_patches_apart(self):
+        """ Center of two patches is in empty ground, entity_block finds nothing there """
+        ents = _ents(_rect(0, 0, 9, 9)) + _ents(_rect(40, 0, 49, 9))
+        b = entity_block(ents, 'iron-ore')
+        self.assertEqual((24, 4, 24, 4), (b.p1.x, b.p1.y, b.p2.x, b.p2.y))
+
+        arr = np.array([(e['position']['x'], e['position']['y'], e['amount'], e['name']) for e in ents],
+                       dtype=[('x', float), ('y', float), ('amount', int), ('name', 'U16')])
+        p = patches(arr)
+        self.assertEqual([100, 100], p['rect_tiles'].tolist())
+        self.assertEqual({0, 40}, set(p['rect_x1'].tolist()))
+
+    def test_negative_coordinates(self):
+        """ Tiles are floored, a patch around the origin keeps all its tiles """
+        ents = _ents(_rect(-3, -3, 2, 2)) + _ents(_rect(-20, -12, -17, -10), name='coal')
+        arr = np.array([(e['position']['x'], e['position']['y'], e['amount'], e['name']) for e in ents],
+                       dtype=[('x', float), ('y', float), ('amount', int), ('name', 'U16')])
+        for p in (patches(ents), patches(arr)):
+            self.assertEqual(['iron-ore', 'coal'], p['name'].tolist())
+            iron, coal = p
+            self.assertEqual((36, 360), (iron['tiles'], iron['amount']))
+            self.assertEqual((-3, -3, 2, 2), (iron['x_min'], iron['y_min'], iron['x_max'], iron['y_max']))
+            self.assertEqual((-3, -3, 2, 2), (iron['rect_x1'], iron['rect_y1'], iron['rect_x2'], iron['rect_y2']))
+            self.assertEqual((36, -0.5, -0.5), (iron['rect_tiles'], iron['cx'], iron['cy']))
+            self.assertEqual((-20, -12, -17, -10), (coal['x_min'], coal['y_min'], coal['x_max'], coal['y_max']))
+            self.assertEqual(12, coal['rect_tiles'])
+
+
+if __name__ == '__main__':
+    unittest.main()
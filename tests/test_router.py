@@ -0,0 +1,78 @@
+import unittest
+
+from factory_theory.factory import Factory
+from factory_theory.layout import extract_layout
+from factory_theory.primitives import SOL, SegmentedBelt, non_intersecting_seg_belts
+from factory_theory.router import RoutingError, bounds_around, fix_belt, hint_belt, obstacles_from_layout, \
+    path_to_corners, route, route_all
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self) -> None:
+        SOL.fresh_solver()
+
+    def test_route_around_wall(self):
+        wall = {(2, y) for y in range(0, 5)}
+        path = route([(0, 2)], [(4, 2)], wall, (-1, -1, 6, 6))
+        self.assertEqual((0, 2), path[0])
+        self.assertEqual((4, 2), path[-1])
+        self.assertFalse(set(path) & wall)
+        self.assertEqual(11, len(path))  # around the wall end at y=5
+        self.assertEqual([(0, 2), (0, 5), (4, 5), (4, 2)], path_to_corners(path))
+
+    def test_unreachable(self):
+        wall = {(2, y) for y in range(-1, 7)}
+        self.assertIsNone(route([(0, 2)], [(4, 2)], wall, (-1, -1, 6, 6)))
+
+    def test_multi_source(self):
+        path = route([(0, 0), (0, 9)], [(5, 8), (6, 9)], set(), (0, 0, 10, 10))
+        self.assertEqual([(0, 9), (6, 9)], path_to_corners(path))
+
+    def test_three_crossing_belts(self):
+        """ Same task as TestDemoTasks.test_three_seg_belts, routed classically and only checked by z3 """
+        ends = [((0, 0), (20, 20)), ((0, 10), (20, 10)), ((0, 20), (20, 0))]
+        paths = route_all([([s], [t]) for s, t in ends], set(), (-3, -3, 23, 23))
+        self.assertFalse(set(paths[0]) & set(paths[1]) or set(paths[0]) & set(paths[2]) or set(paths[1]) & set(paths[2]))
+
+        corners = [path_to_corners(p) for p in paths]
+        belts = [SegmentedBelt(max_segs=len(c) - 1, bounded=True) for c in corners]
+        for b, c in zip(belts, corners):
+            SOL.add(fix_belt(b, c))
+        for i in range(3):
+            for j in range(i + 1, 3):
+                SOL.add(non_intersecting_seg_belts(belts[i], belts[j]))
+        self.assertIsNotNone(SOL.model())
+        self.assertEqual(corners, [b.eval_corners() for b in belts])
+
+    def test_congestion_unsolvable(self):
+        # single corridor can't hold two belts
+        walls = {(x, y) for x in range(1, 5) for y in (-1, 1)}
+        with self.assertRaises(RoutingError):
+            route_all([([(0, 0)], [(5, 0)]), ([(1, 0)], [(4, 0)])], walls, (0, -1, 5, 1), max_iters=5)
+
+    def test_route_between_solved_buildings(self):
+        f = Factory()
+        m1 = f.new_machine('g')
+        m2 = f.new_machine('r')
+        f.add(m1.pos == (0, 0))
+        f.add(m2.pos == (10, 4))
+        f.finalize_and_model()
+        blocked = obstacles_from_layout(extract_layout(f))
+
+        path = route([(3, 1)], [(9, 5)], blocked, bounds_around(blocked))
+        self.assertEqual(11, len(path))
+        self.assertFalse(set(path) & blocked)
+
+    def test_hints(self):
+        SOL.set_backend('optimize')
+        try:
+            SOL.fresh_solver()
+            b = SegmentedBelt(max_segs=3, bounded=True)
+            self.assertTrue(hint_belt(b, [(0, 0), (0, 4), (3, 4)]))
+            b.fix_ends((0, 0), (3, 4))
+            self.assertIsNotNone(SOL.model())
+            self.assertEqual([(0, 0), (0, 4), (3, 4)], b.eval_corners())
+        finally:
+            SOL.set_backend('binary')
+            SOL.fresh_solver()
+        self.assertFalse(hint_belt(SegmentedBelt(), [(0, 0), (1, 0)]))
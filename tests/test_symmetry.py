@@ -0,0 +1,63 @@
+import unittest
+
+import z3
+
+from factory_theory.factory import Factory
+from factory_theory.primitives import IntVal
+from factory_theory.symmetry import Symmetries, lex_leq, swap
+
+
+class TestSymmetries(unittest.TestCase):
+    def test_invariance(self):
+        x1, y1, x2, y2, z = z3.Ints('x1 y1 x2 y2 z')
+        syms = Symmetries([z3.And(x1 + y1 > 0, y2 + x2 > 0), z3.Or(x1 < x2, x2 < x1), z == x1 + x2])
+        self.assertTrue(syms.invariant(swap([x1, y1], [x2, y2])))
+        self.assertFalse(syms.invariant(swap([x1, y1], [y2, x2])))  # disjunction turns into one about y
+        self.assertFalse(Symmetries([x1 < x2]).invariant(swap([x1], [x2])))
+        self.assertIsNone(swap([x1, 3], [x2, 4]))
+
+    def test_lex_leq(self):
+        x1, y1, x2, y2 = z3.Ints('x1 y1 x2 y2')
+        s = z3.Solver()
+        s.add(lex_leq([x1, y1], [x2, y2]), x1 == x2, y1 == 3)
+        s.add(y2 < 3)
+        self.assertEqual(z3.unsat, s.check())
+
+
+class TestSymmetryBreaking(unittest.TestCase):
+    @staticmethod
+    def _star(f: Factory, n: int):
+        hub = f.new_machine('r')
+        satellites = [f.new_machine('g') for _ in range(n)]
+        for m in satellites:
+            f.connect_with_inserter(m, hub)
+        return hub, satellites
+
+    def test_classes(self):
+        f = Factory()
+        f.break_symmetries = True
+        hub, satellites = self._star(f, 4)
+        f.add(satellites[0].pos.x < hub.pos.x)  # singles out the first one
+        f.new_machine('b')  # same size, but without connections
+        f.finalize()
+        self.assertEqual(2, f.add_symmetry_breaking([f.area.size.x + f.area.size.y]))
+        self.assertEqual([satellites[1:]], f.symmetry_classes)
+
+        self.assertEqual(0, f.add_symmetry_breaking([satellites[2].pos.x]))  # objective distinguishes them all
+
+    def test_same_optimum(self):
+        results = []
+        for sym in (False, True):
+            f = Factory()
+            f.break_symmetries = sym
+            self._star(f, 3)
+            metric = IntVal()
+            f.add(metric.v == f.area.size.x + f.area.size.y)
+            f.sol.on_probe = lambda p: None
+            _, res = f.finalize_and_model(metric)
+            results.append(res)
+            if sym:
+                self.assertEqual(1, len(f.symmetry_classes))
+                xs = [m.pos.eval_as_tuple() for m in f.symmetry_classes[0]]
+                self.assertEqual(sorted(xs), xs)
+        self.assertEqual(results[0], results[1])